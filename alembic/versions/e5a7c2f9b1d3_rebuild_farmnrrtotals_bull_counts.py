@@ -0,0 +1,27 @@
+"""Rebuild FarmNrrTotals With Bull Counts By First Insemination Date
+
+Revision ID: e5a7c2f9b1d3
+Revises: d81e6a04c7b9
+Create Date: 2026-10-18 13:02:41.318204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5a7c2f9b1d3'
+down_revision: Union[str, None] = 'd81e6a04c7b9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # The bull counts are now kept per first insemination date.  The totals are derived from the inseminations, so
+    # they are removed, and rebuilt in the new format when the app starts.  (See rebuild_farm_nrr_totals_if_missing.)
+    op.execute("DELETE FROM farmnrrtotals")
+
+
+def downgrade() -> None:
+    op.execute("DELETE FROM farmnrrtotals")
@@ -1,3 +1,4 @@
+import io
 from enum import Enum
 from pathlib import Path
 
@@ -20,7 +21,137 @@ class SlideLayout(Enum):
     PICTURE_WITH_CAPTION = 8
 
 
-def create_powerpoint(data: dict, file_path: Path, image_file_paths):
+# Charts embedded in the presentation as PNG files, by their field name in ImageFilePaths.
+powerpoint_chart_names = (
+    "milk_solids_histogram",
+    "milk_solids_by_age_chart",
+    "liveweight_milk_solids_chart",
+    "efficiency_milk_solids_chart",
+    "scc_histogram",
+    "milk_solids_vs_scc_chart",
+    "efficiency_vs_scc_chart",
+    "liveweight_histogram",
+    "cow_age_chart",
+)
+
+
+# Names of the shapes in the master presentation that are filled in for each report.
+farm_name_shape_name = "farm_name"
+summary_table_shape_name = "summary_table"
+chart_shape_name_prefix = "chart:"  # Followed by the chart name, eg. "chart:scc_histogram".
+
+# Rows of the summary table, by their key in the summary statistics.
+summary_table_rows = {
+    "one_and_two": 2, "three_to_eight": 3, "nine_plus": 4, "total": 5,
+    "one": 8, "two": 9,
+}
+
+summary_table_field_order = (
+    "lactation_description", "num_cows", "pct_of_herd", "milk_volume", "avg_milk_volume", "milk_solids",
+    "avg_milk_solids", "days_in_milk", "avg_weight", "avg_fat_pct", "avg_protein_pct",
+)
+
+logo_image_path = Path(__file__).parent.joinpath("Blockwise_Services_logo.png")
+
+# The master presentation as a .pptx file, built when first needed.  (See get_master_presentation.)
+_master_presentation_bytes: bytes | None = None
+
+
+def create_powerpoint(
+        data: dict,
+        file_path: Path | io.BytesIO,
+        image_file_paths,
+        farm_name: str = "Farm Name Here",
+        season: str = "Spring 2026",
+):
+    """
+    A copy of the master presentation, with the farm name, season, summary table and charts filled in.
+    """
+    prs = Presentation(io.BytesIO(get_master_presentation()))
+
+    for slide in prs.slides:
+        for shape in slide.shapes:
+            if shape.name == farm_name_shape_name:
+                paragraphs = shape.text_frame.paragraphs
+                paragraphs[0].runs[0].text = farm_name
+                paragraphs[1].runs[0].text = season
+            elif shape.name == summary_table_shape_name:
+                fill_summary_table(table=shape.table, data=data)
+            elif shape.name.startswith(chart_shape_name_prefix):
+                chart_name = shape.name.removeprefix(chart_shape_name_prefix)
+                chart_file_path = getattr(image_file_paths, chart_name).with_suffix(".png")
+                replace_picture_image(slide=slide, picture=shape, image_file_path=chart_file_path)
+
+    prs.save(file_path)
+
+
+def get_master_presentation() -> bytes:
+    """
+    Built once per process.  Every part of the presentation that does not depend on the herd (the logo, fonts and
+    colours of all the text, the table headers, and the decorations) is in the master presentation.
+    """
+    global _master_presentation_bytes
+
+    if _master_presentation_bytes is None:
+        master_presentation_file = io.BytesIO()
+        build_master_presentation().save(master_presentation_file)
+        _master_presentation_bytes = master_presentation_file.getvalue()
+
+    return _master_presentation_bytes
+
+
+def fill_summary_table(table, data: dict):
+    """
+    The cells are already formatted in the master presentation, so only the text is added.  Then the columns are
+    made narrower, to fit the longest text in each, if possible.
+    """
+    running_max_col_widths = {
+        field: calc_text_width(text=table.cell(1, idx).text, font_size=10)
+        for idx, field in enumerate(summary_table_field_order)
+    }
+
+    for group, row_idx in summary_table_rows.items():
+        for idx, field in enumerate(summary_table_field_order):
+            data_value = str(data[group][field])
+            table.cell(row_idx, idx).text_frame.paragraphs[0].add_run().text = data_value
+
+            data_value_width = calc_text_width(text=data_value, font_size=10)
+            if data_value_width > running_max_col_widths[field]:
+                if row_idx < 7:
+                    running_max_col_widths[field] = data_value_width
+                else:
+                    running_max_col_widths[field] = len(data_value)
+
+    # Shrink column widths if possible.
+    default_column_width = table.columns[0].width
+
+    for idx, field in enumerate(summary_table_field_order):
+        col_width = running_max_col_widths[field]
+        if col_width < default_column_width:
+            table.columns[idx].width = col_width
+
+
+def replace_picture_image(slide, picture, image_file_path: Path):
+    """
+    Show another image in a picture shape, keeping its position, width and place in the z-order.  The height is
+    scaled to the image, as by add_picture() with only a width, and the description (alt text) is the image's file
+    name, as add_picture() gives it.
+    """
+    image_part, rId = slide.part.get_or_add_image_part(str(image_file_path))
+
+    old_rId = picture._element.blip_rId
+    picture._element.blipFill.blip.rEmbed = rId
+    slide.part.drop_rel(old_rId)
+    picture._element.nvPicPr.cNvPr.set("descr", image_file_path.name)
+
+    picture.height = image_part.scale(picture.width, None)[1]
+
+
+def build_master_presentation() -> Presentation:
+    """
+    The presentation without the data of a herd.  The charts are placeholder pictures (of the logo), and the data
+    cells of the summary table are empty.
+    """
     prs = Presentation()
 
     title_slide_layout = prs.slide_layouts[SlideLayout.TITLE_SLIDE.value]
@@ -38,10 +169,10 @@ def create_powerpoint(data: dict, file_path: Path, image_file_paths):
 
     title_slide = prs.slides.add_slide(slide_layout=title_slide_layout)
 
-    logo_image_path = Path(__file__).parent.joinpath("Blockwise_Services_logo.png")
     logo = title_slide.shapes.add_picture(str(logo_image_path), left=Cm(3), top=Cm(0.5), height=Cm(10))
 
     title = title_slide.placeholders[0]
+    title.name = farm_name_shape_name
     subtitle = title_slide.placeholders[1]
     title.top = Cm(10.5)
     subtitle.top = Cm(15)
@@ -180,6 +311,7 @@ def create_powerpoint(data: dict, file_path: Path, image_file_paths):
     run.font.color.rgb = BLOCKWISE_GREEN
 
     shape_with_table = slide_2.shapes.add_table(rows=10, cols=11, left=Cm(2), top=Cm(4), width=Cm(26), height=Cm(8))
+    shape_with_table.name = summary_table_shape_name
     table = shape_with_table.table
 
     top_cell = table.cell(0, 0)
@@ -200,11 +332,7 @@ def create_powerpoint(data: dict, file_path: Path, image_file_paths):
         "avg_fat_pct": "Avg Fat %",
         "avg_protein_pct": "Avg Protein %",
     }
-    running_max_col_widths = {
-        key: calc_text_width(text=val, font_size=10) for key, val in field_name_to_column_name.items()
-    }
-    field_order = ("lactation_description", "num_cows", "pct_of_herd", "milk_volume", "avg_milk_volume", "milk_solids",
-                   "avg_milk_solids", "days_in_milk", "avg_weight", "avg_fat_pct", "avg_protein_pct")
+    field_order = summary_table_field_order
 
     for idx, field in enumerate(field_order):
         table.cell(1, idx).text = field_name_to_column_name[field]
@@ -217,47 +345,21 @@ def create_powerpoint(data: dict, file_path: Path, image_file_paths):
         table.cell(7, idx).text_frame.paragraphs[0].font.bold = True
         table.cell(7, idx).text_frame.paragraphs[0].alignment = PP_ALIGN.CENTER
 
-    group_order = ("one_and_two", "three_to_eight", "nine_plus", "total")
-    for row_idx, group in enumerate(group_order):
+    # Data cells are formatted here, and their text is added by fill_summary_table().
+    for group, row_idx in summary_table_rows.items():
         for idx, field in enumerate(field_order):
-            data_value = str(data[group][field])
-            table.cell(2 + row_idx, idx).text = data_value
-            table.cell(2 + row_idx, idx).text_frame.paragraphs[0].font.size = Pt(10)
-            table.cell(2 + row_idx, idx).text_frame.paragraphs[0].alignment = PP_ALIGN.CENTER
+            table.cell(row_idx, idx).text_frame.paragraphs[0].font.size = Pt(10)
+            table.cell(row_idx, idx).text_frame.paragraphs[0].alignment = PP_ALIGN.CENTER
             if group == "total":
-                table.cell(2 + row_idx, idx).text_frame.paragraphs[0].font.bold = True
-
-            data_value_width = calc_text_width(text=data_value, font_size=10)
-            if data_value_width > running_max_col_widths[field]:
-                running_max_col_widths[field] = data_value_width
-
-    group_order = ("one", "two")
-    for row_idx, group in enumerate(group_order):
-        for idx, field in enumerate(field_order):
-            data_value = str(data[group][field])
-            table.cell(8 + row_idx, idx).text = data_value
-            table.cell(8 + row_idx, idx).text_frame.paragraphs[0].font.size = Pt(10)
-            table.cell(8 + row_idx, idx).text_frame.paragraphs[0].alignment = PP_ALIGN.CENTER
-
-            data_value_width = calc_text_width(text=data_value, font_size=10)
-            if data_value_width > running_max_col_widths[field]:
-                running_max_col_widths[field] = len(data_value)
-
-    # Shrink column widths if possible.
-    default_column_width = table.columns[0].width
-
-    for idx, field in enumerate(field_order):
-        col_width = running_max_col_widths[field]
-        if col_width < default_column_width:
-            table.columns[idx].width = col_width
+                table.cell(row_idx, idx).text_frame.paragraphs[0].font.bold = True
 
     ##########################################################################################
     # Production
 
     slide = prs.slides.add_slide(slide_layout=title_only_layout)
 
-    chart_file_path = str(image_file_paths.milk_solids_histogram.with_suffix(".png"))
-    chart = slide.shapes.add_picture(chart_file_path, left=Cm(2), top=Cm(4), width=Cm(15))
+    chart = slide.shapes.add_picture(str(logo_image_path), left=Cm(2), top=Cm(4), width=Cm(15))
+    chart.name = chart_shape_name_prefix + "milk_solids_histogram"
 
     title = slide.placeholders[0]
     run = title.text_frame.paragraphs[0].add_run()
@@ -284,8 +386,8 @@ def create_powerpoint(data: dict, file_path: Path, image_file_paths):
 
     slide = prs.slides.add_slide(slide_layout=title_only_layout)
 
-    chart_file_path = str(image_file_paths.milk_solids_by_age_chart.with_suffix(".png"))
-    chart = slide.shapes.add_picture(chart_file_path, left=Cm(2), top=Cm(4), width=Cm(15))
+    chart = slide.shapes.add_picture(str(logo_image_path), left=Cm(2), top=Cm(4), width=Cm(15))
+    chart.name = chart_shape_name_prefix + "milk_solids_by_age_chart"
 
     title = slide.placeholders[0]
     run = title.text_frame.paragraphs[0].add_run()
@@ -312,8 +414,8 @@ def create_powerpoint(data: dict, file_path: Path, image_file_paths):
 
     slide = prs.slides.add_slide(slide_layout=title_only_layout)
 
-    chart_file_path = str(image_file_paths.liveweight_milk_solids_chart.with_suffix(".png"))
-    chart = slide.shapes.add_picture(chart_file_path, left=Cm(2), top=Cm(4), width=Cm(15))
+    chart = slide.shapes.add_picture(str(logo_image_path), left=Cm(2), top=Cm(4), width=Cm(15))
+    chart.name = chart_shape_name_prefix + "liveweight_milk_solids_chart"
 
     title = slide.placeholders[0]
     run = title.text_frame.paragraphs[0].add_run()
@@ -354,8 +456,8 @@ def create_powerpoint(data: dict, file_path: Path, image_file_paths):
 
     slide = prs.slides.add_slide(slide_layout=title_only_layout)
 
-    chart_file_path = str(image_file_paths.efficiency_milk_solids_chart.with_suffix(".png"))
-    chart = slide.shapes.add_picture(chart_file_path, left=Cm(2), top=Cm(4), width=Cm(15))
+    chart = slide.shapes.add_picture(str(logo_image_path), left=Cm(2), top=Cm(4), width=Cm(15))
+    chart.name = chart_shape_name_prefix + "efficiency_milk_solids_chart"
 
     title = slide.placeholders[0]
     run = title.text_frame.paragraphs[0].add_run()
@@ -404,8 +506,8 @@ def create_powerpoint(data: dict, file_path: Path, image_file_paths):
 
     slide = prs.slides.add_slide(slide_layout=title_only_layout)
 
-    chart_file_path = str(image_file_paths.scc_histogram.with_suffix(".png"))
-    chart = slide.shapes.add_picture(chart_file_path, left=Cm(2), top=Cm(4), width=Cm(15))
+    chart = slide.shapes.add_picture(str(logo_image_path), left=Cm(2), top=Cm(4), width=Cm(15))
+    chart.name = chart_shape_name_prefix + "scc_histogram"
 
     title = slide.placeholders[0]
     run = title.text_frame.paragraphs[0].add_run()
@@ -432,8 +534,8 @@ def create_powerpoint(data: dict, file_path: Path, image_file_paths):
 
     slide = prs.slides.add_slide(slide_layout=title_only_layout)
 
-    chart_file_path = str(image_file_paths.milk_solids_vs_scc_chart.with_suffix(".png"))
-    chart = slide.shapes.add_picture(chart_file_path, left=Cm(2), top=Cm(4), width=Cm(15))
+    chart = slide.shapes.add_picture(str(logo_image_path), left=Cm(2), top=Cm(4), width=Cm(15))
+    chart.name = chart_shape_name_prefix + "milk_solids_vs_scc_chart"
 
     title = slide.placeholders[0]
     run = title.text_frame.paragraphs[0].add_run()
@@ -460,8 +562,8 @@ def create_powerpoint(data: dict, file_path: Path, image_file_paths):
 
     slide = prs.slides.add_slide(slide_layout=title_only_layout)
 
-    chart_file_path = str(image_file_paths.efficiency_vs_scc_chart.with_suffix(".png"))
-    chart = slide.shapes.add_picture(chart_file_path, left=Cm(2), top=Cm(4), width=Cm(15))
+    chart = slide.shapes.add_picture(str(logo_image_path), left=Cm(2), top=Cm(4), width=Cm(15))
+    chart.name = chart_shape_name_prefix + "efficiency_vs_scc_chart"
 
     title = slide.placeholders[0]
     run = title.text_frame.paragraphs[0].add_run()
@@ -489,8 +591,8 @@ def create_powerpoint(data: dict, file_path: Path, image_file_paths):
 
     slide = prs.slides.add_slide(slide_layout=title_only_layout)
 
-    chart_file_path = str(image_file_paths.liveweight_histogram.with_suffix(".png"))
-    chart = slide.shapes.add_picture(chart_file_path, left=Cm(2), top=Cm(4), width=Cm(15))
+    chart = slide.shapes.add_picture(str(logo_image_path), left=Cm(2), top=Cm(4), width=Cm(15))
+    chart.name = chart_shape_name_prefix + "liveweight_histogram"
 
     title = slide.placeholders[0]
     run = title.text_frame.paragraphs[0].add_run()
@@ -518,8 +620,8 @@ def create_powerpoint(data: dict, file_path: Path, image_file_paths):
 
     slide = prs.slides.add_slide(slide_layout=title_only_layout)
 
-    chart_file_path = str(image_file_paths.cow_age_chart.with_suffix(".png"))
-    chart = slide.shapes.add_picture(chart_file_path, left=Cm(2), top=Cm(4), width=Cm(15))
+    chart = slide.shapes.add_picture(str(logo_image_path), left=Cm(2), top=Cm(4), width=Cm(15))
+    chart.name = chart_shape_name_prefix + "cow_age_chart"
 
     title = slide.placeholders[0]
     run = title.text_frame.paragraphs[0].add_run()
@@ -564,7 +666,7 @@ def create_powerpoint(data: dict, file_path: Path, image_file_paths):
         triangle.fill.solid()
         triangle.fill.fore_color.rgb = BLOCKWISE_GREEN
 
-    prs.save(file_path)
+    return prs
 
 
 def calc_text_width(text: str, font_size: int) -> int:
@@ -1,15 +1,22 @@
 from decimal import Decimal
 from pathlib import Path
+from typing import Iterable
 
 from xlsxwriter import Workbook
 
 
-def create_excel_spreadsheet(cow_dict: dict, xlsx_file_path: Path, csv_file_path: Path):
+def create_excel_spreadsheet(cow_dict: dict, xlsx_file_path: Path, output_rows: Iterable[list[str]]):
+    """
+    'output_rows' are the rows of the output CSV file, header first.  (See iter_output_rows.)
 
-    workbook = Workbook(filename=xlsx_file_path)
+    The workbook is written in constant memory mode: each row is written to a temporary file as soon as the next
+    row is started, so every worksheet must be written in row order, and column widths are worked out as the rows
+    are written.
+    """
+    workbook = Workbook(filename=xlsx_file_path, options={"constant_memory": True})
 
     #################################################################################################
-    # Data Summary copied from CSV file that has already been constructed.
+    # Data Summary, the same as the output CSV file.
     herd_companion = workbook.add_worksheet("Herd Companion +")
 
     data_group_format = workbook.add_format()
@@ -38,24 +45,19 @@ def create_excel_spreadsheet(cow_dict: dict, xlsx_file_path: Path, csv_file_path
         herd_companion.write(0, col, "", stats_group_format)
     herd_companion.write(0, 23, "Calculated based on input data", stats_group_format)
 
-    row = 1
+    output_rows = iter(output_rows)
 
-    with open(csv_file_path) as f:
-        header = f.readline()
-        header_fields = [x.strip() for x in header.split(",")]
-        for col, field in enumerate(header_fields):
-            if col < 21:
-                cell_format = data_header_format
-            else:
-                cell_format = stats_header_format
-            herd_companion.write(row, col, field, cell_format)
-        row += 1
-
-        for line in f:
-            values = [x.strip() for x in line.split(",")]
-            for col, value in enumerate(values):
-                herd_companion.write(row, col, value)
-            row += 1
+    header_fields = next(output_rows)
+    for col, field in enumerate(header_fields):
+        if col < 21:
+            cell_format = data_header_format
+        else:
+            cell_format = stats_header_format
+        herd_companion.write(1, col, field, cell_format)
+
+    for row, values in enumerate(output_rows, start=2):
+        for col, value in enumerate(values):
+            herd_companion.write(row, col, value)
 
     herd_companion.set_column(first_col=0, last_col=32, width=15)
 
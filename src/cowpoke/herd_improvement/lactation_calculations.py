@@ -1,13 +1,20 @@
 import dataclasses
 import datetime
+import io
+import json
 from decimal import Decimal
 from pathlib import Path
+from typing import Iterator
 
-import matplotlib.pyplot as plt
 import seaborn as sns
+from matplotlib.figure import Figure
 
 from src.cowpoke.herd_improvement.create_reports import create_excel_spreadsheet
-from src.cowpoke.herd_improvement.create_powerpoint import create_powerpoint
+from src.cowpoke.herd_improvement.create_powerpoint import create_powerpoint, powerpoint_chart_names
+from src.cowpoke.herd_improvement.lactation_statistics_numpy import calculate_statistics_numpy
+from src.cowpoke.herd_improvement.liveweight_ingest import add_liveweights_to_cow_dict
+from src.cowpoke.stage_timing import stage_timer
+from src.cowpoke.worker_pools import get_worker_pool
 
 
 @dataclasses.dataclass(frozen=True)
@@ -15,39 +22,95 @@ class DownloadFilePaths:
     src_dir = Path(__file__).parent.parent.parent
     temp_dir = src_dir.joinpath("temp", "cowpoke", "herd_improvement")
 
-    output_csv = temp_dir.joinpath("lactation_calculations.csv")
-    output_spreadsheet = temp_dir.joinpath("report.xlsx")
-    output_powerpoint = temp_dir.joinpath("blockwise_herd_report.pptx")
-
-
-def calculate_lactation_results(lactation_file_path: str, liveweight_file_path: str, output_file_path: str) -> dict:
-    cow_dict, cow_list, header_fields = _parse_lactation_csv_file(lactation_file_path=lactation_file_path)
-
-    if liveweight_file_path:
-        liveweight_dict = _parse_liveweight_csv_file(liveweight_file_path=liveweight_file_path)
-        cow_dict = _add_liveweight_to_cow_dict(cow_dict=cow_dict, liveweight_dict=liveweight_dict)
-
-    cow_dict = _add_estimated_weights_to_cow_dict(cow_dict=cow_dict)
-
-    augmented_cow_dict = _calculate_statistics(cow_dict=cow_dict)
-
-    _write_output_file(
-        output_file_path=output_file_path, cow_dict=augmented_cow_dict, cow_list=cow_list, header_fields=header_fields
-    )
-
-    summary_stats = calculate_summary_statistics(cow_dict=augmented_cow_dict)
+    output_csv: Path = temp_dir.joinpath("lactation_calculations.csv")
+    output_spreadsheet: Path = temp_dir.joinpath("report.xlsx")
+    output_powerpoint: Path = temp_dir.joinpath("blockwise_herd_report.pptx")
+
+    @classmethod
+    def in_directory(cls, directory: Path) -> "DownloadFilePaths":
+        """
+        The same file names, in another directory (eg. a run directory).
+        """
+        return cls(**{
+            field.name: directory.joinpath(field.default.name) for field in dataclasses.fields(cls)
+        })
+
+
+def calculate_lactation_results(
+        lactation_file_path: str,
+        liveweight_file_paths: list,
+        output_file_path: str,
+        download_file_paths: DownloadFilePaths = DownloadFilePaths(),
+        image_file_paths: "ImageFilePaths" = None,
+        report_data_file_path: Path | None = None,
+        statistics_engine: str = "decimal",
+        custom_lactation_bands: tuple["LactationBand", ...] = (),
+        liveweight_selection: str = "most_recent",
+) -> dict:
+    """
+    If 'report_data_file_path' is given, the charts and the PowerPoint file are not created.  The data to create
+    them on demand is saved there instead.  (See write_lactation_report_data.)
+
+    'statistics_engine' is a key of 'lactation_statistics_engines'.  'custom_lactation_bands' are summarised as well
+    as the standard lactation groups.  (See calculate_summary_statistics.)
+
+    'liveweight_file_paths' may be empty.  When a cow is weighed more than once, 'liveweight_selection' chooses her
+    weight.  (See 'liveweight_ingest.py'.)  The summary statistics include the "liveweight_join" report.
+    """
+    if image_file_paths is None:
+        image_file_paths = ImageFilePaths()
+
+    with stage_timer("parse"):
+        cow_dict, cow_list, header_fields = _parse_lactation_csv_file(lactation_file_path=lactation_file_path)
+
+        liveweight_join_report = add_liveweights_to_cow_dict(
+            cow_dict=cow_dict, liveweight_file_paths=liveweight_file_paths, liveweight_selection=liveweight_selection
+        )
+
+    with stage_timer("statistics"):
+        cow_dict = _add_estimated_weights_to_cow_dict(cow_dict=cow_dict)
+
+        augmented_cow_dict = lactation_statistics_engines[statistics_engine](cow_dict=cow_dict)
+
+    with stage_timer("output_csv"):
+        _write_output_file(
+            output_file_path=output_file_path,
+            cow_dict=augmented_cow_dict,
+            cow_list=cow_list,
+            header_fields=header_fields,
+        )
+
+    with stage_timer("summary_statistics"):
+        summary_stats = calculate_summary_statistics(
+            cow_dict=augmented_cow_dict, custom_lactation_bands=custom_lactation_bands
+        )
+        summary_stats["liveweight_join"] = dataclasses.asdict(liveweight_join_report)
     # import pprint
     # pprint.pprint(summary_stats)
 
-    create_excel_spreadsheet(
-        cow_dict=augmented_cow_dict,
-        xlsx_file_path=DownloadFilePaths.output_spreadsheet,
-        csv_file_path=DownloadFilePaths.output_csv,
-    )
-
-    create_graphs(cow_dict=augmented_cow_dict)
-
-    create_powerpoint(data=summary_stats, file_path=DownloadFilePaths.output_powerpoint, image_file_paths=ImageFilePaths)
+    with stage_timer("spreadsheet"):
+        create_excel_spreadsheet(
+            cow_dict=augmented_cow_dict,
+            xlsx_file_path=download_file_paths.output_spreadsheet,
+            output_rows=iter_output_rows(cow_dict=augmented_cow_dict, cow_list=cow_list, header_fields=header_fields),
+        )
+
+    if report_data_file_path is not None:  # Charts and PowerPoint file are created when first downloaded.
+        with stage_timer("report_data"):
+            write_lactation_report_data(
+                file_path=report_data_file_path,
+                chart_data=extract_chart_data(cow_dict=augmented_cow_dict),
+                summary_stats=summary_stats,
+            )
+        return summary_stats
+
+    with stage_timer("charts"):
+        create_graphs(cow_dict=augmented_cow_dict, image_file_paths=image_file_paths)
+
+    with stage_timer("powerpoint"):
+        create_powerpoint(
+            data=summary_stats, file_path=download_file_paths.output_powerpoint, image_file_paths=image_file_paths
+        )
 
     return summary_stats
 
@@ -170,68 +233,6 @@ def _convert_raw_data(raw_data: dict) -> dict:
     return raw_data
 
 
-def _parse_liveweight_csv_file(liveweight_file_path: str) -> dict:
-    herdwatch_field_name_lookup = {
-        "Tag": "eartag",
-        "First weight date": "date",
-        "First Weight": "liveweight",
-    }
-    herdcompanion_field_name_lookup = {
-        "Line No.": "line_number",
-        "Eartag": "eartag",
-        "Liveweight": "liveweight",
-    }
-
-    with open(liveweight_file_path) as f:
-        # First line(s) of file may be empty or bogus, because the HerdWatch logo was there.
-
-        for _ in range(100):  # Header should be in first 100 lines.
-            header = f.readline()
-            if header.startswith("Tag"):
-                field_lookup = herdwatch_field_name_lookup
-                break
-            if header.startswith("Line"):
-                field_lookup = herdcompanion_field_name_lookup
-                break
-
-        header_names = [x.strip() for x in header.split(",")]  # x.strip() to remove newline "\n" from last header name.
-        fields = [field_lookup.get(x, "_") for x in header_names]
-        field_indices = {
-            field: idx for idx, field in enumerate(fields)
-        }
-
-        liveweight_dict = {}
-
-        for row in f:
-            row_values = [x.strip() for x in row.split(",")]
-            if row_values[0] == "":
-                continue
-
-            eartag = row_values[field_indices["eartag"]]
-            if eartag == "":  # If blank 'eartag', must be using Herd Companion format with 'Line No.' field.
-                eartag = row_values[field_indices["line_number"]]
-
-            liveweight = row_values[field_indices["liveweight"]]
-            if liveweight == "":
-                continue
-            try:
-                liveweight_dict[eartag] = Decimal(liveweight)
-            except:
-                raise ValueError(f"Could not convert 'liveweight' value '{liveweight}' into Decimal")
-
-        return liveweight_dict
-
-
-def _add_liveweight_to_cow_dict(cow_dict: dict, liveweight_dict: dict) -> dict:
-    for eartag, data in cow_dict.items():
-        lactation_data = data["lactation_data"]
-        if eartag in liveweight_dict:
-            lactation_data["liveweight"] = liveweight_dict[eartag]
-            lactation_data["liveweight_estimated"] = False
-
-    return cow_dict
-
-
 def _add_estimated_weights_to_cow_dict(cow_dict: dict) -> dict:
     for _, data in cow_dict.items():
         lactation_data = data["lactation_data"]
@@ -302,6 +303,15 @@ def _calculate_statistics(cow_dict: dict) -> dict:
     return cow_dict
 
 
+# The engines give the same rounded statistics, to within the tolerances documented in
+# 'lactation_statistics_numpy.py'.  "numpy" is much faster for large files (eg. a breed society's), so it is for
+# interactive runs, and "decimal" is for audit runs.
+lactation_statistics_engines = {
+    "decimal": _calculate_statistics,
+    "numpy": calculate_statistics_numpy,
+}
+
+
 def _calculate_merit_score(lactation_data: dict) -> tuple[Decimal, Decimal]:
     cow_weight = lactation_data["liveweight"]
     milk = lactation_data["milk"]
@@ -334,6 +344,16 @@ def _calculate_group(lactation_data: dict) -> str:
 
 
 def _write_output_file(output_file_path: str, cow_dict: dict, cow_list: list, header_fields: list) -> None:
+    with open(output_file_path, "w") as g:
+        for row in iter_output_rows(cow_dict=cow_dict, cow_list=cow_list, header_fields=header_fields):
+            g.write(",".join(row) + "\n")
+
+
+def iter_output_rows(cow_dict: dict, cow_list: list, header_fields: list) -> Iterator[list[str]]:
+    """
+    The rows of the output CSV file, as lists of strings, starting with the header row.  Cows in the order of the
+    lactation file.  (Also the "Herd Companion +" sheet of the spreadsheet.)
+    """
     reverse_field_lookup = {
         val: key for key, val in field_name_lookup.items()
     }
@@ -365,120 +385,178 @@ def _write_output_file(output_file_path: str, cow_dict: dict, cow_list: list, he
     else:
         all_fields = header_fields + ["liveweight"] + augmented_header_fields
 
-    header = ",".join(reverse_field_lookup[x] for x in all_fields) + "\n"
-
-    with open(output_file_path, "w") as g:
-        g.write(header)
+    yield [reverse_field_lookup[x] for x in all_fields]
 
-        for cow_eartag in cow_list:
-            data = cow_dict[cow_eartag]
-            lactation_data = data["lactation_data"]
+    for cow_eartag in cow_list:
+        data = cow_dict[cow_eartag]
+        lactation_data = data["lactation_data"]
 
-            existing_row = [str(lactation_data[x]) for x in header_fields]
+        existing_row = [str(lactation_data[x]) for x in header_fields]
 
-            if lactation_data["liveweight_estimated"]:
-                liveweight = str(lactation_data["liveweight"]) + "*"
-            else:
-                liveweight = str(lactation_data["liveweight"])
+        if lactation_data["liveweight_estimated"]:
+            liveweight = str(lactation_data["liveweight"]) + "*"
+        else:
+            liveweight = str(lactation_data["liveweight"])
 
-            statistics = data["statistics"]
-            stats_row = [str(statistics[x]) for x in augmented_header_fields]
+        statistics = data["statistics"]
+        stats_row = [str(statistics[x]) for x in augmented_header_fields]
 
-            row = existing_row + [liveweight] + stats_row
-            line = ",".join(row) + "\n"
-            g.write(line)
+        yield existing_row + [liveweight] + stats_row
 
 
 ########################################################################################################################
 # Summary Statistics
 
-def calculate_summary_statistics(cow_dict: dict) -> dict:
+@dataclasses.dataclass(frozen=True)
+class LactationBand:
+    """
+    Cows with 'first_lactation' to 'last_lactation' lactations, inclusive.  No upper limit if 'last_lactation' is None.
+    """
+    description: str
+    first_lactation: int
+    last_lactation: int | None = None
+
+    def includes(self, lactations: int) -> bool:
+        return self.first_lactation <= lactations and (self.last_lactation is None or lactations <= self.last_lactation)
+
+
+# The lactation groups in the herd report, keyed by their key in the summary statistics.
+standard_lactation_bands = {
+    "one_and_two": LactationBand(description="1 & 2", first_lactation=1, last_lactation=2),
+    "three_to_eight": LactationBand(description="3 to 8", first_lactation=3, last_lactation=8),
+    "nine_plus": LactationBand(description="9+", first_lactation=9),
+    "one": LactationBand(description="1", first_lactation=1, last_lactation=1),
+    "two": LactationBand(description="2", first_lactation=2, last_lactation=2),
+}
+
+
+def parse_lactation_bands(text: str) -> tuple[LactationBand, ...]:
+    """
+    Bands separated by "/" or ",", eg. "1 / 2-3 / 4-6 / 7+".  Bands may overlap.  Raises ValueError if the text
+    can't be understood.
+    """
+    lactation_bands = []
+
+    for part in text.replace(",", "/").split("/"):
+        band_text = part.strip().replace(" ", "")
+        if band_text == "":
+            continue
+
+        try:
+            if band_text.endswith("+"):
+                first_lactation, last_lactation = int(band_text[:-1]), None
+                description = f"{first_lactation}+"
+            elif "-" in band_text:
+                first_text, last_text = band_text.split("-")
+                first_lactation, last_lactation = int(first_text), int(last_text)
+                description = f"{first_lactation} to {last_lactation}"
+            else:
+                first_lactation = last_lactation = int(band_text)
+                description = f"{first_lactation}"
+        except ValueError:
+            raise ValueError(
+                f"Could not understand lactation band '{part.strip()}'.  Expected eg. '1 / 2-3 / 4-6 / 7+'"
+            )
+
+        if first_lactation < 1:
+            raise ValueError(f"Lactation band '{part.strip()}' is not valid.  Lactations start at 1")
+        if last_lactation is not None and last_lactation < first_lactation:
+            raise ValueError(f"Lactation band '{part.strip()}' is empty")
+
+        lactation_bands.append(
+            LactationBand(description=description, first_lactation=first_lactation, last_lactation=last_lactation)
+        )
+
+    return tuple(lactation_bands)
+
+
+def calculate_summary_statistics(cow_dict: dict, custom_lactation_bands: tuple[LactationBand, ...] = ()) -> dict:
+    """
+    The 'standard_lactation_bands', the "total" of the whole herd, and the "custom_bands" (a list, in the order
+    given), all added up in one pass over the cows.
+    """
     number_of_cows = len(cow_dict)
-    summary_statistics = {
-        "number_of_cows": number_of_cows,
-    }
 
-    cows = []
-    for eartag, data in cow_dict.items():
-        if data["lactation_data"]["lact_num"] in (1, 2):
-            cows.append(data)
-    summary_statistics["one_and_two"] = calculate_group_data(
-        cow_list=cows, herd_size=number_of_cows, description="1 & 2"
-    )
+    all_bands = list(standard_lactation_bands.values()) + list(custom_lactation_bands)
+    all_group_totals = [GroupTotals() for _ in all_bands]
+    herd_totals = GroupTotals()
 
-    cows = []
-    for eartag, data in cow_dict.items():
-        lactations = data["lactation_data"]["lact_num"]
-        if 3 <= lactations <= 8:
-            cows.append(data)
-    summary_statistics["three_to_eight"] = calculate_group_data(
-        cow_list=cows, herd_size=number_of_cows, description="3 to 8"
-    )
+    group_totals_by_lactations = {}  # The group totals each number of lactations is added to.
 
-    cows = []
-    for eartag, data in cow_dict.items():
+    for data in cow_dict.values():
         lactations = data["lactation_data"]["lact_num"]
-        if 9 <= lactations:
-            cows.append(data)
-    summary_statistics["nine_plus"] = calculate_group_data(
-        cow_list=cows, herd_size=number_of_cows, description="9+"
-    )
 
-    cows = []
-    for eartag, data in cow_dict.items():
-        cows.append(data)
-    summary_statistics["total"] = calculate_group_data(cow_list=cows, herd_size=number_of_cows, description="Total")
+        cow_group_totals = group_totals_by_lactations.get(lactations)
+        if cow_group_totals is None:
+            cow_group_totals = [herd_totals] + [
+                group_totals for band, group_totals in zip(all_bands, all_group_totals) if band.includes(lactations)
+            ]
+            group_totals_by_lactations[lactations] = cow_group_totals
 
-    cows = []
-    for eartag, data in cow_dict.items():
-        lactations = data["lactation_data"]["lact_num"]
-        if lactations == 1:
-            cows.append(data)
-    summary_statistics["one"] = calculate_group_data(cow_list=cows, herd_size=number_of_cows, description="1")
+        for group_totals in cow_group_totals:
+            group_totals.add(cow=data)
 
-    cows = []
-    for eartag, data in cow_dict.items():
-        lactations = data["lactation_data"]["lact_num"]
-        if lactations == 2:
-            cows.append(data)
-    summary_statistics["two"] = calculate_group_data(cow_list=cows, herd_size=number_of_cows, description="2")
+    group_data = [
+        summarise_group_totals(group_totals=group_totals, herd_size=number_of_cows, description=band.description)
+        for band, group_totals in zip(all_bands, all_group_totals)
+    ]
+
+    summary_statistics = {
+        "number_of_cows": number_of_cows,
+        **dict(zip(standard_lactation_bands, group_data)),
+        "total": summarise_group_totals(group_totals=herd_totals, herd_size=number_of_cows, description="Total"),
+        "custom_bands": group_data[len(standard_lactation_bands):],
+    }
 
     return summary_statistics
 
 
+@dataclasses.dataclass(slots=True)
+class GroupTotals:
+    num_cows: int = 0
+    milk_vol: Decimal | int = 0
+    milk_solids: Decimal | int = 0
+    days_in_milk: int = 0
+    weight: Decimal | int = 0
+    fat_pct: Decimal | int = 0
+    protein_pct: Decimal | int = 0
+
+    def add(self, cow: dict):
+        lactation_data = cow["lactation_data"]
+        statistics = cow["statistics"]
+        self.num_cows += 1
+        self.milk_vol += lactation_data["milk"]
+        self.milk_solids += lactation_data["milk_solids"]
+        self.days_in_milk += lactation_data["lact_len"]
+        self.weight += lactation_data["liveweight"]
+        self.fat_pct += statistics["fat_percentage"]
+        self.protein_pct += statistics["protein_percentage"]
+
+
 def calculate_group_data(cow_list: list, herd_size: int, description: str) -> dict:
+    group_totals = GroupTotals()
+    for cow in cow_list:
+        group_totals.add(cow=cow)
+
+    return summarise_group_totals(group_totals=group_totals, herd_size=herd_size, description=description)
+
+
+def summarise_group_totals(group_totals: GroupTotals, herd_size: int, description: str) -> dict:
     # Lactation, No of Cows, % of Herd,
     # Vol of Milk kg, Avg Vol of Milk,
     # Milk Solids kg, Ave Milk Solids,
     # Days in Milk, Ave Weight, Avg Fat %, Avg Protein %
 
-    num_cows = 0
-    milk_vol = 0
-    milk_solids = 0
-    days_in_milk = 0
-    weight = 0
-    fat_pct = 0
-    protein_pct = 0
-
-    for cow in cow_list:
-        lactation_data = cow["lactation_data"]
-        statistics = cow["statistics"]
-        num_cows += 1
-        milk_vol += lactation_data["milk"]
-        milk_solids += lactation_data["milk_solids"]
-        days_in_milk += lactation_data["lact_len"]
-        weight += lactation_data["liveweight"]
-        fat_pct += statistics["fat_percentage"]
-        protein_pct += statistics["protein_percentage"]
+    num_cows = group_totals.num_cows
 
     if num_cows == 0:
         return {
         "lactation_description": description,
         "num_cows": num_cows,
         "pct_of_herd": round(100 * Decimal(num_cows) / herd_size),
-        "milk_volume": milk_vol,
+        "milk_volume": group_totals.milk_vol,
         "avg_milk_volume": 0,
-        "milk_solids": milk_solids,
+        "milk_solids": group_totals.milk_solids,
         "avg_milk_solids": 0,
         "days_in_milk": 0,
         "avg_weight": 0,
@@ -490,14 +568,14 @@ def calculate_group_data(cow_list: list, herd_size: int, description: str) -> di
         "lactation_description": description,
         "num_cows": num_cows,
         "pct_of_herd": round(100 * Decimal(num_cows) / herd_size),
-        "milk_volume": milk_vol,
-        "avg_milk_volume": round(Decimal(milk_vol) / num_cows),
-        "milk_solids": milk_solids,
-        "avg_milk_solids": round(Decimal(milk_solids) / num_cows),
-        "days_in_milk": round(Decimal(days_in_milk) / num_cows),
-        "avg_weight": round(Decimal(weight) / num_cows),
-        "avg_fat_pct": round(Decimal(fat_pct) / num_cows, 2),
-        "avg_protein_pct": round(Decimal(protein_pct) / num_cows, 2),
+        "milk_volume": group_totals.milk_vol,
+        "avg_milk_volume": round(Decimal(group_totals.milk_vol) / num_cows),
+        "milk_solids": group_totals.milk_solids,
+        "avg_milk_solids": round(Decimal(group_totals.milk_solids) / num_cows),
+        "days_in_milk": round(Decimal(group_totals.days_in_milk) / num_cows),
+        "avg_weight": round(Decimal(group_totals.weight) / num_cows),
+        "avg_fat_pct": round(Decimal(group_totals.fat_pct) / num_cows, 2),
+        "avg_protein_pct": round(Decimal(group_totals.protein_pct) / num_cows, 2),
     }
 
 
@@ -506,144 +584,273 @@ class ImageFilePaths:
     src_dir = Path(__file__).parent.parent.parent
     temp_dir = src_dir.joinpath("temp", "cowpoke", "herd_improvement")
 
-    protein_pct_histogram = temp_dir.joinpath("protein_pct_histogram.svg")
-    milk_solids_histogram = temp_dir.joinpath("milk_solids_histogram.svg")
-    scc_histogram = temp_dir.joinpath("scc_histogram.svg")
-    merit_score_histogram = temp_dir.joinpath("merit_score_histogram.svg")
-    cow_age_chart = temp_dir.joinpath("cow_age_chart.svg")
-    cow_performance_chart = temp_dir.joinpath("cow_performance_chart.svg")
-    liveweight_histogram = temp_dir.joinpath("liveweight_histogram.svg")
-    liveweight_milk_solids_chart = temp_dir.joinpath("liveweight_milk_solids_chart.svg")
-    efficiency_milk_solids_chart = temp_dir.joinpath("efficiency_milk_solids_chart.svg")
-    milk_solids_by_age_chart = temp_dir.joinpath("milk_solids_by_age_chart.svg")
-    milk_solids_by_age_boxplot = temp_dir.joinpath("milk_solids_by_age_boxplot.svg")
-    efficiency_by_age_chart = temp_dir.joinpath("efficiency_by_age_chart.svg")
-    efficiency_by_age_boxplot = temp_dir.joinpath("efficiency_by_age_boxplot.svg")
-    milk_solids_vs_scc_chart = temp_dir.joinpath("milk_solids_vs_scc.svg")
-    efficiency_vs_scc_chart = temp_dir.joinpath("efficiency_vs_scc.svg")
-
-
-def create_graphs(cow_dict: dict) -> dict:
-    protein_percentage = []
-    ave_scc = []
-    milk_solids = []
-    merit_score = []
-    weight_score = []
-    age = []
-    liveweight = []
-    liveweight_est = []
+    protein_pct_histogram: Path = temp_dir.joinpath("protein_pct_histogram.svg")
+    milk_solids_histogram: Path = temp_dir.joinpath("milk_solids_histogram.svg")
+    scc_histogram: Path = temp_dir.joinpath("scc_histogram.svg")
+    merit_score_histogram: Path = temp_dir.joinpath("merit_score_histogram.svg")
+    cow_age_chart: Path = temp_dir.joinpath("cow_age_chart.svg")
+    cow_performance_chart: Path = temp_dir.joinpath("cow_performance_chart.svg")
+    liveweight_histogram: Path = temp_dir.joinpath("liveweight_histogram.svg")
+    liveweight_milk_solids_chart: Path = temp_dir.joinpath("liveweight_milk_solids_chart.svg")
+    efficiency_milk_solids_chart: Path = temp_dir.joinpath("efficiency_milk_solids_chart.svg")
+    milk_solids_by_age_chart: Path = temp_dir.joinpath("milk_solids_by_age_chart.svg")
+    milk_solids_by_age_boxplot: Path = temp_dir.joinpath("milk_solids_by_age_boxplot.svg")
+    efficiency_by_age_chart: Path = temp_dir.joinpath("efficiency_by_age_chart.svg")
+    efficiency_by_age_boxplot: Path = temp_dir.joinpath("efficiency_by_age_boxplot.svg")
+    milk_solids_vs_scc_chart: Path = temp_dir.joinpath("milk_solids_vs_scc.svg")
+    efficiency_vs_scc_chart: Path = temp_dir.joinpath("efficiency_vs_scc.svg")
+
+    @classmethod
+    def in_directory(cls, directory: Path) -> "ImageFilePaths":
+        """
+        The same file names, in another directory (eg. a run directory).
+        """
+        return cls(**{
+            field.name: directory.joinpath(field.default.name) for field in dataclasses.fields(cls)
+        })
+
+
+# Charts, by their field name in ImageFilePaths.
+lactation_chart_names = tuple(field.name for field in dataclasses.fields(ImageFilePaths))
+
+# Columns of the cow dict that are plotted, as plain lists.  (See extract_chart_data.)
+chart_data_columns = (
+    "protein_percentage", "ave_scc", "milk_solids", "merit_score", "weight_score", "age", "liveweight",
+    "liveweight_estimated",
+)
+
+
+def extract_chart_data(cow_dict: dict) -> dict:
+    """
+    The data plotted by the charts, with Decimals as floats, so that it can be saved as JSON and sent to a worker.
+    """
+    chart_data = {column: [] for column in chart_data_columns}
 
     for cow, data in cow_dict.items():
         stats = data["statistics"]
         lactation_data = data["lactation_data"]
-        protein_percentage.append(stats["protein_percentage"])
-        ave_scc.append(lactation_data["ave_SCC"])
-        milk_solids.append(lactation_data["milk_solids"])
-        merit_score.append(stats["merit_score"])
-        weight_score.append(stats["weight_score"])
-        age.append(lactation_data["lact_num"])
-        liveweight.append(lactation_data["liveweight"])
-        liveweight_est.append(lactation_data["liveweight_estimated"])
+        chart_data["protein_percentage"].append(stats["protein_percentage"])
+        chart_data["ave_scc"].append(lactation_data["ave_SCC"])
+        chart_data["milk_solids"].append(lactation_data["milk_solids"])
+        chart_data["merit_score"].append(stats["merit_score"])
+        chart_data["weight_score"].append(stats["weight_score"])
+        chart_data["age"].append(lactation_data["lact_num"])
+        chart_data["liveweight"].append(lactation_data["liveweight"])
+        chart_data["liveweight_estimated"].append(lactation_data["liveweight_estimated"])
+
+    return {
+        column: [float(x) if isinstance(x, Decimal) else x for x in values] for column, values in chart_data.items()
+    }
 
-    liveweight_true = ["Estimated" if x else "True Weight" for x in liveweight_est]
 
+def write_lactation_report_data(file_path: Path, chart_data: dict, summary_stats: dict):
+    """
+    Everything needed to draw the charts and create the PowerPoint file later.  Decimals in the summary statistics
+    are saved as strings, which the PowerPoint file shows unchanged.
+    """
+    with open(file_path, "w") as g:
+        json.dump({"chart_data": chart_data, "summary_stats": summary_stats}, g, default=str)
+
+
+def read_lactation_report_data(file_path: Path) -> dict:
+    with open(file_path) as f:
+        return json.load(f)
+
+
+def create_graphs(cow_dict: dict, image_file_paths: ImageFilePaths = ImageFilePaths()):
+    """
+    Draw every chart as SVG, and as PNG too if it is in the PowerPoint file.
+    The charts are drawn at the same time in the "charts" worker pool, each sent only the columns it plots.
+    """
+    chart_data = extract_chart_data(cow_dict=cow_dict)
+    chart_pool = get_worker_pool("charts")
+
+    chart_futures = {}
+    for chart_name in lactation_chart_names:
+        chart_futures[chart_name] = chart_pool.submit(
+            render_lactation_chart,
+            chart_name,
+            {column: chart_data[column] for column in lactation_chart_columns[chart_name]},
+            ("svg", "png") if chart_name in powerpoint_chart_names else ("svg",),
+        )
+
+    for chart_name, chart_future in chart_futures.items():
+        file_path = getattr(image_file_paths, chart_name)
+        for image_format, image in chart_future.result().items():
+            file_path.with_suffix(f".{image_format}").write_bytes(image)
+
+
+def render_lactation_chart_from_report_data(report_data_file_path: Path, chart_name: str, image_format: str) -> bytes:
+    """
+    For the "charts" worker pool.  (See 'worker_pools.py'.)
+    """
+    chart_data = read_lactation_report_data(file_path=report_data_file_path)["chart_data"]
+    return render_lactation_chart(chart_name=chart_name, chart_data=chart_data, image_formats=(image_format,))[
+        image_format
+    ]
+
+
+def create_powerpoint_from_report_data(
+        report_data_file_path: Path,
+        image_file_paths: ImageFilePaths,
+        farm_name: str,
+) -> bytes:
+    """
+    For the "analysis" worker pool.  The PNG charts in the PowerPoint file (see 'powerpoint_chart_names') must
+    already have been drawn.
+    """
+    summary_stats = read_lactation_report_data(file_path=report_data_file_path)["summary_stats"]
+
+    pptx_buffer = io.BytesIO()
+    create_powerpoint(
+        data=summary_stats, file_path=pptx_buffer, image_file_paths=image_file_paths, farm_name=farm_name
+    )
+    return pptx_buffer.getvalue()
+
+
+def render_lactation_chart(chart_name: str, chart_data: dict, image_formats: tuple[str, ...] = ("svg",)) -> dict:
+    """
+    Draw one chart, and return {image format: image bytes}.  'chart_data' only needs the chart's columns.
+    Uses its own Figure (not the pyplot state machine), so it is safe to run concurrently, eg. in a process pool.
+    """
+    fig = draw_lactation_chart(chart_name=chart_name, chart_data=chart_data)
+
+    images = {}
+    for image_format in image_formats:
+        image_buffer = io.BytesIO()
+        fig.savefig(image_buffer, format=image_format, bbox_inches="tight")
+        images[image_format] = image_buffer.getvalue()
+
+    return images
+
+
+# The columns of the chart data (see 'chart_data_columns') that each chart plots.
+lactation_chart_columns = {
+    "protein_pct_histogram": ("protein_percentage",),
+    "milk_solids_histogram": ("milk_solids",),
+    "scc_histogram": ("ave_scc",),
+    "merit_score_histogram": ("merit_score",),
+    "cow_age_chart": ("age",),
+    "cow_performance_chart": ("weight_score", "protein_percentage", "liveweight_estimated"),
+    "liveweight_histogram": ("liveweight",),
+    "liveweight_milk_solids_chart": ("liveweight", "milk_solids", "liveweight_estimated"),
+    "efficiency_milk_solids_chart": ("weight_score", "milk_solids", "liveweight_estimated"),
+    "milk_solids_by_age_chart": ("age", "milk_solids"),
+    "milk_solids_by_age_boxplot": ("age", "milk_solids"),
+    "efficiency_by_age_chart": ("age", "weight_score", "liveweight_estimated"),
+    "efficiency_by_age_boxplot": ("age", "weight_score"),
+    "milk_solids_vs_scc_chart": ("ave_scc", "milk_solids"),
+    "efficiency_vs_scc_chart": ("ave_scc", "weight_score", "liveweight_estimated"),
+}
+
+# Same size as the seaborn figure-level plots (displot, relplot, catplot) that the charts were first drawn with.
+chart_figure_size = (5, 5)
+
+
+def draw_lactation_chart(chart_name: str, chart_data: dict) -> Figure:
+    """
+    Returns the chart as a matplotlib Figure of its own, drawn with the axes-level seaborn functions.
+    """
     sns.set_theme(style="darkgrid")
 
-    g = sns.displot(data={"Protein %": protein_percentage}, x="Protein %", binwidth=0.1, binrange=[3,5.5], kde=True)
-    g.savefig(ImageFilePaths.protein_pct_histogram)
-    plt.close()
-
-    g = sns.displot(data={"Milk Solids kg": milk_solids}, x="Milk Solids kg", binwidth=20, binrange=[300,900], kde=True)
-    g.savefig(ImageFilePaths.milk_solids_histogram)
-    g.savefig(ImageFilePaths.milk_solids_histogram.with_suffix(".png"))
-    plt.close()
-
-    g = sns.displot(data={"Average SCC": ave_scc}, x="Average SCC", binwidth=50, stat="percent")
-    g.savefig(ImageFilePaths.scc_histogram)
-    g.savefig(ImageFilePaths.scc_histogram.with_suffix(".png"))
-    plt.close()
-
-    g = sns.displot(data={"Score": merit_score}, x="Score", binwidth=50, binrange=[0,1800], stat="percent", kde=True)
-    g.savefig(ImageFilePaths.merit_score_histogram)
-    plt.close()
-
-    g = sns.displot(data={"Liveweight": liveweight}, x="Liveweight", binwidth=25, binrange=[300,800],
-                    stat="percent", kde=True)
-    g.savefig(ImageFilePaths.liveweight_histogram)
-    g.savefig(ImageFilePaths.liveweight_histogram.with_suffix(".png"))
-    plt.close()
-
-    g = sns.relplot(data={"Liveweight": liveweight, "Milk Solids": milk_solids },
-                    x="Liveweight", y="Milk Solids", hue=liveweight_true, kind="scatter")
-    g.savefig(ImageFilePaths.liveweight_milk_solids_chart)
-    g.savefig(ImageFilePaths.liveweight_milk_solids_chart.with_suffix(".png"))
-    plt.close()
-
-    g = sns.relplot(data={"Cow Efficiency": weight_score, "Milk Solids": milk_solids },
-                    x="Cow Efficiency", y="Milk Solids", hue=liveweight_true, kind="scatter")
-    g.savefig(ImageFilePaths.efficiency_milk_solids_chart)
-    g.savefig(ImageFilePaths.efficiency_milk_solids_chart.with_suffix(".png"))
-    plt.close()
-
-    g = sns.relplot(data={"Cow Efficiency": weight_score, "Milk Richness": protein_percentage },
-                    x="Cow Efficiency", y="Milk Richness", hue=liveweight_true, kind="scatter")
-    g.savefig(ImageFilePaths.cow_performance_chart)
-    plt.close()
-
-    g = sns.catplot(data={"Age": age, "Milk Solids": milk_solids }, x="Age", y="Milk Solids")
-    g.savefig(ImageFilePaths.milk_solids_by_age_chart)
-    g.savefig(ImageFilePaths.milk_solids_by_age_chart.with_suffix(".png"))
-    plt.close()
-
-    g = sns.catplot(data={"Age": age, "Milk Solids": milk_solids }, x="Age", y="Milk Solids", kind="box")
-    g.savefig(ImageFilePaths.milk_solids_by_age_boxplot)
-    plt.close()
-
-    g = sns.catplot(data={"Age": age, "Cow Efficiency": weight_score}, x="Age", y="Cow Efficiency", hue=liveweight_true)
-    g.savefig(ImageFilePaths.efficiency_by_age_chart)
-    g.savefig(ImageFilePaths.efficiency_by_age_chart.with_suffix(".png"))
-    plt.close()
-
-    g = sns.catplot(data={"Age": age, "Cow Efficiency": weight_score }, x="Age", y="Cow Efficiency", kind="box")
-    g.savefig(ImageFilePaths.efficiency_by_age_boxplot)
-    plt.close()
-
-    g = sns.relplot(data={"Average SCC": ave_scc, "Milk Solids": milk_solids },
-                    x="Average SCC", y="Milk Solids", kind="scatter")
-    g.savefig(ImageFilePaths.milk_solids_vs_scc_chart)
-    g.savefig(ImageFilePaths.milk_solids_vs_scc_chart.with_suffix(".png"))
-    plt.close()
-
-    g = sns.relplot(data={"Average SCC": ave_scc, "Cow Efficiency": weight_score },
-                    x="Average SCC", y="Cow Efficiency", hue=liveweight_true, kind="scatter")
-    g.savefig(ImageFilePaths.efficiency_vs_scc_chart)
-    g.savefig(ImageFilePaths.efficiency_vs_scc_chart.with_suffix(".png"))
-    plt.close()
-
-    #################################################
-    # Age distribution with 9, 10, 11, etc collapsed into "9+" and Industry Standard percentages overlaid.
-
-    fig, ax1 = plt.subplots()
-
-    ages_with_9plus = [str(x) if x < 9 else "9+" for x in age]
-    age_categories_in_order = ["1", "2", "3", "4", "5", "6", "7", "8", "9+"]
-    industry_standard_age_pcts = [18, 16, 13,  12,  11,  9,   8,   7,   6]
-
-    sns.countplot(data={"Age": ages_with_9plus}, x="Age", stat="percent", order=age_categories_in_order, ax=ax1)
-
-    ax2 = ax1.twiny()
-    sns.scatterplot(x=age_categories_in_order, y=industry_standard_age_pcts, ax=ax2,
-                    color="red", marker="D", label="Industry Standard")
-    plt.legend(loc="upper right")
-    ax2.set_axis_off()
-
-    ax3 = ax2.twiny()
-    sns.lineplot(x=age_categories_in_order, y=industry_standard_age_pcts, ax=ax3, color="red")
-    ax3.set_axis_off()
-
-    fig.savefig(ImageFilePaths.cow_age_chart)
-    fig.savefig(ImageFilePaths.cow_age_chart.with_suffix(".png"))
-    plt.close()
+    if "liveweight_estimated" in chart_data:
+        liveweight_true = ["Estimated" if x else "True Weight" for x in chart_data["liveweight_estimated"]]
+
+    if chart_name == "cow_age_chart":
+        #################################################
+        # Age distribution with 9, 10, 11, etc collapsed into "9+" and Industry Standard percentages overlaid.
+
+        fig = Figure()
+        ax1 = fig.subplots()
+
+        ages_with_9plus = [str(x) if x < 9 else "9+" for x in chart_data["age"]]
+        age_categories_in_order = ["1", "2", "3", "4", "5", "6", "7", "8", "9+"]
+        industry_standard_age_pcts = [18, 16, 13,  12,  11,  9,   8,   7,   6]
+
+        sns.countplot(data={"Age": ages_with_9plus}, x="Age", stat="percent", order=age_categories_in_order, ax=ax1)
+
+        ax2 = ax1.twiny()
+        sns.scatterplot(x=age_categories_in_order, y=industry_standard_age_pcts, ax=ax2,
+                        color="red", marker="D", label="Industry Standard")
+        ax2.legend(loc="upper right")
+        ax2.set_axis_off()
+
+        ax3 = ax2.twiny()
+        sns.lineplot(x=age_categories_in_order, y=industry_standard_age_pcts, ax=ax3, color="red")
+        ax3.set_axis_off()
+
+        return fig
+
+    fig = Figure(figsize=chart_figure_size)
+    ax = fig.subplots()
+
+    if chart_name == "protein_pct_histogram":
+        sns.histplot(data={"Protein %": chart_data["protein_percentage"]}, x="Protein %", binwidth=0.1,
+                     binrange=[3,5.5], kde=True, ax=ax)
+
+    elif chart_name == "milk_solids_histogram":
+        sns.histplot(data={"Milk Solids kg": chart_data["milk_solids"]}, x="Milk Solids kg", binwidth=20,
+                     binrange=[300,900], kde=True, ax=ax)
+
+    elif chart_name == "scc_histogram":
+        sns.histplot(data={"Average SCC": chart_data["ave_scc"]}, x="Average SCC", binwidth=50, stat="percent", ax=ax)
+
+    elif chart_name == "merit_score_histogram":
+        sns.histplot(data={"Score": chart_data["merit_score"]}, x="Score", binwidth=50, binrange=[0,1800],
+                     stat="percent", kde=True, ax=ax)
+
+    elif chart_name == "liveweight_histogram":
+        sns.histplot(data={"Liveweight": chart_data["liveweight"]}, x="Liveweight", binwidth=25, binrange=[300,800],
+                     stat="percent", kde=True, ax=ax)
+
+    elif chart_name == "liveweight_milk_solids_chart":
+        sns.scatterplot(data={"Liveweight": chart_data["liveweight"], "Milk Solids": chart_data["milk_solids"]},
+                        x="Liveweight", y="Milk Solids", hue=liveweight_true, ax=ax)
+
+    elif chart_name == "efficiency_milk_solids_chart":
+        sns.scatterplot(data={"Cow Efficiency": chart_data["weight_score"], "Milk Solids": chart_data["milk_solids"]},
+                        x="Cow Efficiency", y="Milk Solids", hue=liveweight_true, ax=ax)
+
+    elif chart_name == "cow_performance_chart":
+        sns.scatterplot(data={"Cow Efficiency": chart_data["weight_score"],
+                              "Milk Richness": chart_data["protein_percentage"]},
+                        x="Cow Efficiency", y="Milk Richness", hue=liveweight_true, ax=ax)
+
+    elif chart_name == "milk_solids_by_age_chart":
+        sns.stripplot(data={"Age": chart_data["age"], "Milk Solids": chart_data["milk_solids"]},
+                      x="Age", y="Milk Solids", ax=ax)
+
+    elif chart_name == "milk_solids_by_age_boxplot":
+        sns.boxplot(data={"Age": chart_data["age"], "Milk Solids": chart_data["milk_solids"]},
+                    x="Age", y="Milk Solids", ax=ax)
+
+    elif chart_name == "efficiency_by_age_chart":
+        sns.stripplot(data={"Age": chart_data["age"], "Cow Efficiency": chart_data["weight_score"]},
+                      x="Age", y="Cow Efficiency", hue=liveweight_true, ax=ax)
+
+    elif chart_name == "efficiency_by_age_boxplot":
+        sns.boxplot(data={"Age": chart_data["age"], "Cow Efficiency": chart_data["weight_score"]},
+                    x="Age", y="Cow Efficiency", ax=ax)
+
+    elif chart_name == "milk_solids_vs_scc_chart":
+        sns.scatterplot(data={"Average SCC": chart_data["ave_scc"], "Milk Solids": chart_data["milk_solids"]},
+                        x="Average SCC", y="Milk Solids", ax=ax)
+
+    elif chart_name == "efficiency_vs_scc_chart":
+        sns.scatterplot(data={"Average SCC": chart_data["ave_scc"], "Cow Efficiency": chart_data["weight_score"]},
+                        x="Average SCC", y="Cow Efficiency", hue=liveweight_true, ax=ax)
+
+    else:
+        raise ValueError(f"Unknown chart '{chart_name}'")
+
+    fig.tight_layout()  # As the figure-level functions do, so the axes fill the figure.
+
+    # "True Weight" / "Estimated", outside the axes, as placed by relplot and catplot.  (Saved with bbox_inches="tight",
+    # so the image is widened to include it.)
+    if ax.get_legend() is not None:
+        sns.move_legend(ax, "center left", bbox_to_anchor=(1, 0.5), frameon=False)
+
+    return fig
 
 
 if __name__ == "__main__":
@@ -652,6 +859,6 @@ if __name__ == "__main__":
 
     calculate_lactation_results(
         lactation_file_path=demo_file_name,
-        liveweight_file_path=liveweight_file_name,
+        liveweight_file_paths=[liveweight_file_name],
         output_file_path=DownloadFilePaths.output_csv,
     )
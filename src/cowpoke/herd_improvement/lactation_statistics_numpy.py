@@ -0,0 +1,196 @@
+"""
+Vectorised NumPy engine for the per-cow lactation statistics.
+
+Adds the same "statistics" dict to each cow in the cow dict as _calculate_statistics() in
+'lactation_calculations.py', with the same keys, types and rounding (Decimals rounded half to even to 2 or 4 places,
+and whole number merit scores), so that the CSV file, spreadsheet, summary statistics and charts are unchanged.
+The lactation columns are loaded into arrays, the percentages and scores are calculated for the whole herd at once,
+and the five ranks come from stable argsorts instead of five Python sorts.
+
+The Decimal values are loaded as int64 arrays of the value times 10**places (see 'max_decimal_places'), so that the
+rounded statistics are calculated exactly, with integer division.  Tolerances, compared with the Decimal engine:
+
+    fat %, protein %, milk solids %,    the same, unless an input has more than 'max_decimal_places' decimal places
+    weight score, merit score           (it is rounded to that first), when they may differ in the last place
+
+    ranks                               the same, except that cows whose unrounded values differ by less than
+                                        float64 precision (~1e-15 relative) may swap places.  Also, the Decimal
+                                        engine calculates to 28 significant figures, so it can split cows with
+                                        exactly equal merit scores (eg. 734.3578 and 734.3578000...0003), which
+                                        this engine ranks in file order.
+
+Cows with equal values keep their order in the file, as with the Decimal engine's stable sorts.
+
+It returns Decimals with the same number of decimal places as the Decimal engine, so the statistics are displayed
+the same way.  (See 'statistics_engine_check.py' to compare the engines on a lactation file.)
+"""
+from decimal import Decimal
+from operator import itemgetter
+
+import numpy as np
+
+
+# Most decimal places of the lactation values (kg, SCC, liveweight) that are calculated with exactly.  More than
+# this, and the merit score numerator could lose precision as a float64 (or overflow an int64).
+max_decimal_places = 3
+
+# Decimal columns of the lactation data used by the statistics.
+decimal_statistics_fields = ("fat", "protein", "milk", "milk_solids", "ave_SCC", "liveweight")
+
+# Values of the "group" statistic, indexed by group code.  (See _calculate_group in 'lactation_calculations.py'.)
+group_names = ("1", "2", "3")
+
+
+def calculate_statistics_numpy(cow_dict: dict) -> dict:
+    """
+    Raises ValueError if a cow's milk or liveweight is not more than 0, instead of dividing by it.
+    """
+    eartags = list(cow_dict)
+    all_lactation_data = [data["lactation_data"] for data in cow_dict.values()]
+
+    scaled_columns, scale = _load_scaled_columns(all_lactation_data=all_lactation_data)
+    fat, protein, milk, milk_solids, ave_scc, liveweight = scaled_columns
+    lact_len = np.fromiter(map(itemgetter("lact_len"), all_lactation_data), dtype=np.int64, count=len(eartags))
+    lact_num = np.fromiter(map(itemgetter("lact_num"), all_lactation_data), dtype=np.int64, count=len(eartags))
+
+    _check_positive(eartags=eartags, milk=milk, liveweight=liveweight)
+
+    # Score = 1.33 * fat + 3.13 * protein - 0.072 * milk - 0.4 * SCC, times 1000 * scale, as an integer.
+    # Merit score = max(Score * weight score, 0) = max(score_numerator * milk_solids / merit_denominator, 0)
+    score_numerator = 1330 * fat + 3130 * protein - 72 * milk - 400 * ave_scc
+    merit_numerator = np.maximum(score_numerator * milk_solids, 0)
+    merit_denominator = 1000 * scale * liveweight
+
+    # Ranked on the unrounded values, as by the Decimal engine.  Each is a single division of exact integers, so
+    # cows with equal values (eg. the many merit scores of 0) tie exactly.
+    _store_statistics(
+        cow_dict=cow_dict,
+        eartags=eartags,
+        group_codes=_group_codes(lact_len=lact_len, lact_num=lact_num),
+        fat_percentages=_divide_rounded(10_000 * fat, milk),
+        protein_percentages=_divide_rounded(10_000 * protein, milk),
+        milk_solids_percentages=_divide_rounded(10_000 * milk_solids, milk),
+        weight_scores=_divide_rounded(10_000 * milk_solids, liveweight),
+        merit_scores=_divide_rounded(merit_numerator, merit_denominator),
+        merit_score_values=merit_numerator / merit_denominator,
+        weight_score_values=milk_solids / liveweight,
+        milk_solids=milk_solids,
+        protein_percentage_values=protein / milk,
+        ave_scc=ave_scc,
+    )
+
+    return cow_dict
+
+
+def _check_positive(eartags: list, milk: np.ndarray, liveweight: np.ndarray):
+    for values, field_name in ((milk, "305 day Milk kg"), (liveweight, "Liveweight")):
+        invalid_indices = np.flatnonzero(values <= 0)
+        if len(invalid_indices):
+            raise ValueError(f"'{field_name}' must be more than 0 (cow '{eartags[invalid_indices[0]]}')")
+
+
+def _group_codes(lact_len: np.ndarray, lact_num: np.ndarray) -> np.ndarray:
+    """
+    Indices into 'group_names'.
+    """
+    full_lactation = (220 <= lact_len) & (lact_len <= 305)
+    group_codes = np.full(len(lact_len), group_names.index("3"))
+    group_codes[full_lactation & (3 <= lact_num) & (lact_num <= 8)] = group_names.index("1")
+    group_codes[full_lactation & (1 <= lact_num) & (lact_num <= 2)] = group_names.index("2")
+    return group_codes
+
+
+def _store_statistics(
+        cow_dict: dict,
+        eartags: list,
+        group_codes: np.ndarray,
+        fat_percentages: np.ndarray,
+        protein_percentages: np.ndarray,
+        milk_solids_percentages: np.ndarray,
+        weight_scores: np.ndarray,
+        merit_scores: np.ndarray,
+        merit_score_values: np.ndarray,
+        weight_score_values: np.ndarray,
+        milk_solids: np.ndarray,
+        protein_percentage_values: np.ndarray,
+        ave_scc: np.ndarray,
+):
+    """
+    Add the "statistics" dict to each cow.  The percentages are rounded integers of hundredths, and the weight scores
+    of ten thousandths.  The ranks are of the '_values' (and milk solids and SCC) arrays, which may be scaled.
+    """
+    columns = zip(
+        eartags,
+        group_codes.tolist(),
+        _decimals(fat_percentages, places=2),
+        _decimals(protein_percentages, places=2),
+        _decimals(milk_solids_percentages, places=2),
+        _decimals(weight_scores, places=4),
+        merit_scores.tolist(),
+        _ranks(-merit_score_values),
+        _ranks(-weight_score_values),
+        _ranks(-milk_solids),
+        _ranks(-protein_percentage_values),
+        _ranks(ave_scc),
+    )
+
+    for (eartag, group_code, fat_pct, protein_pct, milk_solids_pct, weight, merit, merit_rank, weight_rank,
+         milk_solids_rank, protein_pct_rank, scc_rank) in columns:
+        cow_dict[eartag]["statistics"] = {
+            "group": group_names[group_code],
+            "fat_percentage": fat_pct,
+            "protein_percentage": protein_pct,
+            "milk_solids_percentage": milk_solids_pct,
+            "weight_score": weight,
+            "merit_score": merit,
+            "merit_score_rank": merit_rank,
+            "weight_score_rank": weight_rank,
+            "milk_solids_rank": milk_solids_rank,
+            "protein_percentage_rank": protein_pct_rank,
+            "SCC_rank": scc_rank,
+        }
+
+
+def _load_scaled_columns(all_lactation_data: list[dict]) -> tuple[list[np.ndarray], int]:
+    """
+    The 'decimal_statistics_fields' as int64 arrays of the values times 'scale', which is the smallest power of 10
+    (up to 10**max_decimal_places) that makes every value a whole number.  Returns (columns, scale).
+    """
+    values = np.array([
+        np.fromiter(map(float, map(itemgetter(field), all_lactation_data)), dtype=np.float64,
+                    count=len(all_lactation_data))
+        for field in decimal_statistics_fields
+    ])
+
+    for places in range(max_decimal_places + 1):
+        scaled_values = values * 10**places
+        whole_values = np.rint(scaled_values)
+        if np.all(np.abs(scaled_values - whole_values) < 1e-6):
+            break
+
+    return list(whole_values.astype(np.int64)), 10**places
+
+
+def _divide_rounded(numerators: np.ndarray, denominators: np.ndarray) -> np.ndarray:
+    """
+    Integer division, rounded half to even.  Denominators must be positive.
+    """
+    quotients, remainders = np.divmod(numerators, denominators)
+    round_up = (2 * remainders > denominators) | ((2 * remainders == denominators) & (quotients % 2 == 1))
+    return quotients + round_up
+
+
+def _decimals(values: np.ndarray, places: int) -> list[Decimal]:
+    """
+    Integers, as Decimals with 'places' decimal places (trailing zeros kept, as from round(Decimal, places)).
+    """
+    return [Decimal(x).scaleb(-places) for x in values.tolist()]
+
+
+def _ranks(sort_values: np.ndarray) -> list[int]:
+    """
+    0-based rank of each cow, smallest sort value first.  Ties keep the original order.
+    """
+    ranks = np.empty(len(sort_values), dtype=np.int64)
+    ranks[np.argsort(sort_values, kind="stable")] = np.arange(len(sort_values))
+    return ranks.tolist()
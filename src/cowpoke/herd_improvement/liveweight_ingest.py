@@ -0,0 +1,202 @@
+"""
+Liveweights of the cows in a lactation file, from one or more weighing files (eg. one per weigh date, or a HerdWatch
+and a Herd Companion export).
+
+Every row of every file is read once, in one streaming pass, and only the weight kept for each cow is held in memory.
+The files are joined to the lactation file by normalised eartag (see normalise_eartag), so "UK 7028816 01469" in a
+weighing file matches "UK702881601469" in the lactation file.  When a cow is weighed more than once, the weight kept
+is chosen by 'liveweight_selection_rules':
+
+    most_recent         the latest weigh date
+    nearest_calving     the weigh date nearest to the cow's calving date in the lactation file (or the latest, if
+                        she has no calving date)
+
+Weights without a weigh date are older than any with one.  Otherwise, of equal weigh dates, the last row read wins.
+"""
+import datetime
+from dataclasses import dataclass
+from decimal import Decimal, InvalidOperation
+from pathlib import Path
+
+
+liveweight_selection_rules = ("most_recent", "nearest_calving")
+
+# Date formats of the weigh dates and calving dates, eg. "08/10/2025" (HerdWatch) and "21/03/25" (Herd Companion).
+date_formats = ("%d/%m/%Y", "%d/%m/%y")
+
+herdwatch_field_name_lookup = {
+    "Tag": "eartag",
+    "First weight date": "date",
+    "First Weight": "liveweight",
+}
+herdcompanion_field_name_lookup = {
+    "Line No.": "line_number",
+    "Eartag": "eartag",
+    "Liveweight": "liveweight",
+    "Weigh Date": "date",
+}
+
+
+@dataclass(frozen=True)
+class LiveweightRecord:
+    eartag: str
+    liveweight: Decimal
+    weigh_date: datetime.date | None
+
+
+@dataclass
+class LiveweightJoinReport:
+    """
+    'matched_cows' have a weight from the weighing files, and 'estimated_cows' are given an estimated weight.
+    'unmatched_cows' are cows in the weighing files that are not in the lactation file.
+    """
+    files: int = 0
+    weights_read: int = 0
+    matched_cows: int = 0
+    estimated_cows: int = 0
+    unmatched_cows: int = 0
+
+
+def normalise_eartag(eartag: str) -> str:
+    """
+    Upper case, without spaces, hyphens or dots.
+    """
+    return "".join(eartag.split()).replace("-", "").replace(".", "").upper()
+
+
+def parse_date(text: str) -> datetime.date | None:
+    """
+    None if blank, or not in one of the 'date_formats'.
+    """
+    for date_format in date_formats:
+        try:
+            return datetime.datetime.strptime(text.strip(), date_format).date()
+        except ValueError:
+            continue
+    return None
+
+
+def iter_liveweight_records(liveweight_file_path: str | Path):
+    """
+    The weights in a HerdWatch or Herd Companion liveweight CSV file, in file order.  Rows without a weight are
+    skipped.
+    """
+    with open(liveweight_file_path) as f:
+        # First line(s) of file may be empty or bogus, because the HerdWatch logo was there.
+
+        for _ in range(100):  # Header should be in first 100 lines.
+            header = f.readline()
+            if header.startswith("Tag"):
+                field_lookup = herdwatch_field_name_lookup
+                break
+            if header.startswith("Line"):
+                field_lookup = herdcompanion_field_name_lookup
+                break
+        else:
+            raise ValueError(f"Could not find a HerdWatch or Herd Companion header in liveweight file "
+                             f"'{Path(liveweight_file_path).name}'")
+
+        header_names = [x.strip() for x in header.split(",")]  # x.strip() to remove newline "\n" from last header name.
+        fields = [field_lookup.get(x, "_") for x in header_names]
+        field_indices = {
+            field: idx for idx, field in enumerate(fields)
+        }
+        date_index = field_indices.get("date")
+
+        for row in f:
+            row_values = [x.strip() for x in row.split(",")]
+            if row_values[0] == "":
+                continue
+
+            eartag = row_values[field_indices["eartag"]]
+            if eartag == "":  # If blank 'eartag', must be using Herd Companion format with 'Line No.' field.
+                eartag = row_values[field_indices["line_number"]]
+
+            liveweight = row_values[field_indices["liveweight"]]
+            if liveweight == "":
+                continue
+            try:
+                liveweight = Decimal(liveweight)
+            except InvalidOperation:
+                raise ValueError(f"Could not convert 'liveweight' value '{liveweight}' into Decimal")
+
+            weigh_date = parse_date(row_values[date_index]) if date_index is not None else None
+
+            yield LiveweightRecord(eartag=eartag, liveweight=liveweight, weigh_date=weigh_date)
+
+
+def select_liveweights(
+        liveweight_file_paths: list,
+        calving_dates: dict[str, datetime.date],
+        liveweight_selection: str = "most_recent",
+) -> tuple[dict[str, LiveweightRecord], LiveweightJoinReport]:
+    """
+    The weight kept for each cow in the files, keyed by normalised eartag.  'calving_dates' are also keyed by
+    normalised eartag.  Returns (liveweights, join report with only 'files' and 'weights_read' filled in).
+    """
+    if liveweight_selection not in liveweight_selection_rules:
+        raise ValueError(f"Unknown liveweight selection '{liveweight_selection}'.  "
+                         f"Expected one of: {', '.join(liveweight_selection_rules)}")
+
+    def sort_key(record: LiveweightRecord, calving_date: datetime.date | None) -> tuple:
+        """
+        Larger is better.
+        """
+        if record.weigh_date is None:
+            return 0, 0
+        if liveweight_selection == "nearest_calving" and calving_date is not None:
+            return 1, -abs((record.weigh_date - calving_date).days)
+        return 1, record.weigh_date.toordinal()
+
+    liveweights = {}
+    join_report = LiveweightJoinReport(files=len(liveweight_file_paths))
+
+    for liveweight_file_path in liveweight_file_paths:
+        for record in iter_liveweight_records(liveweight_file_path=liveweight_file_path):
+            join_report.weights_read += 1
+            key = normalise_eartag(record.eartag)
+            kept_record = liveweights.get(key)
+            if kept_record is None or (sort_key(record, calving_dates.get(key))
+                                       >= sort_key(kept_record, calving_dates.get(key))):
+                liveweights[key] = record
+
+    return liveweights, join_report
+
+
+def add_liveweights_to_cow_dict(
+        cow_dict: dict,
+        liveweight_file_paths: list,
+        liveweight_selection: str = "most_recent",
+) -> LiveweightJoinReport:
+    """
+    Set the "liveweight" of each cow in the cow dict that is in the weighing files.  (The others are estimated
+    later, by _add_estimated_weights_to_cow_dict in 'lactation_calculations.py'.)
+    """
+    cow_eartags = {normalise_eartag(eartag): eartag for eartag in cow_dict}
+
+    calving_dates = {}
+    if liveweight_selection == "nearest_calving":
+        for key, eartag in cow_eartags.items():
+            calving_date = parse_date(cow_dict[eartag]["lactation_data"].get("calving_date", ""))
+            if calving_date is not None:
+                calving_dates[key] = calving_date
+
+    liveweights, join_report = select_liveweights(
+        liveweight_file_paths=liveweight_file_paths,
+        calving_dates=calving_dates,
+        liveweight_selection=liveweight_selection,
+    )
+
+    for key, record in liveweights.items():
+        eartag = cow_eartags.get(key)
+        if eartag is None:
+            join_report.unmatched_cows += 1
+            continue
+        lactation_data = cow_dict[eartag]["lactation_data"]
+        lactation_data["liveweight"] = record.liveweight
+        lactation_data["liveweight_estimated"] = False
+        join_report.matched_cows += 1
+
+    join_report.estimated_cows = len(cow_dict) - join_report.matched_cows
+
+    return join_report
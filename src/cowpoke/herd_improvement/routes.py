@@ -1,20 +1,57 @@
-import datetime
+import asyncio
+import functools
 import logging
-import shutil
+import os
+from pathlib import Path
 
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import FileResponse, HTMLResponse
 from fastapi.templating import Jinja2Templates
 
+from src.cowpoke.herd_improvement.create_powerpoint import powerpoint_chart_names
 from src.cowpoke.herd_improvement.lactation_calculations import (
-    calculate_lactation_results, DownloadFilePaths, ImageFilePaths,
+    calculate_lactation_results,
+    create_powerpoint_from_report_data,
+    DownloadFilePaths,
+    ImageFilePaths,
+    parse_lactation_bands,
+    render_lactation_chart_from_report_data,
 )
+from src.cowpoke.herd_improvement.liveweight_ingest import liveweight_selection_rules
+from src.cowpoke.run_directories import (
+    calculate_run_id,
+    create_staging_directory,
+    discard_staging_directory,
+    load_run_results,
+    publish_run_directory,
+    run_directory,
+    save_run_results,
+    write_file_atomically,
+)
+from src.cowpoke.stage_timing import record_stage_timings, recorded_stage, timed_run
+from src.cowpoke.worker_pools import run_in_worker_pool
 
 
 logger = logging.getLogger(__name__)
 
 templates = Jinja2Templates(directory=["cowpoke/herd_improvement/templates", "templates"])
 
+# Uploaded files in each run directory.  (See 'run_directories.py'.)
+lactation_file_name = "lactation.csv"
+liveweight_file_name_format = "liveweight_{}.csv"  # Numbered from 1, in the order they were uploaded.
+
+# The charts and PowerPoint file of each run are created from this file when they are first downloaded.
+report_data_file_name = "lactation_report_data.json"
+
+# Per-cow statistics engine.  (See 'lactation_statistics_engines' in 'lactation_calculations.py'.)
+# "numpy" (the default) for the much faster vectorised engine, or "decimal" for the original Decimal arithmetic.
+# Uploads ticked as audit runs always use the Decimal engine.
+lactation_statistics_engine = os.environ.get("COWPOKE_LACTATION_STATISTICS_ENGINE", "numpy")
+audit_lactation_statistics_engine = "decimal"
+
+# Charts and PowerPoint files being created by this worker, keyed by (run ID, file name), so each is created once.
+run_file_tasks: dict[tuple[str, str], asyncio.Task] = {}
+
 router = APIRouter()
 
 
@@ -29,96 +66,285 @@ async def lactation_demo(request: Request):
     demo_lactation_file = "cowpoke/herd_improvement/demo_data/LatestLactation_2026_02_20.csv"
     demo_liveweigh_file = "cowpoke/herd_improvement/demo_data/Herdwatch_Liveweight_2025_10_08.csv"
 
-    lactation_results = calculate_lactation_results(
-        lactation_file_path=demo_lactation_file,
-        liveweight_file_path=demo_liveweigh_file,
-        output_file_path=DownloadFilePaths.output_csv,
-    )
-    template_context = {
-        "stats": lactation_results,
-        "farm_name": "Old MacDonald's",
-        "utcnow": str(datetime.datetime.now(datetime.UTC)).replace(" ", "::"),
-    }
-
-    template_resp = templates.TemplateResponse(request={}, name="lactation_results.html", context=template_context)
+    with open(demo_lactation_file, "rb") as f:
+        lactation_bytes = f.read()
+    with open(demo_liveweigh_file, "rb") as f:
+        liveweight_bytes = f.read()
 
-    return template_resp
+    return run_herd_improvement_analysis(
+        farm_name="Old MacDonald's", lactation_bytes=lactation_bytes, liveweight_bytes_list=[liveweight_bytes]
+    )
 
 
 @router.post("/cowpoke/herd-improvement/uploads", response_class=HTMLResponse)
 async def lactation_upload(request: Request):
-    lactation_temp_file_path = "temp/cowpoke/herd_improvement/lactation.csv"
-    liveweight_temp_file_path = "temp/cowpoke/herd_improvement/liveweight.csv"
-
     async with request.form() as form:
         farm_name = form["farm_name"]
+        lactation_bands_text = form.get("lactation_bands", "")  # Optional custom bands, eg. "1 / 2-3 / 4-6 / 7+".
+        liveweight_selection = form.get("liveweight_selection", "most_recent")
+        audit_run = bool(form.get("audit_run"))  # Checkbox.
 
         uploaded_lactation_file = form["lactation_file"]
-        file_object = uploaded_lactation_file.file  # File object is in 'bytes' mode, not 'string' mode.
-        with open(lactation_temp_file_path, "wb") as g:
-            shutil.copyfileobj(file_object, g)  # Save locally so can be re-opened in 'string' mode.
-        lactation_temp_file = lactation_temp_file_path
-
-        uploaded_liveweight_file = form.get("liveweight_file")  # Liveweight file upload is optional.
-        if uploaded_liveweight_file:
-            file_object = uploaded_liveweight_file.file  # File object is in 'bytes' mode, not 'string' mode.
-            with open(liveweight_temp_file_path, "wb") as g:
-                shutil.copyfileobj(file_object, g)  # Save locally so can be re-opened in 'string' mode.
-            liveweight_temp_file = liveweight_temp_file_path
-        else:
-            liveweight_temp_file = None
+        lactation_bytes = await uploaded_lactation_file.read()
+
+        # Liveweight files are optional, and there may be several (eg. one per weigh date).
+        liveweight_bytes_list = [
+            await uploaded_liveweight_file.read()
+            for uploaded_liveweight_file in form.getlist("liveweight_file")
+            if uploaded_liveweight_file  # "" if no file was selected.
+        ]
+
+    return run_herd_improvement_analysis(
+        farm_name=farm_name,
+        lactation_bytes=lactation_bytes,
+        liveweight_bytes_list=liveweight_bytes_list,
+        lactation_bands_text=lactation_bands_text,
+        liveweight_selection=liveweight_selection,
+        statistics_engine=audit_lactation_statistics_engine if audit_run else lactation_statistics_engine,
+    )
+
+
+@router.get("/cowpoke/herd-improvement/download/{run_id}/{result_filename}")
+async def lactation_calculations_download(run_id: str, result_filename: str, farm_name: str = ""):
+    """
+    The farm name isn't an input of the run, so it is given with the PowerPoint file download, for the title slide.
+    """
+    file_lookup = {
+        "lactation-calculations.csv": DownloadFilePaths.output_csv,
+        "report.xlsx": DownloadFilePaths.output_spreadsheet,
+        "blockwise-herd-report.pptx": DownloadFilePaths.output_powerpoint,
+    }
+    if result_filename not in file_lookup:
+        raise HTTPException(status_code=404, detail="Unknown file")
+
+    if file_lookup[result_filename] == DownloadFilePaths.output_powerpoint:
+        file_path = await get_or_create_run_file(
+            run_id=run_id,
+            file_name=powerpoint_file_name(farm_name=farm_name),
+            create_content=functools.partial(create_powerpoint_file, farm_name=farm_name),
+        )
+    else:
+        file_path = run_file_path(run_id=run_id, file_name=file_lookup[result_filename].name)
+
+    return FileResponse(path=file_path, filename=result_filename.replace("-", "_"))
 
+
+@router.get("/cowpoke/herd-improvement/images/{run_id}/{image_file}")
+async def result_images(run_id: str, image_file: str):
+    file_lookup = {
+        "cow-age-chart.svg": "cow_age_chart",
+        "scc-histogram.svg": "scc_histogram",
+        "protein-pct-histogram.svg": "protein_pct_histogram",
+        "milk-solids-histogram.svg": "milk_solids_histogram",
+        "merit-score-histogram.svg": "merit_score_histogram",
+        "liveweight-histogram.svg": "liveweight_histogram",
+        "liveweight-milk-solids-chart.svg": "liveweight_milk_solids_chart",
+        "efficiency-milk-solids-chart.svg": "efficiency_milk_solids_chart",
+        "cow-performance-chart.svg": "cow_performance_chart",
+        "milk-solids-by-age-chart.svg": "milk_solids_by_age_chart",
+        "milk-solids-by-age-boxplot.svg": "milk_solids_by_age_boxplot",
+        "efficiency-by-age-chart.svg": "efficiency_by_age_chart",
+        "efficiency-by-age-boxplot.svg": "efficiency_by_age_boxplot",
+        "milk-solids-vs-scc-chart.svg": "milk_solids_vs_scc_chart",
+        "efficiency-vs-scc-chart.svg": "efficiency_vs_scc_chart",
+    }
+    if image_file not in file_lookup:
+        raise HTTPException(status_code=404, detail="Unknown image")
+
+    file_path = await get_chart_file_path(run_id=run_id, chart_name=file_lookup[image_file], image_format="svg")
+    download_filename = image_file.replace("-", "_")
+    return FileResponse(path=file_path, filename=download_filename)
+
+
+def run_herd_improvement_analysis(
+        farm_name: str,
+        lactation_bytes: bytes,
+        liveweight_bytes_list: list[bytes],
+        lactation_bands_text: str = "",
+        liveweight_selection: str = "most_recent",
+        statistics_engine: str = lactation_statistics_engine,
+) -> HTMLResponse:
+    """
+    Run the analysis in a staging directory, then publish it as the run directory for these inputs.  If the same
+    files were uploaded before with the same options, and the run directory still exists, its results are shown
+    instead.  (The farm name doesn't affect the results, so it isn't part of the run ID.)
+    """
     try:
-        lactation_results = calculate_lactation_results(
-            lactation_file_path=lactation_temp_file,
-            liveweight_file_path=liveweight_temp_file,
-            output_file_path=DownloadFilePaths.output_csv,
+        custom_lactation_bands = parse_lactation_bands(text=lactation_bands_text)
+        if liveweight_selection not in liveweight_selection_rules:
+            raise ValueError(f"Unknown liveweight selection '{liveweight_selection}'")
+    except ValueError as err:
+        logger.error(err)
+        template_resp = templates.TemplateResponse(
+            request={}, name="lactation_results_error.html", context={"error_message": err}
         )
+        return template_resp
+
+    run_id = calculate_run_id(
+        "herd_improvement",
+        statistics_engine,  # The engines may round a few statistics differently.
+        "/".join(band.description for band in custom_lactation_bands),  # In the report data.
+        liveweight_selection,
+        lactation_bytes,
+        str(len(liveweight_bytes_list)),  # So that the lactation file can't be mistaken for a liveweight file.
+        *liveweight_bytes_list,
+    )
+
+    lactation_results = load_run_results(run_id=run_id)
+    if lactation_results is not None:
+        return render_lactation_results(lactation_results=lactation_results, farm_name=farm_name, run_id=run_id)
+
+    staging_dir = create_staging_directory(run_id=run_id)
+
+    try:
+        lactation_file_path = staging_dir.joinpath(lactation_file_name)
+        lactation_file_path.write_bytes(lactation_bytes)
+
+        liveweight_file_paths = []
+        for k, liveweight_bytes in enumerate(liveweight_bytes_list):
+            liveweight_file_path = staging_dir.joinpath(liveweight_file_name_format.format(k + 1))
+            liveweight_file_path.write_bytes(liveweight_bytes)
+            liveweight_file_paths.append(liveweight_file_path)
+
+        download_file_paths = DownloadFilePaths.in_directory(staging_dir)
+
+        with timed_run(pipeline="herd_improvement") as stage_timings:
+            lactation_results = calculate_lactation_results(
+                lactation_file_path=lactation_file_path,
+                liveweight_file_paths=liveweight_file_paths,
+                output_file_path=download_file_paths.output_csv,
+                download_file_paths=download_file_paths,
+                image_file_paths=ImageFilePaths.in_directory(staging_dir),
+                report_data_file_path=staging_dir.joinpath(report_data_file_name),
+                statistics_engine=statistics_engine,
+                custom_lactation_bands=custom_lactation_bands,
+                liveweight_selection=liveweight_selection,
+            )
+
+        save_run_results(run_dir=staging_dir, results=lactation_results)
     except ValueError as err:
+        discard_staging_directory(staging_dir=staging_dir)
         logger.error(err)
         template_resp = templates.TemplateResponse(
             request={}, name="lactation_results_error.html", context={"error_message": err}
         )
         return template_resp
+    except BaseException:
+        discard_staging_directory(staging_dir=staging_dir)
+        raise
+
+    publish_run_directory(staging_dir=staging_dir, run_id=run_id)
+    record_stage_timings(timings=stage_timings, run_id=run_id)
+
+    return render_lactation_results(lactation_results=lactation_results, farm_name=farm_name, run_id=run_id)
 
+
+def render_lactation_results(lactation_results: dict, farm_name: str, run_id: str) -> HTMLResponse:
     template_context = {
         "stats": lactation_results,
         "farm_name": farm_name,
-        "utcnow": str(datetime.datetime.now(datetime.UTC)).replace(" ", "::"),
+        "run_id": run_id,
     }
     template_resp = templates.TemplateResponse(request={}, name="lactation_results.html", context=template_context)
 
     return template_resp
 
 
-@router.get("/cowpoke/herd-improvement/download/{result_filename}")
-async def lactation_calculations_download(result_filename: str):
-    file_lookup = {
-        "lactation-calculations.csv": DownloadFilePaths.output_csv,
-        "report.xlsx": DownloadFilePaths.output_spreadsheet,
-        "blockwise-herd-report.pptx": DownloadFilePaths.output_powerpoint,
-    }
-    return FileResponse(path=file_lookup[result_filename], filename=result_filename.replace("-", "_"))
+def run_file_path(run_id: str, file_name: str) -> Path:
+    """
+    Path of a file in a run directory.  Raises 404 if the run ID is invalid, or the run has been garbage-collected.
+    """
+    try:
+        file_path = run_directory(run_id=run_id).joinpath(file_name)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Unknown run")
 
+    if not file_path.exists():
+        raise HTTPException(status_code=404, detail="Results have expired.  Please upload again.")
 
-@router.get("/cowpoke/herd-improvement/images/{image_file}")
-async def result_images(image_file: str):
-    file_lookup = {
-        "cow-age-chart.svg": ImageFilePaths.cow_age_chart,
-        "scc-histogram.svg": ImageFilePaths.scc_histogram,
-        "protein-pct-histogram.svg": ImageFilePaths.protein_pct_histogram,
-        "milk-solids-histogram.svg": ImageFilePaths.milk_solids_histogram,
-        "merit-score-histogram.svg": ImageFilePaths.merit_score_histogram,
-        "liveweight-histogram.svg": ImageFilePaths.liveweight_histogram,
-        "liveweight-milk-solids-chart.svg": ImageFilePaths.liveweight_milk_solids_chart,
-        "efficiency-milk-solids-chart.svg": ImageFilePaths.efficiency_milk_solids_chart,
-        "cow-performance-chart.svg": ImageFilePaths.cow_performance_chart,
-        "milk-solids-by-age-chart.svg": ImageFilePaths.milk_solids_by_age_chart,
-        "milk-solids-by-age-boxplot.svg": ImageFilePaths.milk_solids_by_age_boxplot,
-        "efficiency-by-age-chart.svg": ImageFilePaths.efficiency_by_age_chart,
-        "efficiency-by-age-boxplot.svg": ImageFilePaths.efficiency_by_age_boxplot,
-        "milk-solids-vs-scc-chart.svg": ImageFilePaths.milk_solids_vs_scc_chart,
-        "efficiency-vs-scc-chart.svg": ImageFilePaths.efficiency_vs_scc_chart,
-    }
-    download_filename = image_file.replace("-", "_")
-    return FileResponse(path=file_lookup[image_file], filename=download_filename)
+    return file_path
+
+
+async def get_chart_file_path(run_id: str, chart_name: str, image_format: str) -> Path:
+    """
+    Path of a chart in a run directory, drawing the chart first if it is the first time it has been asked for.
+    """
+    async def render_chart(run_dir: Path) -> bytes:
+        with recorded_stage(pipeline="herd_improvement", stage="chart_rendering", run_id=run_id):
+            return await run_in_worker_pool(
+                "charts",
+                render_lactation_chart_from_report_data,
+                run_dir.joinpath(report_data_file_name),
+                chart_name,
+                image_format,
+            )
+
+    file_name = getattr(ImageFilePaths, chart_name).with_suffix(f".{image_format}").name
+    return await get_or_create_run_file(run_id=run_id, file_name=file_name, create_content=render_chart)
+
+
+def powerpoint_file_name(farm_name: str) -> str:
+    """
+    A PowerPoint file is kept in the run directory for each farm name it has been downloaded with.
+    """
+    output_powerpoint = DownloadFilePaths.output_powerpoint
+    return f"{output_powerpoint.stem}_{calculate_run_id(farm_name)}{output_powerpoint.suffix}"
+
+
+async def create_powerpoint_file(run_dir: Path, farm_name: str) -> bytes:
+    """
+    Draw the PNG charts in the PowerPoint file (the ones not drawn yet, all at once), then create the file.
+    """
+    run_id = run_dir.name
+
+    await asyncio.gather(*(
+        get_chart_file_path(run_id=run_id, chart_name=chart_name, image_format="png")
+        for chart_name in powerpoint_chart_names
+    ))
+
+    with recorded_stage(pipeline="herd_improvement", stage="powerpoint", run_id=run_id):
+        return await run_in_worker_pool(
+            "analysis",
+            create_powerpoint_from_report_data,
+            run_dir.joinpath(report_data_file_name),
+            ImageFilePaths.in_directory(run_dir),
+            farm_name,
+        )
+
+
+async def get_or_create_run_file(run_id: str, file_name: str, create_content) -> Path:
+    """
+    Path of a file in a run directory.  If the file doesn't exist yet, it is created from the awaited bytes of
+    'create_content(run_dir)', unless this worker is already creating it.  Raises 404 if the run has expired.
+    """
+    try:
+        run_dir = run_directory(run_id=run_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Unknown run")
+
+    file_path = run_dir.joinpath(file_name)
+
+    if file_path.exists():  # Created before, or by an analysis from before files were created on demand.
+        return file_path
+
+    run_file_path(run_id=run_id, file_name=report_data_file_name)  # Raises 404 if expired.
+
+    task_key = (run_id, file_name)
+    task = run_file_tasks.get(task_key)
+
+    if task is None:  # Not being created by this worker (though maybe by another one - which is harmless).
+        task = asyncio.create_task(create_run_file(file_path=file_path, create_content=create_content))
+        run_file_tasks[task_key] = task
+        task.add_done_callback(lambda _: run_file_tasks.pop(task_key, None))
+
+    try:
+        await asyncio.shield(task)  # If this request is cancelled, keep going for the other requests.
+    except FileNotFoundError:  # Run directory removed by garbage collection in the meantime.
+        raise HTTPException(status_code=404, detail="Results have expired.  Please upload again.")
+
+    return file_path
+
+
+async def create_run_file(file_path: Path, create_content):
+    content = await create_content(file_path.parent)
+    write_file_atomically(file_path=file_path, content=content)
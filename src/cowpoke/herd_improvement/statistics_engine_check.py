@@ -0,0 +1,118 @@
+"""
+Check of the NumPy lactation statistics engine against the Decimal engine, on a lactation file.
+
+Each engine's statistics must be within 'engine_tolerances' of the Decimal engine's, and its ranks must put the
+Decimal engine's values in order (to within the same tolerances, so cows with near-equal values may swap places):
+
+    python -m src.cowpoke.herd_improvement.statistics_engine_check lactation.csv --liveweight-files weights.csv
+
+Run from the repository root.  Prints the largest difference of each statistic, and exits with status 1 if any is
+out of tolerance.
+"""
+import argparse
+import copy
+import sys
+import time
+from decimal import Decimal
+from pathlib import Path
+
+from src.cowpoke.herd_improvement.lactation_calculations import (
+    _add_estimated_weights_to_cow_dict,
+    _parse_lactation_csv_file,
+    lactation_statistics_engines,
+)
+from src.cowpoke.herd_improvement.liveweight_ingest import add_liveweights_to_cow_dict
+
+
+demo_lactation_file = Path(__file__).parent.joinpath("demo_data", "LatestLactation_2026_02_20.csv")
+
+# Largest difference allowed from the Decimal engine.  (See 'lactation_statistics_numpy.py'.)
+engine_tolerances = {
+    "fat_percentage": Decimal("0.01"),
+    "protein_percentage": Decimal("0.01"),
+    "milk_solids_percentage": Decimal("0.01"),
+    "weight_score": Decimal("0.0001"),
+    "merit_score": Decimal(1),
+}
+
+# Ranks, with the value they rank, whether it is in the "statistics" or "lactation_data" dict, and the tolerance.
+# The largest value is ranked 0, except for SCC.
+ranked_values = {
+    "merit_score_rank": ("statistics", "merit_score", engine_tolerances["merit_score"]),
+    "weight_score_rank": ("statistics", "weight_score", engine_tolerances["weight_score"]),
+    "milk_solids_rank": ("lactation_data", "milk_solids", Decimal(0)),
+    "protein_percentage_rank": ("statistics", "protein_percentage", engine_tolerances["protein_percentage"]),
+    "SCC_rank": ("lactation_data", "ave_SCC", Decimal(0)),
+}
+
+
+def calculate_with_engine(cow_dict: dict, statistics_engine: str) -> tuple[dict, float]:
+    """
+    A copy of the cow dict with the engine's statistics added.  Returns (cow dict, seconds).
+    """
+    cow_dict = copy.deepcopy(cow_dict)
+    start = time.perf_counter()
+    cow_dict = lactation_statistics_engines[statistics_engine](cow_dict=cow_dict)
+    return cow_dict, time.perf_counter() - start
+
+
+def compare_statistics(expected_cow_dict: dict, cow_dict: dict) -> list[str]:
+    """
+    A line per statistic and rank, with the number of cows that differ from 'expected_cow_dict' and the largest
+    difference.  Lines of differences out of tolerance start with "FAIL".
+    """
+    lines = []
+
+    for field, tolerance in engine_tolerances.items():
+        differences = [
+            abs(Decimal(data["statistics"][field]) - Decimal(expected_cow_dict[eartag]["statistics"][field]))
+            for eartag, data in cow_dict.items()
+        ]
+        max_difference = max(differences, default=Decimal(0))
+        status = "FAIL" if max_difference > tolerance else "ok"
+        num_different = sum(1 for x in differences if x)
+        lines.append(f"{status:<6}{field:<28}{num_different:>8} cows differ, largest difference {max_difference}")
+
+    for rank_field, (source, field, tolerance) in ranked_values.items():
+        sign = 1 if rank_field == "SCC_rank" else -1
+        eartags_by_rank = sorted(cow_dict, key=lambda eartag: cow_dict[eartag]["statistics"][rank_field])
+        values = [sign * Decimal(expected_cow_dict[eartag][source][field]) for eartag in eartags_by_rank]
+        max_disorder = max((x - y for x, y in zip(values, values[1:])), default=Decimal(0))
+        max_disorder = max(max_disorder, Decimal(0))
+        status = "FAIL" if max_disorder > tolerance else "ok"
+        num_different = sum(
+            1 for eartag, data in cow_dict.items()
+            if data["statistics"][rank_field] != expected_cow_dict[eartag]["statistics"][rank_field]
+        )
+        lines.append(f"{status:<6}{rank_field:<28}{num_different:>8} cows differ, largest disorder {max_disorder}")
+
+    return lines
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Compare the lactation statistics engines with the Decimal engine.")
+    parser.add_argument("lactation_file", nargs="?", default=str(demo_lactation_file))
+    parser.add_argument("--liveweight-files", nargs="*", default=[])
+    parser.add_argument("--engines", nargs="+", default=[x for x in lactation_statistics_engines if x != "decimal"])
+    args = parser.parse_args(argv)
+
+    cow_dict, _, _ = _parse_lactation_csv_file(lactation_file_path=args.lactation_file)
+    add_liveweights_to_cow_dict(cow_dict=cow_dict, liveweight_file_paths=args.liveweight_files)
+    cow_dict = _add_estimated_weights_to_cow_dict(cow_dict=cow_dict)
+
+    expected_cow_dict, decimal_seconds = calculate_with_engine(cow_dict=cow_dict, statistics_engine="decimal")
+    print(f"{len(cow_dict)} cows.  decimal: {decimal_seconds:.3f}s")
+
+    failed = False
+    for statistics_engine in args.engines:
+        engine_cow_dict, seconds = calculate_with_engine(cow_dict=cow_dict, statistics_engine=statistics_engine)
+        print(f"{statistics_engine}: {seconds:.3f}s")
+        lines = compare_statistics(expected_cow_dict=expected_cow_dict, cow_dict=engine_cow_dict)
+        print("\n".join(f"  {line}" for line in lines))
+        failed = failed or any(line.startswith("FAIL") for line in lines)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -82,3 +82,36 @@ class Insemination(SQLModel, table=True):
     cow_id: int = Field(foreign_key="cow.id")
     days_since_last_insemination: int | None
     status: str
+
+
+class NrrSeason(SQLModel, table=True):
+    """
+    The Non Return Rate results of one mating season on a farm, kept so that seasons can be compared.
+    The per-cow columns are packed arrays, one entry per cow.  (See 'non_return_rate/season_store.py'.)
+    """
+    id: int | None = Field(default=None, primary_key=True)
+    farm_id: int = Field(foreign_key="farm.id", index=True)
+    season_label: str
+    herd_size: int | None
+    season_start_date: date
+    season_end_date: date
+    total_inseminations: int
+    first_insemination_days: bytes  # Unsigned 16-bit days after season_start_date.
+    return_bitmasks: bytes  # Unsigned 8-bit.
+    bull_counters: str  # JSON.
+    run_id: str
+
+
+class FarmNrrTotals(SQLModel, table=True):
+    """
+    Running NRR counts of the inseminations recorded on a farm in one mating season, kept up to date as
+    inseminations are completed and deleted, so that the live NRR can be shown without reading every insemination.
+    (See 'non_return_rate/farm_totals.py'.)  Counts are lists in the order of 'nrr_count_fields'.
+    """
+    id: int | None = Field(default=None, primary_key=True)
+    farm_id: int = Field(foreign_key="farm.id", index=True)
+    season_start_year: int
+    nrr_counts: str  # JSON list.
+    bull_nrr_counts: str  # JSON {bull ID: {first insemination date: list}}.  A cow counts towards every bull
+                          # that inseminated her.
+    first_insemination_counts: str  # JSON {first insemination date: list}.
@@ -0,0 +1,201 @@
+"""
+Batch Non Return Rate analysis of many herds, eg. by a co-op office at the end of the mating season.
+
+A batch is a zip file of mating records CSV files (one per herd), plus a manifest CSV file with columns
+File, Farm Name and Herd Size.  (The manifest can also be a file called 'manifest.csv' inside the zip file.)
+Each herd is analysed as if it had been uploaded on its own, and the results are combined into a summary table,
+and a league table of bulls across all herds.
+"""
+import io
+import zipfile
+from dataclasses import dataclass
+from decimal import Decimal
+from pathlib import PurePosixPath
+
+
+manifest_file_name = "manifest.csv"
+
+max_batch_herds = 1000
+max_herd_file_bytes = 50 * 1024 * 1024
+
+
+@dataclass
+class BatchHerd:
+    file_name: str
+    farm_name: str
+    herd_size: str
+    input_bytes: bytes
+
+
+def read_batch_zip(zip_bytes: bytes, manifest_bytes: bytes | None = None) -> list[BatchHerd]:
+    """
+    Raises ValueError if the zip file can't be read, has no CSV files, or doesn't match the manifest.
+    Herds which are not in the manifest are named after their file, with an unknown herd size.
+    """
+    try:
+        zip_file = zipfile.ZipFile(io.BytesIO(zip_bytes))
+    except zipfile.BadZipFile:
+        raise ValueError("The uploaded file is not a zip file")
+
+    csv_members = {}
+
+    for member in zip_file.infolist():
+        path = PurePosixPath(member.filename)
+        if member.is_dir() or path.suffix.lower() != ".csv" or path.name.startswith(("._", "~")):
+            continue  # Eg. "__MACOSX/._herd.csv" and Excel lock files.
+        if path.name.lower() == manifest_file_name:
+            if manifest_bytes is None:
+                manifest_bytes = zip_file.read(member)
+            continue
+        if member.file_size > max_herd_file_bytes:
+            raise ValueError(f"'{path.name}' is too large ({member.file_size} bytes)")
+        if path.name in csv_members:
+            raise ValueError(f"More than one file called '{path.name}' in the zip file")
+        csv_members[path.name] = member
+
+    if not csv_members:
+        raise ValueError("No CSV files in the zip file")
+    if len(csv_members) > max_batch_herds:
+        raise ValueError(f"Too many CSV files in the zip file ({len(csv_members)}).  The maximum is {max_batch_herds}.")
+
+    manifest = parse_batch_manifest(manifest_bytes) if manifest_bytes is not None else {}
+
+    missing_files = [file_name for file_name in manifest if file_name not in csv_members]
+    if missing_files:
+        raise ValueError(f"Files in the manifest, but not in the zip file: {', '.join(missing_files)}")
+
+    herds = []
+
+    for file_name, member in sorted(csv_members.items()):
+        farm_name, herd_size = manifest.get(file_name, (PurePosixPath(file_name).stem, ""))
+        herds.append(BatchHerd(
+            file_name=file_name, farm_name=farm_name, herd_size=herd_size, input_bytes=zip_file.read(member)
+        ))
+
+    return herds
+
+
+def parse_batch_manifest(manifest_bytes: bytes) -> dict[str, tuple[str, str]]:
+    """
+    {file name: (farm name, herd size)}.  Columns are found by name, as in the mating records CSV files.
+    """
+    lines = manifest_bytes.decode("utf-8-sig", errors="replace").splitlines()
+    if not lines:
+        raise ValueError("The manifest is empty")
+
+    lower_case_fields = [x.strip().lower() for x in lines[0].split(",")]
+
+    file_idx = farm_idx = herd_size_idx = None
+    for idx, field in enumerate(lower_case_fields):
+        if "file" in field:
+            file_idx = idx
+        if "farm" in field:
+            farm_idx = idx
+        if "herd" in field or "size" in field:
+            herd_size_idx = idx
+
+    if file_idx is None:
+        raise ValueError(f"No 'File' column in the manifest header line: '{lines[0].strip()}'")
+
+    manifest = {}
+
+    for line_number, line in enumerate(lines[1:], start=2):
+        if not line.strip():
+            continue
+        parts = [x.strip() for x in line.split(",")]
+        if len(parts) <= file_idx or not parts[file_idx]:
+            raise ValueError(f"Manifest line {line_number}: no file name")
+
+        file_name = PurePosixPath(parts[file_idx]).name
+        farm_name = parts[farm_idx] if farm_idx is not None and farm_idx < len(parts) else ""
+        herd_size = parts[herd_size_idx] if herd_size_idx is not None and herd_size_idx < len(parts) else ""
+        manifest[file_name] = (farm_name or PurePosixPath(file_name).stem, herd_size)
+
+    return manifest
+
+
+def summarise_batch_herd(herd: BatchHerd, results: dict) -> dict:
+    """
+    One row of the batch summary table, from the result dict of one herd.
+    """
+    three_weeks = results["submission_statistics"][2]  # There are always at least three weeks.
+
+    return {
+        "file_name": herd.file_name,
+        "farm_name": herd.farm_name,
+        "herd_size": herd.herd_size,
+        "run_id": results["run_id"],
+        "total_cows_submitted": results["total_cows_submitted"],
+        "total_inseminations": results["total_inseminations"],
+        "three_week_submission_pct": three_weeks["cumulative_pct_herd"],
+        "six_weeks_nrr": results["nrr"]["six_weeks_confirmed"]["non_return_rate"],
+        "full_season_nrr": results["nrr"]["full_season_confirmed"]["non_return_rate"],
+        "error_message": "",
+    }
+
+
+def summarise_batch_totals(herd_results: list[dict]) -> dict:
+    """
+    Totals across all herds.  The combined NRRs are calculated from the summed cow counts, not averaged.
+    """
+    totals = {
+        "herds": len(herd_results),
+        "total_cows_submitted": sum(results["total_cows_submitted"] for results in herd_results),
+        "total_inseminations": sum(results["total_inseminations"] for results in herd_results),
+    }
+
+    for period in ("six_weeks_confirmed", "full_season_confirmed"):
+        eligible_cows = sum(results["nrr"][period]["eligible_cows"] for results in herd_results)
+        returned_cows = sum(results["nrr"][period]["returned_cows"] for results in herd_results)
+        totals[f"{period}_nrr"] = _format_non_return_rate(eligible_cows=eligible_cows, returned_cows=returned_cows)
+
+    return totals
+
+
+def calculate_bull_league_table(herd_results: list[dict]) -> list[dict]:
+    """
+    Six week NRR of each bull, with the cows of all herds added together.  Highest NRR first.
+    """
+    bulls = {}
+
+    for results in herd_results:
+        for bull in results["bull_statistics"]:
+            bull_totals = bulls.setdefault(
+                bull["bull_name"], {"herds": 0, "inseminations": 0, "eligible_cows": 0, "returned_cows": 0}
+            )
+            bull_totals["herds"] += 1
+            bull_totals["inseminations"] += bull["count"]
+
+        for bull in results["nrr_by_bull"]:
+            bulls[bull["bull_name"]]["eligible_cows"] += bull["nrr"]["eligible_cows"]
+            bulls[bull["bull_name"]]["returned_cows"] += bull["nrr"]["returned_cows"]
+
+    league_table = [
+        {
+            "bull_name": bull_name,
+            **bull_totals,
+            "non_return_rate": _format_non_return_rate(
+                eligible_cows=bull_totals["eligible_cows"], returned_cows=bull_totals["returned_cows"]
+            ),
+        }
+        for bull_name, bull_totals in bulls.items()
+    ]
+
+    def sort_key(bull: dict):
+        if bull["eligible_cows"] == 0:
+            return (1, Decimal(0), -bull["inseminations"])  # "N/A" at the bottom.
+        nrr = Decimal(bull["eligible_cows"] - bull["returned_cows"]) / Decimal(bull["eligible_cows"])
+        return (0, -nrr, -bull["eligible_cows"])
+
+    league_table.sort(key=sort_key)
+
+    return league_table
+
+
+def _format_non_return_rate(eligible_cows: int, returned_cows: int) -> str:
+    # Same formula and formatting as summarise_non_return_rate().
+    if eligible_cows > 0:
+        non_return_rate = 100 * Decimal(eligible_cows - returned_cows) / Decimal(eligible_cows)
+        return f"{non_return_rate:.1f}"
+    else:
+        return "N/A"
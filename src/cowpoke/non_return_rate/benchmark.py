@@ -0,0 +1,269 @@
+"""
+Benchmark of the Non Return Rate analysis, on synthetic mating seasons.
+
+Each stage of an NRR engine (see 'nrr_engines') is timed separately, by the stage_timer() spans that time it in the
+web server, and the timings are written to a JSON file with the commit they were measured at, so that a change can
+be compared with an earlier run:
+
+    python -m src.cowpoke.non_return_rate.benchmark --herd-sizes 500 5000 --output before.json
+    (change the code)
+    python -m src.cowpoke.non_return_rate.benchmark --herd-sizes 500 5000 --output after.json --compare before.json
+
+Run from the repository root.  The engine is the one set by COWPOKE_NRR_ENGINE (as in the web server), unless
+--engine is given.  Everything runs offline: the seasons are generated, and the charts are rendered to memory.
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+from src.cowpoke.non_return_rate.non_return_rate import (
+    ReturnType,
+    render_cow_submission_graph,
+    render_return_days_histogram,
+)
+from src.cowpoke.non_return_rate.non_return_rate_numpy import nrr_engines
+from src.cowpoke.stage_timing import timed_run
+
+
+# What happens after each insemination, as relative weights.  None is no return.
+default_return_rates = {
+    None: 55,
+    ReturnType.SAME_DAY: 1,
+    ReturnType.ONE_DAY: 1,
+    ReturnType.TWO_17_DAY: 5,
+    ReturnType.NORMAL: 28,
+    ReturnType.LONG: 10,
+}
+
+# Days to the next insemination, for each kind of return.  (See calculate_return_status.)
+return_days_ranges = {
+    ReturnType.SAME_DAY: (0, 0),
+    ReturnType.ONE_DAY: (1, 1),
+    ReturnType.TWO_17_DAY: (2, 17),
+    ReturnType.NORMAL: (18, 24),
+    ReturnType.LONG: (25, 60),
+}
+
+# Stages, in the order they are run.  All but "charts" are the stage_timer() stages of the engines.
+benchmark_stages = ("parse", "classification", "nrr", "statistics", "augmented_csv", "charts")
+
+
+@dataclass
+class SyntheticSeason:
+    herd_size: int
+    num_sires: int = 20
+    season_days: int = 90
+    submission_days: int = 42  # First inseminations are spread over this many days from the start of the season.
+    return_rates: dict = field(default_factory=lambda: dict(default_return_rates))
+    start_date: datetime.date = datetime.date(2024, 10, 1)
+    seed: int = 1
+
+
+def generate_season_csv(season: SyntheticSeason) -> str:
+    """
+    Mating records CSV file of a synthetic season, in date order, as uploaded by a farm.
+    Some Cow IDs have a letter prefix, as on real farms.
+    """
+    rng = random.Random(season.seed)
+    outcomes = list(season.return_rates)
+    weights = list(season.return_rates.values())
+    sires = [f"Sire {k + 1:03d}" for k in range(season.num_sires)]
+    last_date = season.start_date + datetime.timedelta(days=season.season_days - 1)
+
+    rows = []
+    for k in range(season.herd_size):
+        cow = f"{'AB'[k % 2]}{k}" if k % 10 == 0 else str(k + 1000)
+        insem_date = season.start_date + datetime.timedelta(
+            days=rng.randrange(min(season.submission_days, season.season_days))
+        )
+        while insem_date <= last_date:
+            rows.append((insem_date, cow, rng.choice(sires)))
+            outcome = rng.choices(outcomes, weights)[0]
+            if outcome is None:
+                break
+            insem_date += datetime.timedelta(days=rng.randint(*return_days_ranges[outcome]))
+
+    rows.sort(key=lambda x: x[0])  # Stable, so a cow's same day returns stay in order.
+
+    lines = ["Cow,Mating Date,Bull"]
+    lines.extend(f"{cow},{insem_date:%d-%b-%y},{sire}" for insem_date, cow, sire in rows)
+    return "\n".join(lines) + "\n"
+
+
+def time_stages(csv_text: str, herd_size: int, output_dir: Path, engine: str) -> dict:
+    """
+    Seconds taken by each stage of the engine, run on the CSV file as on an upload, then by drawing the charts (as
+    when they are first downloaded).
+    """
+    with contextlib.redirect_stdout(io.StringIO()), timed_run("non_return_rate") as stage_timings:
+        # Same day returns are printed.
+        result = nrr_engines[engine](
+            herd_size_str=str(herd_size),
+            input_file_path=io.BytesIO(csv_text.encode("utf-8")),
+            output_file_path=output_dir.joinpath("nrr_benchmark_output.csv"),
+            season_index_file_path=output_dir.joinpath("nrr_benchmark_season_index.json"),
+            season_record_file_path=output_dir.joinpath("nrr_benchmark_season_record.json"),
+        )
+    timings = dict(stage_timings.stages)
+
+    start = time.perf_counter()
+    render_return_days_histogram(return_days_histogram_list=result["return_days_histogram"])
+    render_cow_submission_graph(day_cumulative_counts=result["cow_submission_counts"])
+    timings["charts"] = time.perf_counter() - start
+
+    timings["num_inseminations"] = result["total_inseminations"]
+    return timings
+
+
+def run_benchmark(season: SyntheticSeason, repeats: int, engine: str) -> dict:
+    """
+    Median and fastest time of each stage over 'repeats' runs.  (The first run is a warm-up, and not counted.)
+    """
+    csv_text = generate_season_csv(season=season)
+    runs = []
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for k in range(repeats + 1):
+            runs.append(time_stages(
+                csv_text=csv_text, herd_size=season.herd_size, output_dir=Path(temp_dir), engine=engine
+            ))
+    runs = runs[1:]
+
+    stages = {
+        stage: {
+            "median_seconds": statistics.median(run[stage] for run in runs),
+            "min_seconds": min(run[stage] for run in runs),
+        }
+        for stage in benchmark_stages
+    }
+    stages["total"] = {
+        "median_seconds": statistics.median(sum(run[stage] for stage in benchmark_stages) for run in runs),
+        "min_seconds": min(sum(run[stage] for stage in benchmark_stages) for run in runs),
+    }
+
+    parameters = asdict(season)
+    parameters["start_date"] = season.start_date.isoformat()
+    parameters["return_rates"] = {
+        (return_type.value if return_type is not None else "No Return"): weight
+        for return_type, weight in season.return_rates.items()
+    }
+
+    return {
+        "parameters": parameters,
+        "num_inseminations": runs[0]["num_inseminations"],
+        "repeats": repeats,
+        "stages": stages,
+    }
+
+
+def current_commit() -> str | None:
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+
+def compare_benchmarks(baseline: dict, current: dict) -> list[str]:
+    """
+    A line per stage of each season in both files, with the ratio of the median times.  (Below 1 is faster.)
+    """
+    baseline_runs = {json.dumps(run["parameters"], sort_keys=True): run for run in baseline["runs"]}
+
+    lines = [f"Compared with {baseline.get('commit') or 'baseline'} ({baseline['created']}, "
+             f"{baseline.get('engine', 'python')} engine):"]
+    for run in current["runs"]:
+        baseline_run = baseline_runs.get(json.dumps(run["parameters"], sort_keys=True))
+        if baseline_run is None:
+            continue
+        lines.append(f"Herd size {run['parameters']['herd_size']} ({run['num_inseminations']} inseminations)")
+        for stage, timing in run["stages"].items():
+            if stage not in baseline_run["stages"]:  # Eg. a stage added since.
+                continue
+            baseline_seconds = baseline_run["stages"][stage]["median_seconds"]
+            current_seconds = timing["median_seconds"]
+            ratio = current_seconds / baseline_seconds if baseline_seconds > 0 else float("nan")
+            lines.append(f"  {stage:<16}{baseline_seconds:>10.4f}s {current_seconds:>10.4f}s {ratio:>8.2f}x")
+
+    return lines
+
+
+def parse_return_rates(text: str) -> dict:
+    """
+    Eg. "none=55,same_day=1,one_day=1,two_17_day=5,normal=28,long=10".  Kinds of return not given have weight 0.
+    """
+    names = {"none": None, **{return_type.name.lower(): return_type for return_type in return_days_ranges}}
+    return_rates = dict.fromkeys(default_return_rates, 0)
+
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip().lower() not in names:
+            raise argparse.ArgumentTypeError(f"Unknown kind of return '{name}'.  Expected one of: {', '.join(names)}")
+        return_rates[names[name.strip().lower()]] = float(weight)
+
+    return return_rates
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Benchmark the Non Return Rate analysis on synthetic seasons.")
+    parser.add_argument("--herd-sizes", type=int, nargs="+", default=[500, 5000], help="Cows in each herd.")
+    parser.add_argument("--sires", type=int, default=20, help="Number of sires used.")
+    parser.add_argument("--season-days", type=int, default=90, help="Length of the mating season in days.")
+    parser.add_argument("--return-rates", type=parse_return_rates, default=default_return_rates,
+                        help="Weights of what follows each insemination, eg. 'none=55,normal=28,long=10'.")
+    parser.add_argument("--repeats", type=int, default=5, help="Timed runs of each herd.")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--engine", choices=list(nrr_engines), default=os.environ.get("COWPOKE_NRR_ENGINE", "numpy"),
+                        help="NRR engine to time.  (Default: COWPOKE_NRR_ENGINE, as in the web server.)")
+    parser.add_argument("--output", default="nrr_benchmark.json", help="JSON file for the results.")
+    parser.add_argument("--compare", help="JSON file of an earlier benchmark to compare with.")
+    args = parser.parse_args(argv)
+
+    results = {
+        "commit": current_commit(),
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "machine": platform.platform(),
+        "engine": args.engine,
+        "runs": [],
+    }
+
+    for herd_size in args.herd_sizes:
+        season = SyntheticSeason(
+            herd_size=herd_size,
+            num_sires=args.sires,
+            season_days=args.season_days,
+            return_rates=args.return_rates,
+            seed=args.seed,
+        )
+        run = run_benchmark(season=season, repeats=args.repeats, engine=args.engine)
+        results["runs"].append(run)
+
+        print(f"Herd size {herd_size} ({run['num_inseminations']} inseminations)")
+        for stage, timing in run["stages"].items():
+            print(f"  {stage:<16}{timing['median_seconds']:>10.4f}s")
+
+    with open(args.output, "w") as g:
+        json.dump(results, g, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print("\n".join(compare_benchmarks(baseline=baseline, current=results)))
+
+
+if __name__ == "__main__":
+    main()
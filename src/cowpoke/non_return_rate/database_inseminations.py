@@ -0,0 +1,86 @@
+"""
+Inseminations recorded in the Cowpoke database, as input for the Non Return Rate analysis.
+
+The engines read (cow, date, bull) tuples, as parsed from a mating records CSV file by iter_csv_inseminations().
+FarmInseminations yields the same tuples straight from SQLite, in date order, so that a farm's recorded
+inseminations can be analysed without exporting them to a CSV file first.
+"""
+import datetime
+import hashlib
+from dataclasses import dataclass
+from typing import Iterator
+
+from sqlmodel import Session, select
+
+from src.cowpoke.database_connection import engine
+from src.cowpoke.models import Bull, Cow, Insemination, Job
+
+
+# Rows fetched from SQLite at a time while streaming.
+database_batch_size = 1000
+
+
+@dataclass(frozen=True)
+class FarmInseminations:
+    """
+    The inseminations on one farm with a job date from 'start_date' to 'end_date' inclusive.  (Either may be None.)
+    Cows are identified by tag ID, and bulls by bull code, as on the job pages.
+
+    Only the query is held, so this can be sent to a worker process, which streams the rows itself.
+    """
+    farm_id: int
+    start_date: datetime.date | None = None
+    end_date: datetime.date | None = None
+
+    def __iter__(self) -> Iterator[tuple]:
+        """
+        Raises ValueError if there are no inseminations.  (As for an empty CSV file.)
+        """
+        statement = (select(Cow.tag_id, Job.job_date, Bull.bull_code)
+                     .select_from(Insemination)
+                     .join(Cow, Insemination.cow_id == Cow.id)
+                     .join(Bull, Insemination.bull_id == Bull.id)
+                     .join(Job, Insemination.job_id == Job.id)
+                     .where(*self._conditions())
+                     .order_by(Job.job_date, Insemination.id)
+                     .execution_options(yield_per=database_batch_size))
+
+        found_inseminations = False
+
+        with Session(engine) as session:
+            for tag_id, job_date, bull_code in session.exec(statement):
+                found_inseminations = True
+                yield tag_id, job_date, bull_code
+
+        if not found_inseminations:
+            raise ValueError("No inseminations have been recorded for this farm in this date range")
+
+    def fingerprint(self) -> str:
+        """
+        A hash of every insemination in the range (ID, job date, cow and bull), so that it can be part of a run ID.
+        It changes whenever an insemination is added, deleted or edited, even if a deleted insemination's ID is
+        reused by the one entered in its place.
+        """
+        statement = (select(Insemination.id, Job.job_date, Cow.tag_id, Bull.bull_code)
+                     .select_from(Insemination)
+                     .join(Cow, Insemination.cow_id == Cow.id)
+                     .join(Bull, Insemination.bull_id == Bull.id)
+                     .join(Job, Insemination.job_id == Job.id)
+                     .where(*self._conditions())
+                     .order_by(Insemination.id)
+                     .execution_options(yield_per=database_batch_size))
+
+        hasher = hashlib.sha256()
+        with Session(engine) as session:
+            for row in session.exec(statement):
+                hasher.update(repr(tuple(row)).encode("utf-8"))
+
+        return f"{self.farm_id}:{self.start_date}:{self.end_date}:{hasher.hexdigest()}"
+
+    def _conditions(self) -> list:
+        conditions = [Job.farm_id == self.farm_id]
+        if self.start_date is not None:
+            conditions.append(Job.job_date >= self.start_date)
+        if self.end_date is not None:
+            conditions.append(Job.job_date <= self.end_date)
+        return conditions
@@ -0,0 +1,259 @@
+"""
+Live Non Return Rate of the inseminations recorded on each farm, kept up to date as inseminations are completed
+and deleted on the job pages.
+
+Each farm has a FarmNrrTotals row per mating season (see 'models.py'), with the cows counted by NRR class, and by
+first insemination date for the whole farm and per bull.  A completed or deleted insemination only changes the class
+(and bulls) of one cow, so the totals are updated by taking away that cow's old contribution and adding her new one.
+Only her own inseminations in the season are read.  The live NRR is then served from the totals, whatever the number
+of inseminations on the farm.
+"""
+import datetime
+import json
+from dataclasses import dataclass
+
+from sqlmodel import Session, delete, select
+
+from src.cowpoke.models import FarmNrrTotals, Insemination, Job
+from src.cowpoke.non_return_rate.non_return_rate import (
+    ReturnType,
+    calculate_return_bitmask,
+    calculate_return_status,
+    classify_return_bitmask,
+    nrr_count_fields,
+    summarise_nrr_counts,
+)
+
+
+# Mating seasons run from 1 June to 31 May, and are known by the year they start in.
+season_start_month = 6
+
+
+@dataclass(frozen=True)
+class CowNrrState:
+    """
+    What one cow adds to the totals of a season.
+    """
+    first_insemination_date: datetime.date
+    nrr_count_field: str
+    bull_ids: frozenset[int]
+
+
+def season_start_year(job_date: datetime.date) -> int:
+    return job_date.year if job_date.month >= season_start_month else job_date.year - 1
+
+
+def season_dates(start_year: int) -> tuple[datetime.date, datetime.date]:
+    start_date = datetime.date(start_year, season_start_month, 1)
+    end_date = datetime.date(start_year + 1, season_start_month, 1) - datetime.timedelta(days=1)
+    return start_date, end_date
+
+
+def calculate_cow_nrr_state(session: Session, cow_id: int, start_year: int) -> CowNrrState | None:
+    """
+    None if the cow has no inseminations in the season.  Includes changes that have been flushed, but not committed.
+    """
+    start_date, end_date = season_dates(start_year=start_year)
+
+    statement = (select(Job.job_date, Insemination.bull_id)
+                 .select_from(Insemination)
+                 .join(Job, Insemination.job_id == Job.id)
+                 .where(Insemination.cow_id == cow_id)
+                 .where(Job.job_date >= start_date)
+                 .where(Job.job_date <= end_date)
+                 .order_by(Job.job_date, Insemination.id))
+    inseminations = session.exec(statement).all()
+
+    if not inseminations:
+        return None
+
+    return calculate_cow_nrr_state_from_inseminations(inseminations=inseminations)
+
+
+def calculate_cow_nrr_state_from_inseminations(inseminations: list[tuple]) -> CowNrrState:
+    """
+    'inseminations' are the (date, bull ID) of one cow in one season, in date order.
+    """
+    return_types = [ReturnType.FIRST_INSEMINATION]
+    for (previous_date, _), (insemination_date, _) in zip(inseminations, inseminations[1:]):
+        return_types.append(calculate_return_status(days_elapsed=(insemination_date - previous_date).days))
+
+    return CowNrrState(
+        first_insemination_date=inseminations[0][0],
+        nrr_count_field=classify_return_bitmask(calculate_return_bitmask(return_types=return_types)),
+        bull_ids=frozenset(bull_id for _, bull_id in inseminations),
+    )
+
+
+def update_farm_nrr_totals(
+        session: Session,
+        farm_id: int,
+        start_year: int,
+        cow_state_before: CowNrrState | None,
+        cow_state_after: CowNrrState | None,
+):
+    """
+    Replace one cow's contribution to the totals.  Added to the session, to be committed with the insemination.
+    """
+    if cow_state_before == cow_state_after:
+        return
+
+    statement = (select(FarmNrrTotals).where(FarmNrrTotals.farm_id == farm_id)
+                                      .where(FarmNrrTotals.season_start_year == start_year))
+    farm_nrr_totals = session.exec(statement).first()
+
+    if farm_nrr_totals is None:
+        farm_nrr_totals = FarmNrrTotals(
+            farm_id=farm_id,
+            season_start_year=start_year,
+            nrr_counts=json.dumps([0] * len(nrr_count_fields)),
+            bull_nrr_counts=json.dumps({}),
+            first_insemination_counts=json.dumps({}),
+        )
+
+    nrr_counts = json.loads(farm_nrr_totals.nrr_counts)
+    bull_nrr_counts = json.loads(farm_nrr_totals.bull_nrr_counts)
+    first_insemination_counts = json.loads(farm_nrr_totals.first_insemination_counts)
+
+    for cow_state, change in ((cow_state_before, -1), (cow_state_after, 1)):
+        if cow_state is not None:
+            add_cow_nrr_state(
+                cow_state=cow_state,
+                change=change,
+                nrr_counts=nrr_counts,
+                bull_nrr_counts=bull_nrr_counts,
+                first_insemination_counts=first_insemination_counts,
+            )
+
+    farm_nrr_totals.nrr_counts = json.dumps(nrr_counts)
+    farm_nrr_totals.bull_nrr_counts = json.dumps(bull_nrr_counts)
+    farm_nrr_totals.first_insemination_counts = json.dumps(first_insemination_counts)
+    session.add(farm_nrr_totals)
+
+
+def add_cow_nrr_state(
+        cow_state: CowNrrState,
+        change: int,
+        nrr_counts: list[int],
+        bull_nrr_counts: dict[str, dict[str, list[int]]],
+        first_insemination_counts: dict[str, list[int]],
+):
+    """
+    Add (change=1) or take away (change=-1) one cow.  Bulls and dates left with no cows are removed.
+    """
+    k = nrr_count_fields.index(cow_state.nrr_count_field)
+    nrr_counts[k] += change
+
+    date_key = cow_state.first_insemination_date.isoformat()
+    all_dates_counts = [first_insemination_counts]
+    all_dates_counts.extend(bull_nrr_counts.setdefault(str(bull_id), {}) for bull_id in cow_state.bull_ids)
+
+    for dates_counts in all_dates_counts:
+        counts = dates_counts.setdefault(date_key, [0] * len(nrr_count_fields))
+        counts[k] += change
+        if not any(counts):
+            del dates_counts[date_key]
+
+    for bull_id in cow_state.bull_ids:
+        if not bull_nrr_counts[str(bull_id)]:
+            del bull_nrr_counts[str(bull_id)]
+
+
+def rebuild_farm_nrr_totals(session: Session):
+    """
+    Recalculate the totals of every farm from all the inseminations.  (Eg. for inseminations recorded before the
+    totals were kept.)  Committed by the caller.
+    """
+    session.exec(delete(FarmNrrTotals))
+
+    statement = (select(Job.farm_id, Insemination.cow_id, Job.job_date, Insemination.bull_id)
+                 .select_from(Insemination)
+                 .join(Job, Insemination.job_id == Job.id)
+                 .order_by(Insemination.cow_id, Job.job_date, Insemination.id))
+
+    cow_seasons = {}
+    for farm_id, cow_id, job_date, bull_id in session.exec(statement):
+        key = (farm_id, season_start_year(job_date=job_date), cow_id)
+        cow_seasons.setdefault(key, []).append((job_date, bull_id))
+
+    all_totals = {}
+    for (farm_id, start_year, cow_id), inseminations in cow_seasons.items():
+        nrr_counts, bull_nrr_counts, first_insemination_counts = all_totals.setdefault(
+            (farm_id, start_year), ([0] * len(nrr_count_fields), {}, {})
+        )
+        add_cow_nrr_state(
+            cow_state=calculate_cow_nrr_state_from_inseminations(inseminations=inseminations),
+            change=1,
+            nrr_counts=nrr_counts,
+            bull_nrr_counts=bull_nrr_counts,
+            first_insemination_counts=first_insemination_counts,
+        )
+
+    for (farm_id, start_year), (nrr_counts, bull_nrr_counts, first_insemination_counts) in all_totals.items():
+        session.add(FarmNrrTotals(
+            farm_id=farm_id,
+            season_start_year=start_year,
+            nrr_counts=json.dumps(nrr_counts),
+            bull_nrr_counts=json.dumps(bull_nrr_counts),
+            first_insemination_counts=json.dumps(first_insemination_counts),
+        ))
+
+
+def summarise_farm_nrr_totals(
+        farm_nrr_totals: FarmNrrTotals, bull_codes: dict[int, str], today: datetime.date
+) -> dict | None:
+    """
+    The live NRRs of a season, in the same format as the NRR results of an uploaded file.
+    Returns None if no cows are left in the season.
+
+    The analysis start date is the first insemination of the season.  Until the season is over, the analysis
+    period ends today, so the confirmed NRRs only count cows first inseminated at least 24 days ago.  As for an
+    uploaded file, the NRR by bull is the six weeks confirmed NRR.
+    """
+    nrr_counts = json.loads(farm_nrr_totals.nrr_counts)
+    first_insemination_counts = json.loads(farm_nrr_totals.first_insemination_counts)
+
+    if not first_insemination_counts:
+        return None
+
+    first_insemination_dates = sorted(datetime.date.fromisoformat(x) for x in first_insemination_counts)
+    start_date = first_insemination_dates[0]
+    end_of_period = min(today, season_dates(start_year=farm_nrr_totals.season_start_year)[1])
+    end_of_period = max(end_of_period, first_insemination_dates[-1])  # Jobs may be dated in the future.
+    end_of_six_weeks = min(start_date + datetime.timedelta(weeks=6), end_of_period)
+
+    def summarise_up_to(cut_off_date: datetime.date, dates_counts: dict[str, list[int]]) -> dict:
+        counts = [0] * len(nrr_count_fields)
+        for date_key, date_counts in dates_counts.items():
+            if datetime.date.fromisoformat(date_key) <= cut_off_date:
+                counts = [x + y for x, y in zip(counts, date_counts)]
+        return summarise_nrr_counts(
+            counts=dict(zip(nrr_count_fields, counts)), start_date=start_date, cut_off_date=cut_off_date
+        )
+
+    six_weeks_cut_off_date = end_of_six_weeks - datetime.timedelta(days=24)
+
+    nrr_by_bull = [
+        {
+            "bull_name": bull_codes.get(int(bull_id), bull_id),
+            "nrr": summarise_up_to(cut_off_date=six_weeks_cut_off_date, dates_counts=dates_counts),
+        }
+        for bull_id, dates_counts in json.loads(farm_nrr_totals.bull_nrr_counts).items()
+    ]
+    nrr_by_bull.sort(key=lambda x: x["bull_name"])
+
+    return {
+        "season": f"{farm_nrr_totals.season_start_year}-{(farm_nrr_totals.season_start_year + 1) % 100:02d}",
+        "nrr": {
+            "six_weeks_confirmed": summarise_up_to(
+                cut_off_date=six_weeks_cut_off_date, dates_counts=first_insemination_counts
+            ),
+            "full_season_confirmed": summarise_up_to(
+                cut_off_date=end_of_period - datetime.timedelta(days=24), dates_counts=first_insemination_counts
+            ),
+            "full_season_unconfirmed": summarise_nrr_counts(
+                counts=dict(zip(nrr_count_fields, nrr_counts)), start_date=start_date, cut_off_date=end_of_period
+            ),
+        },
+        "nrr_by_bull": nrr_by_bull,
+    }
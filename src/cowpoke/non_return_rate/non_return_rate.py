@@ -1,10 +1,17 @@
+import array
+import bisect
 import datetime
+import io
+import json
+import os
 from decimal import Decimal
 from dataclasses import dataclass
 from enum import Enum
-from typing import Union
+from typing import Iterable, Iterator, Union
 
-from matplotlib import pyplot as plt
+from matplotlib.figure import Figure
+
+from src.cowpoke.stage_timing import stage_timer
 
 
 class ReturnType(Enum):
@@ -16,7 +23,7 @@ class ReturnType(Enum):
     LONG = "Long Return"
 
 
-@dataclass
+@dataclass(slots=True)
 class Insemination:
     insemination_date: datetime.date
     bull: int
@@ -24,32 +31,275 @@ class Insemination:
     days_elapsed: str
 
 
+class InseminationColumns:
+    """
+    Parsed inseminations, in file order, as three arrays: the insemination dates as ordinals (int32), and codes of
+    the Cow IDs and Bull names (uint32).  The IDs and names are interned, so each is kept once, in order of first
+    appearance.  About 12 bytes per insemination, instead of a tuple of three objects.
+
+    Iterating yields the same (cow, insemination date, bull) tuples as iter_csv_inseminations(), so this can still
+    be passed to functions that take a list of inseminations.
+    """
+    __slots__ = ("cow_ids", "bull_names", "cow_codes", "date_ordinals", "bull_codes", "_dates")
+
+    def __init__(self, inseminations: Iterable[tuple] = ()):
+        self.cow_ids = []
+        self.bull_names = []
+        self.cow_codes = array.array("I")
+        self.date_ordinals = array.array("i")
+        self.bull_codes = array.array("I")
+        self._dates = {}  # Ordinal: date, so that each date object is kept once.
+
+        cow_code_map = {}
+        bull_code_map = {}
+        for cow, insem_date, bull in inseminations:
+            cow_code = cow_code_map.setdefault(cow, len(cow_code_map))
+            if cow_code == len(self.cow_ids):
+                self.cow_ids.append(cow)
+            bull_code = bull_code_map.setdefault(bull, len(bull_code_map))
+            if bull_code == len(self.bull_names):
+                self.bull_names.append(bull)
+            ordinal = insem_date.toordinal()
+            self._dates.setdefault(ordinal, insem_date)
+
+            self.cow_codes.append(cow_code)
+            self.date_ordinals.append(ordinal)
+            self.bull_codes.append(bull_code)
+
+    def __len__(self) -> int:
+        return len(self.cow_codes)
+
+    def __iter__(self) -> Iterator[tuple]:
+        for cow_code, ordinal, bull_code in zip(self.cow_codes, self.date_ordinals, self.bull_codes):
+            yield self.cow_ids[cow_code], self._dates[ordinal], self.bull_names[bull_code]
+
+    def first_date(self) -> datetime.date:
+        return self._dates[min(self.date_ordinals)]
+
+    def last_date(self) -> datetime.date:
+        return self._dates[max(self.date_ordinals)]
+
+    def bull_counts(self) -> list[tuple]:
+        """
+        List of (bull, count) tuples, in order of each bull's first appearance.
+        """
+        counts = [0] * len(self.bull_names)
+        for bull_code in self.bull_codes:
+            counts[bull_code] += 1
+        return list(zip(self.bull_names, counts))
+
+    def iter_cow_inseminations(self) -> Iterator[tuple]:
+        """
+        Yield (cow, [(insemination date, bull), ...]) for each cow, with her inseminations in date order.
+        (Inseminations on the same day stay in file order.)
+        """
+        order = array.array("I", range(len(self)))
+        if order:
+            min_ordinal = min(self.date_ordinals)
+            order = _counting_sort(order, keys=self.date_ordinals, min_key=min_ordinal,
+                                   max_key=max(self.date_ordinals))
+            order = _counting_sort(order, keys=self.cow_codes, min_key=0, max_key=len(self.cow_ids) - 1)
+
+        cow_inseminations = []
+        for k, idx in enumerate(order):
+            cow_inseminations.append((self._dates[self.date_ordinals[idx]], self.bull_names[self.bull_codes[idx]]))
+            if k + 1 == len(order) or self.cow_codes[order[k + 1]] != self.cow_codes[idx]:
+                yield self.cow_ids[self.cow_codes[idx]], cow_inseminations
+                cow_inseminations = []
+
+
+def _counting_sort(order: array.array, keys: array.array, min_key: int, max_key: int) -> array.array:
+    """
+    Stable sort of the indices in 'order' by keys[index].  Linear time, without a Python int object per index.
+    """
+    starts = [0] * (max_key - min_key + 2)
+    for idx in order:
+        starts[keys[idx] - min_key + 1] += 1
+    for k in range(1, len(starts)):
+        starts[k] += starts[k - 1]
+
+    sorted_order = array.array("I", bytes(order.itemsize * len(order)))
+    for idx in order:
+        k = keys[idx] - min_key
+        sorted_order[starts[k]] = idx
+        starts[k] += 1
+
+    return sorted_order
+
+
+# The flags that can be read from a CowRecord like dict keys, and the return type each one is set by.
+cow_record_return_flags = {
+    "has_same_day_return": ReturnType.SAME_DAY,
+    "has_one_day_return": ReturnType.ONE_DAY,
+    "has_two_17_day_return": ReturnType.TWO_17_DAY,
+    "has_normal_return": ReturnType.NORMAL,
+    "has_long_return": ReturnType.LONG,
+}
+
+
+class CowRecord:
+    """
+    A value in 'cow_dict': one cow's inseminations in date order, the bulls used, and a bitmask of her return types.
+    (See 'return_type_bits'.)  The return flags are derived from the bitmask, instead of being kept for every cow,
+    and can still be read like the keys of a dict, eg. data["has_normal_return"] or data["no_returns"].
+    """
+    __slots__ = ("inseminations", "bulls", "first_insemination_date", "return_bitmask")
+
+    def __init__(
+            self,
+            inseminations: list[Insemination],
+            bulls: tuple,
+            first_insemination_date: datetime.date,
+            return_bitmask: int,
+    ):
+        self.inseminations = inseminations
+        self.bulls = bulls
+        self.first_insemination_date = first_insemination_date
+        self.return_bitmask = return_bitmask
+
+    def __getitem__(self, key: str):
+        if key in cow_record_return_flags:
+            return bool(self.return_bitmask & return_type_bits[cow_record_return_flags[key]])
+        elif key == "no_returns":
+            return self.return_bitmask == return_type_bits[ReturnType.FIRST_INSEMINATION]
+        elif key in self.__slots__:
+            return getattr(self, key)
+        else:
+            raise KeyError(key)
+
+
 def calculate_non_return_rate_results(
         herd_size_str,
         input_file_path: str,
         output_file_path: str,
-        returns_bar_chart_file_path: str,
-        cow_submission_graph_file_path: str,
+        returns_bar_chart_file_path: Union[str, None] = None,
+        cow_submission_graph_file_path: Union[str, None] = None,
+        season_index_file_path: Union[str, None] = None,
+        season_record_file_path: Union[str, None] = None,
+        inseminations: Union[Iterable[tuple], None] = None,
 ) -> dict:
-    inseminations = _parse_csv_file(file_path=input_file_path)
+    """
+    'input_file_path' can also be an open file object (eg. an upload), which is parsed without saving it to disk.
+    Or instead of a file, 'inseminations' can be any iterable of (cow, date, bull) tuples, in any order.
+    (Eg. FarmInseminations, from the Cowpoke database.)
+    Raises ValueError if the file has malformed rows.  (See iter_csv_inseminations.)
+    Charts are only drawn if their file paths are given.  The data to draw them later is in the result dict:
+    'cow_submission_counts' (see plot_cow_submission_graph) and 'return_days_histogram'.
+    """
+    with stage_timer("parse"):
+        if inseminations is None:
+            inseminations = iter_csv_inseminations(file_path=input_file_path)
+        inseminations = InseminationColumns(inseminations)
 
-    bull_statistics = calculate_bull_statistics(inseminations)
+    #################################################################################
+    # Create Cow dictionary with extra derived info.
+    with stage_timer("classification"):
+        bull_statistics = calculate_bull_statistics(inseminations)
+        cow_dict = build_cow_dict(inseminations=inseminations)
 
-    inseminations.sort(key = lambda x: x[1])  # Sort by date.
+    ###########################################################################################
+    # Generate Non Return Rates.
+    with stage_timer("nrr"):
+        first_date = inseminations.first_date()
+        last_date = inseminations.last_date()
 
-    cow_insems_dict = dict()
+        season_index = build_nrr_season_index(
+            cow_dict=cow_dict, season_start_date=first_date, season_end_date=last_date
+        )
+        if season_index_file_path:
+            write_nrr_season_index(season_index=season_index, file_path=season_index_file_path)
 
-    for cow, insem_date, bull in inseminations:
-        if cow not in cow_insems_dict:
-            cow_insems_dict[cow] = [(insem_date, bull)]
-        else:
-            cow_insems_dict[cow].append((insem_date, bull))
+        full_season_unconfirmed_nrr = calculate_non_return_rate_from_index(
+            season_index=season_index, start_date=first_date, cut_off_date=last_date
+        )
+        last_date_minus_24 = last_date - datetime.timedelta(days=24)
+        full_season_confirmed_nrr = calculate_non_return_rate_from_index(
+            season_index=season_index, start_date=first_date, cut_off_date=last_date_minus_24
+        )
+        end_of_six_weeks = first_date + datetime.timedelta(weeks=6)
+        end_of_period = min(end_of_six_weeks, last_date)  # In case a real season is *less* than six weeks.
+        end_of_period_minus_24 = end_of_period - datetime.timedelta(days=24)
+        six_weeks_confirmed_nrr = calculate_non_return_rate_from_index(
+            season_index=season_index, start_date=first_date, cut_off_date=end_of_period_minus_24
+        )
 
-    #################################################################################
-    # Create Cow dictionary with extra derived info.
+        nrr_by_bull = calculate_nrr_by_bull(
+            bull_statistics=bull_statistics,
+            cow_dict=cow_dict,
+            start_date=first_date,
+            cut_off_date=end_of_period_minus_24
+        )
+
+        if season_record_file_path:
+            season_record = build_nrr_season_record(
+                season_start_date=first_date,
+                season_end_date=last_date,
+                first_insemination_days=[
+                    (data["first_insemination_date"] - first_date).days for data in cow_dict.values()
+                ],
+                return_bitmasks=[data.return_bitmask for data in cow_dict.values()],
+                bull_statistics=bull_statistics,
+                nrr_by_bull=nrr_by_bull,
+            )
+            write_nrr_season_record(season_record=season_record, file_path=season_record_file_path)
+
+    #######################################################################################
+    # Generate other statistics.
+
+    total_cows_submitted = len(cow_dict)
+    total_inseminations = len(inseminations)
+
+    try:
+        herd_size = int(herd_size_str)
+    except ValueError:
+        herd_size = None
+
+    with stage_timer("statistics"):
+        submission_statistics = calculate_cumulative_insemination_statistics(cow_dict=cow_dict, herd_size=herd_size)
+        cow_submission_counts = create_cow_submission_graph(
+            cow_dict=cow_dict, graph_filename=cow_submission_graph_file_path
+        )
+
+        return_status_statistics = calculate_return_status_statistics(cow_dict=cow_dict)
+
+        return_days_histogram = create_return_days_histogram(
+            cow_dict=cow_dict, bar_chart_filename=returns_bar_chart_file_path
+        )
+
+    ############################################################################################
+
+    with stage_timer("augmented_csv"):
+        generate_augmented_insemination_file(  # Writes augmented insemination file to disk at "temp/cowpoke".
+            cow_dict=cow_dict,
+            output_file_path=output_file_path,
+        )
+
+    return {
+        "first_insemination_date": first_date.strftime("%d-%b-%y"),
+        "last_insemination_date": last_date.strftime("%d-%b-%y"),
+        "bull_statistics": bull_statistics,
+        "total_cows_submitted": total_cows_submitted,
+        "total_inseminations": total_inseminations,
+        "submission_statistics": submission_statistics,
+        "cow_submission_counts": cow_submission_counts,
+        "nrr": {
+            "full_season_unconfirmed": full_season_unconfirmed_nrr,
+            "full_season_confirmed": full_season_confirmed_nrr,
+            "six_weeks_confirmed": six_weeks_confirmed_nrr,
+        },
+        "rss": return_status_statistics,
+        "return_days_histogram": return_days_histogram,
+        "nrr_by_bull": nrr_by_bull,
+    }
+
+
+def build_cow_dict(inseminations: InseminationColumns) -> dict:
+    """
+    Classify each insemination by the days since the cow's previous one.  Returns {cow: CowRecord}.
+    """
     cow_dict = dict()
 
-    for cow, insems in cow_insems_dict.items():
+    for cow, insems in inseminations.iter_cow_inseminations():
         first_insem = insems[0]
         remaining_insems = insems[1:]  # (May be empty.)
         first_insemination_date = first_insem[0]
@@ -76,175 +326,444 @@ def calculate_non_return_rate_results(
             new_insems.append(new_insem)
             previous_insem = insem  # Bugfix!  This line was missing, causing ALL returns to compare to First Insem.
 
-        return_statuses = [x.return_type for x in new_insems]
-        has_same_day_return = True if ReturnType.SAME_DAY in return_statuses else False
-        has_one_day_return = True if ReturnType.ONE_DAY in return_statuses else False
-        has_two_17_day_return = True if ReturnType.TWO_17_DAY in return_statuses else False
-        has_normal_return = True if ReturnType.NORMAL in return_statuses else False
-        has_long_return = True if ReturnType.LONG in return_statuses else False
-        no_returns = True if len(new_insems) == 1 else False
-
-        bulls = list({x.bull for x in new_insems})
-
-        cow_dict[cow] = {
-            "inseminations": new_insems,
-            "bulls": bulls,
-            "first_insemination_date": first_insemination_date,
-            "no_returns": no_returns,
-            "has_same_day_return": has_same_day_return,
-            "has_one_day_return": has_one_day_return,
-            "has_two_17_day_return": has_two_17_day_return,
-            "has_normal_return": has_normal_return,
-            "has_long_return": has_long_return,
-        }
+        cow_dict[cow] = CowRecord(
+            inseminations=new_insems,
+            bulls=tuple(dict.fromkeys(x.bull for x in new_insems)),
+            first_insemination_date=first_insemination_date,
+            return_bitmask=calculate_return_bitmask(return_types=[x.return_type for x in new_insems]),
+        )
+
+    return cow_dict
 
-    ###########################################################################################
-    # Generate Non Return Rates.
-    first_date = inseminations[0][1]
-    last_date = inseminations[-1][1]
 
-    full_season_unconfirmed_nrr = calculate_non_return_rate(
-        cow_dict=cow_dict, start_date=first_date, cut_off_date=last_date
+def calculate_non_return_rate(cow_dict: dict, start_date: datetime.date, cut_off_date: datetime.date) -> dict:
+    counts = dict.fromkeys(nrr_count_fields, 0)
+
+    for cow, data in cow_dict.items():
+        if cut_off_date < data["first_insemination_date"]:
+            continue
+
+        counts[classify_cow_for_nrr(data)] += 1
+
+    return summarise_nrr_counts(counts=counts, start_date=start_date, cut_off_date=cut_off_date)
+
+
+# Mutually exclusive counters that each cow in an analysis period adds to.
+# Every cow that is not excluded from analysis is eligible.
+nrr_count_fields = (
+    "excluded_from_analysis",
+    "non_return_cows",
+    "same_day_return_cows",
+    "one_day_return_cows",
+    "returned_cows",
+    "other_eligible_cows",  # Not possible in practice, because every return has one of the return types.
+)
+
+
+def classify_cow_for_nrr(data: dict) -> str:
+    """
+    Return the NRR counter (from 'nrr_count_fields') that a cow in 'cow_dict' adds to.
+    A cow with several kinds of return is counted only under the first matching kind, in the order below.
+    """
+    if isinstance(data, CowRecord):
+        return classify_return_bitmask(data.return_bitmask)  # Same order.
+
+    if data["has_two_17_day_return"] or data["has_long_return"]:
+        return "excluded_from_analysis"
+    elif data["no_returns"]:
+        return "non_return_cows"
+    elif data["has_same_day_return"]:
+        return "same_day_return_cows"
+    elif data["has_one_day_return"]:
+        return "one_day_return_cows"
+    elif data["has_normal_return"]:
+        return "returned_cows"
+    else:
+        return "other_eligible_cows"
+
+
+def summarise_nrr_counts(counts: dict, start_date: datetime.date, cut_off_date: datetime.date) -> dict:
+    total_cows = sum(counts.values())
+    excluded_from_analysis = counts["excluded_from_analysis"]
+
+    return summarise_non_return_rate(
+        start_date=start_date,
+        cut_off_date=cut_off_date,
+        total_cows=total_cows,
+        excluded_from_analysis=excluded_from_analysis,
+        eligible_cows=total_cows - excluded_from_analysis,
+        non_return_cows=counts["non_return_cows"],
+        same_day_return_cows=counts["same_day_return_cows"],
+        one_day_return_cows=counts["one_day_return_cows"],
+        returned_cows=counts["returned_cows"],
     )
-    last_date_minus_24 = last_date - datetime.timedelta(days=24)
-    full_season_confirmed_nrr = calculate_non_return_rate(
-        cow_dict=cow_dict, start_date=first_date, cut_off_date=last_date_minus_24
+
+
+def summarise_non_return_rate(
+        start_date: datetime.date,
+        cut_off_date: datetime.date,
+        total_cows: int,
+        excluded_from_analysis: int,
+        eligible_cows: int,
+        non_return_cows: int,
+        same_day_return_cows: int,
+        one_day_return_cows: int,
+        returned_cows: int,
+) -> dict:
+    """
+    Format the cow counts for one analysis period into the dict used by 'non_return_results.html'.
+    Shared by every NRR engine, so that all engines produce identical output.
+    """
+    if eligible_cows > 0:
+        # This is not quite correct, because a cow could have a one-day return AND a normal return.
+        # non_return_rate = (100 * Decimal(non_return_cows + same_day_return_cows + one_day_return_cows)/
+        #                    Decimal(eligible_cows))
+
+        non_return_rate = 100 * Decimal(eligible_cows - returned_cows) / Decimal(eligible_cows)
+        non_return_rate_string = f"{non_return_rate:.1f}"
+    else:
+        non_return_rate_string = "N/A"
+
+    return {
+        "start_date": start_date.strftime("%d-%b-%y"),
+        "cutoff_date": cut_off_date.strftime("%d-%b-%y"),
+        "total_cows": total_cows,
+        "excluded_from_analysis": excluded_from_analysis,
+        "eligible_cows": eligible_cows,
+        "non_return_cows": non_return_cows,
+        "same_day_return_cows": same_day_return_cows,
+        "one_day_return_cows": one_day_return_cows,
+        "returned_cows": returned_cows,
+        "eligible_minus_returned_cows": eligible_cows - returned_cows,
+        "non_return_rate": non_return_rate_string,
+    }
+
+
+@dataclass
+class NrrSeasonIndex:
+    """
+    Cows grouped by first insemination date, with cumulative NRR counts, so that the NRR for any cut-off date
+    is found by bisection instead of by scanning every cow.
+
+    cumulative_counts[k] holds the counts, in the order of 'nrr_count_fields', of all cows first inseminated
+    on or before first_insemination_dates[k].
+    """
+    season_start_date: datetime.date
+    season_end_date: datetime.date
+    first_insemination_dates: list[datetime.date]
+    cumulative_counts: list[tuple]
+
+
+def build_nrr_season_index(
+        cow_dict: dict, season_start_date: datetime.date, season_end_date: datetime.date
+) -> NrrSeasonIndex:
+    counts_by_date = dict()
+
+    for cow, data in cow_dict.items():
+        first_insemination_date = data["first_insemination_date"]
+        if first_insemination_date not in counts_by_date:
+            counts_by_date[first_insemination_date] = dict.fromkeys(nrr_count_fields, 0)
+        counts_by_date[first_insemination_date][classify_cow_for_nrr(data)] += 1
+
+    first_insemination_dates = sorted(counts_by_date)
+
+    cumulative_counts = []
+    running_counts = (0,) * len(nrr_count_fields)
+    for first_insemination_date in first_insemination_dates:
+        date_counts = counts_by_date[first_insemination_date]
+        running_counts = tuple(
+            running + date_counts[field] for running, field in zip(running_counts, nrr_count_fields)
+        )
+        cumulative_counts.append(running_counts)
+
+    return NrrSeasonIndex(
+        season_start_date=season_start_date,
+        season_end_date=season_end_date,
+        first_insemination_dates=first_insemination_dates,
+        cumulative_counts=cumulative_counts,
     )
-    end_of_six_weeks = first_date + datetime.timedelta(weeks=6)
-    end_of_period = min(end_of_six_weeks, last_date)  # In case a real season is *less* than six weeks.
-    end_of_period_minus_24 = end_of_period - datetime.timedelta(days=24)
-    six_weeks_confirmed_nrr = calculate_non_return_rate(
-        cow_dict=cow_dict, start_date=first_date, cut_off_date=end_of_period_minus_24
+
+
+def calculate_non_return_rate_from_index(
+        season_index: NrrSeasonIndex, start_date: datetime.date, cut_off_date: datetime.date
+) -> dict:
+    """
+    Same result as calculate_non_return_rate(), in O(log n) time.
+    """
+    k = bisect.bisect_right(season_index.first_insemination_dates, cut_off_date)
+    if k == 0:
+        counts = (0,) * len(nrr_count_fields)  # No cows first inseminated by the cut-off date.
+    else:
+        counts = season_index.cumulative_counts[k - 1]
+
+    return summarise_nrr_counts(
+        counts=dict(zip(nrr_count_fields, counts)), start_date=start_date, cut_off_date=cut_off_date
     )
 
-    nrr_by_bull = calculate_nrr_by_bull(
-        bull_statistics=bull_statistics,
-        cow_dict=cow_dict,
-        start_date=first_date,
-        cut_off_date=end_of_period_minus_24
+
+def calculate_non_return_rate_for_window(season_index: NrrSeasonIndex, window_days: int) -> dict:
+    """
+    NRR for an analysis window of 'window_days' from the start of the season.
+    As for the six-week NRR, the cut-off date is 24 days before the end of the window.
+    """
+    season_start_date = season_index.season_start_date
+    end_of_window = season_start_date + datetime.timedelta(days=window_days)
+    end_of_period = min(end_of_window, season_index.season_end_date)  # Window may run past the end of the season.
+    cut_off_date = end_of_period - datetime.timedelta(days=24)
+
+    return calculate_non_return_rate_from_index(
+        season_index=season_index, start_date=season_start_date, cut_off_date=cut_off_date
     )
-    #######################################################################################
-    # Generate other statistics.
 
-    total_cows_submitted = len(cow_dict)
-    total_inseminations = len(inseminations)
 
-    try:
-        herd_size = int(herd_size_str)
-    except ValueError:
-        herd_size = None
+def calculate_nrr_curve(season_index: NrrSeasonIndex) -> list[dict]:
+    """
+    The NRR with a cut-off date on every day of the season.
+    Cut-off dates more than 24 days before the end of the season are 'confirmed'.
+    """
+    season_start_date = season_index.season_start_date
+    last_confirmed_date = season_index.season_end_date - datetime.timedelta(days=24)
+    num_days = (season_index.season_end_date - season_start_date).days + 1
 
-    submission_statistics = calculate_cumulative_insemination_statistics(cow_dict=cow_dict, herd_size=herd_size)
-    create_cow_submission_graph(cow_dict=cow_dict, graph_filename=cow_submission_graph_file_path)
+    nrr_curve = []
 
-    return_status_statistics = calculate_return_status_statistics(cow_dict=cow_dict)
+    for day in range(1, num_days + 1):
+        cut_off_date = season_start_date + datetime.timedelta(days=day - 1)
+        nrr = calculate_non_return_rate_from_index(
+            season_index=season_index, start_date=season_start_date, cut_off_date=cut_off_date
+        )
+        nrr["day"] = day
+        nrr["confirmed"] = cut_off_date <= last_confirmed_date
+        nrr_curve.append(nrr)
 
-    return_days_histogram = create_return_days_histogram(  # Writes bar chart file to disk at "temp/cowpoke".
-        cow_dict=cow_dict, bar_chart_filename=returns_bar_chart_file_path
-    )
+    return nrr_curve
 
-    ############################################################################################
 
-    generate_augmented_insemination_file(  # Writes augmented insemination file to disk at "temp/cowpoke".
-        cow_dict=cow_dict,
-        output_file_path=output_file_path,
+def write_nrr_season_index(season_index: NrrSeasonIndex, file_path: str):
+    season_index_json = {
+        "season_start_date": season_index.season_start_date.isoformat(),
+        "season_end_date": season_index.season_end_date.isoformat(),
+        "first_insemination_dates": [x.isoformat() for x in season_index.first_insemination_dates],
+        "nrr_count_fields": nrr_count_fields,
+        "cumulative_counts": season_index.cumulative_counts,
+    }
+    with open(file_path, "w") as g:
+        json.dump(season_index_json, g)
+
+
+def read_nrr_season_index(file_path: str) -> NrrSeasonIndex:
+    with open(file_path) as f:
+        season_index_json = json.load(f)
+
+    if tuple(season_index_json["nrr_count_fields"]) != nrr_count_fields:
+        raise ValueError(f"Season index file '{file_path}' was written with different NRR count fields")
+
+    return NrrSeasonIndex(
+        season_start_date=datetime.date.fromisoformat(season_index_json["season_start_date"]),
+        season_end_date=datetime.date.fromisoformat(season_index_json["season_end_date"]),
+        first_insemination_dates=[
+            datetime.date.fromisoformat(x) for x in season_index_json["first_insemination_dates"]
+        ],
+        cumulative_counts=[tuple(x) for x in season_index_json["cumulative_counts"]],
     )
 
-    return {
-        "first_insemination_date": first_date.strftime("%d-%b-%y"),
-        "last_insemination_date": last_date.strftime("%d-%b-%y"),
-        "bull_statistics": bull_statistics,
-        "total_cows_submitted": total_cows_submitted,
-        "total_inseminations": total_inseminations,
-        "submission_statistics": submission_statistics,
-        "nrr": {
-            "full_season_unconfirmed": full_season_unconfirmed_nrr,
-            "full_season_confirmed": full_season_confirmed_nrr,
-            "six_weeks_confirmed": six_weeks_confirmed_nrr,
+
+# Bit of each ReturnType in per-cow return bitmasks.  (The NumPy engine uses the same bits.)
+return_type_bits = {return_type: 1 << code for code, return_type in enumerate(ReturnType)}
+
+
+def calculate_return_bitmask(return_types: list[ReturnType]) -> int:
+    bitmask = 0
+    for return_type in return_types:
+        bitmask |= return_type_bits[return_type]
+    return bitmask
+
+
+def classify_return_bitmask(bitmask: int) -> str:
+    """
+    Same as classify_cow_for_nrr(), for a cow's return bitmask.
+    A cow with no returns has only the FIRST_INSEMINATION bit, because every later insemination is a return.
+    """
+    if bitmask & (return_type_bits[ReturnType.TWO_17_DAY] | return_type_bits[ReturnType.LONG]):
+        return "excluded_from_analysis"
+    elif bitmask == return_type_bits[ReturnType.FIRST_INSEMINATION]:
+        return "non_return_cows"
+    elif bitmask & return_type_bits[ReturnType.SAME_DAY]:
+        return "same_day_return_cows"
+    elif bitmask & return_type_bits[ReturnType.ONE_DAY]:
+        return "one_day_return_cows"
+    elif bitmask & return_type_bits[ReturnType.NORMAL]:
+        return "returned_cows"
+    else:
+        return "other_eligible_cows"
+
+
+# Per-bull counters kept in a season record, at the six week cut-off date.  (See 'nrr_by_bull'.)
+bull_counter_fields = ("inseminations", "total_cows", "eligible_cows", "returned_cows")
+
+
+@dataclass
+class NrrSeasonRecord:
+    """
+    The facts about a season that later seasons are compared with, small enough to keep for every farm.
+
+    first_insemination_days[i] is the day of the season (0 = season_start_date) when cow i was first inseminated,
+    and return_bitmasks[i] has the 'return_type_bits' of all her inseminations.  Cows are in order of first
+    insemination, and the Cow IDs are not kept.  bull_counters has the 'bull_counter_fields' of each bull.
+    """
+    season_start_date: datetime.date
+    season_end_date: datetime.date
+    first_insemination_days: list[int]
+    return_bitmasks: list[int]
+    bull_counters: dict[str, tuple]
+
+
+def build_nrr_season_record(
+        season_start_date: datetime.date,
+        season_end_date: datetime.date,
+        first_insemination_days: list[int],
+        return_bitmasks: list[int],
+        bull_statistics: list[dict],
+        nrr_by_bull: list[dict],
+) -> NrrSeasonRecord:
+    cows = sorted(zip(first_insemination_days, return_bitmasks))
+
+    nrr_counts_by_bull = {x["bull_name"]: x["nrr"] for x in nrr_by_bull}
+
+    return NrrSeasonRecord(
+        season_start_date=season_start_date,
+        season_end_date=season_end_date,
+        first_insemination_days=[day for day, _ in cows],
+        return_bitmasks=[bitmask for _, bitmask in cows],
+        bull_counters={
+            bull["bull_name"]: (
+                bull["count"],
+                nrr_counts_by_bull[bull["bull_name"]]["total_cows"],
+                nrr_counts_by_bull[bull["bull_name"]]["eligible_cows"],
+                nrr_counts_by_bull[bull["bull_name"]]["returned_cows"],
+            )
+            for bull in bull_statistics
         },
-        "rss": return_status_statistics,
-        "return_days_histogram": return_days_histogram,
-        "nrr_by_bull": nrr_by_bull,
-    }
+    )
 
 
-def calculate_non_return_rate(cow_dict: dict, start_date: datetime.date, cut_off_date: datetime.date) -> dict:
+def build_nrr_season_index_from_record(season_record: NrrSeasonRecord) -> NrrSeasonIndex:
+    """
+    Same season index as the analysis of the original mating records, without the mating records.
+    """
+    counts_by_day = dict()
+
+    for day, bitmask in zip(season_record.first_insemination_days, season_record.return_bitmasks):
+        if day not in counts_by_day:
+            counts_by_day[day] = dict.fromkeys(nrr_count_fields, 0)
+        counts_by_day[day][classify_return_bitmask(bitmask)] += 1
+
+    first_insemination_dates = []
+    cumulative_counts = []
+    running_counts = (0,) * len(nrr_count_fields)
+    for day in sorted(counts_by_day):
+        day_counts = counts_by_day[day]
+        running_counts = tuple(
+            running + day_counts[field] for running, field in zip(running_counts, nrr_count_fields)
+        )
+        first_insemination_dates.append(season_record.season_start_date + datetime.timedelta(days=day))
+        cumulative_counts.append(running_counts)
+
+    return NrrSeasonIndex(
+        season_start_date=season_record.season_start_date,
+        season_end_date=season_record.season_end_date,
+        first_insemination_dates=first_insemination_dates,
+        cumulative_counts=cumulative_counts,
+    )
 
-        total_cows = 0
-        excluded_from_analysis = 0
-        eligible_cows = 0
-        non_return_cows = 0
-        same_day_return_cows = 0
-        one_day_return_cows = 0
-        returned_cows = 0
 
-        for cow, data in cow_dict.items():
-            if cut_off_date < data["first_insemination_date"]:
-                continue
+def write_nrr_season_record(season_record: NrrSeasonRecord, file_path: str):
+    season_record_json = {
+        "season_start_date": season_record.season_start_date.isoformat(),
+        "season_end_date": season_record.season_end_date.isoformat(),
+        "first_insemination_days": season_record.first_insemination_days,
+        "return_types": [x.name for x in return_type_bits],
+        "return_bitmasks": season_record.return_bitmasks,
+        "bull_counter_fields": bull_counter_fields,
+        "bull_counters": season_record.bull_counters,
+    }
+    with open(file_path, "w") as g:
+        json.dump(season_record_json, g)
 
-            total_cows += 1
-            if data["has_two_17_day_return"] or data["has_long_return"]:
-                excluded_from_analysis += 1
-                continue
-            else:
-                eligible_cows += 1
-                if data["no_returns"]:
-                    non_return_cows += 1
-                elif data["has_same_day_return"]:
-                    same_day_return_cows += 1
-                elif data["has_one_day_return"]:
-                    one_day_return_cows += 1
-                elif data["has_normal_return"]:
-                    returned_cows += 1
-
-        if eligible_cows > 0:
-            # This is not quite correct, because a cow could have a one-day return AND a normal return.
-            # non_return_rate = (100 * Decimal(non_return_cows + same_day_return_cows + one_day_return_cows)/
-            #                    Decimal(eligible_cows))
-
-            non_return_rate = 100 * Decimal(eligible_cows - returned_cows) / Decimal(eligible_cows)
-            non_return_rate_string = f"{non_return_rate:.1f}"
-        else:
-            non_return_rate_string = "N/A"
-
-        return {
-            "start_date": start_date.strftime("%d-%b-%y"),
-            "cutoff_date": cut_off_date.strftime("%d-%b-%y"),
-            "total_cows": total_cows,
-            "excluded_from_analysis": excluded_from_analysis,
-            "eligible_cows": eligible_cows,
-            "non_return_cows": non_return_cows,
-            "same_day_return_cows": same_day_return_cows,
-            "one_day_return_cows": one_day_return_cows,
-            "returned_cows": returned_cows,
-            "eligible_minus_returned_cows": eligible_cows - returned_cows,
-            "non_return_rate": non_return_rate_string,
-        }
+
+def read_nrr_season_record(file_path: str) -> NrrSeasonRecord:
+    with open(file_path) as f:
+        season_record_json = json.load(f)
+
+    if (season_record_json["return_types"] != [x.name for x in return_type_bits]
+            or tuple(season_record_json["bull_counter_fields"]) != bull_counter_fields):
+        raise ValueError(f"Season record file '{file_path}' was written with different return types or counters")
+
+    return NrrSeasonRecord(
+        season_start_date=datetime.date.fromisoformat(season_record_json["season_start_date"]),
+        season_end_date=datetime.date.fromisoformat(season_record_json["season_end_date"]),
+        first_insemination_days=season_record_json["first_insemination_days"],
+        return_bitmasks=season_record_json["return_bitmasks"],
+        bull_counters={bull: tuple(x) for bull, x in season_record_json["bull_counters"].items()},
+    )
 
 
 def calculate_nrr_by_bull(
         bull_statistics: list[dict], cow_dict: dict, start_date: datetime.date, cut_off_date: datetime.date
 ) -> list[dict]:
+    nrr_by_bull_for_cut_offs = calculate_nrr_by_bull_for_cut_offs(
+        bull_statistics=bull_statistics, cow_dict=cow_dict, start_date=start_date, cut_off_dates=[cut_off_date]
+    )
+    return nrr_by_bull_for_cut_offs[0]
+
+
+def calculate_nrr_by_bull_for_cut_offs(
+        bull_statistics: list[dict], cow_dict: dict, start_date: datetime.date, cut_off_dates: list[datetime.date]
+) -> list[list[dict]]:
+    """
+    Calculate the NRR per bull for any number of cut-off dates, in a single pass over the cows.
+    Returns one 'nrr_by_bull' list per cut-off date, in the same order as 'cut_off_dates'.
 
+    The NRR for a given bull is calculated from the set of cows inseminated at least once by that bull.
+    """
     bulls = [x["bull_name"] for x in bull_statistics]
+    sorted_cut_offs = sorted(set(cut_off_dates))
 
-    nrr_by_bull = []
+    # counts[bull][k] counts the cows first inseminated after sorted_cut_offs[k-1], up to sorted_cut_offs[k].
+    counts = {
+        bull: [dict.fromkeys(nrr_count_fields, 0) for _ in sorted_cut_offs]
+        for bull in bulls
+    }
 
-    for bull in bulls:
-        cow_dict_for_bull = dict()
-        for cow, data in cow_dict.items():
-            if bull in data["bulls"]:
-                cow_dict_for_bull[cow] = data
+    for cow, data in cow_dict.items():
+        k = bisect.bisect_left(sorted_cut_offs, data["first_insemination_date"])
+        if k == len(sorted_cut_offs):
+            continue  # First inseminated after every cut-off date.
 
-        nrr_for_bull = calculate_non_return_rate(
-            cow_dict=cow_dict_for_bull, start_date=start_date, cut_off_date=cut_off_date
-        )
-        nrr_by_bull.append({
-            "bull_name": bull,
-            "nrr": nrr_for_bull,
-        })
+        nrr_count_field = classify_cow_for_nrr(data)
+        for bull in data["bulls"]:
+            if bull in counts:
+                counts[bull][k][nrr_count_field] += 1
+
+    # Accumulate, so that counts[bull][k] covers every cow first inseminated up to sorted_cut_offs[k].
+    for bull_counts in counts.values():
+        for previous, current in zip(bull_counts, bull_counts[1:]):
+            for field in nrr_count_fields:
+                current[field] += previous[field]
+
+    nrr_by_bull_for_cut_offs = []
+
+    for cut_off_date in cut_off_dates:
+        k = sorted_cut_offs.index(cut_off_date)
+        nrr_by_bull_for_cut_offs.append([
+            {
+                "bull_name": bull,
+                "nrr": summarise_nrr_counts(counts=counts[bull][k], start_date=start_date, cut_off_date=cut_off_date),
+            }
+            for bull in bulls
+        ])
 
-    return nrr_by_bull
+    return nrr_by_bull_for_cut_offs
 
 
 def calculate_return_status_statistics(cow_dict: dict) -> dict:
@@ -272,7 +791,26 @@ def calculate_return_status_statistics(cow_dict: dict) -> dict:
             elif insem.return_type == ReturnType.LONG:
                 long_returns += 1
 
+    return summarise_return_statuses(
+        first_inseminations=first_inseminations,
+        same_day_returns=same_day_returns,
+        one_day_returns=one_day_returns,
+        two_17_day_returns=two_17_day_returns,
+        normal_returns=normal_returns,
+        long_returns=long_returns,
+    )
+
+
+def summarise_return_statuses(
+        first_inseminations: int,
+        same_day_returns: int,
+        one_day_returns: int,
+        two_17_day_returns: int,
+        normal_returns: int,
+        long_returns: int,
+) -> dict:
     total_returns = same_day_returns + one_day_returns + two_17_day_returns + normal_returns + long_returns
+    total_inseminations = first_inseminations + total_returns
 
     first_insemination_rate = 100 * Decimal(first_inseminations)/Decimal(total_inseminations)
     total_return_rate = 100 * Decimal(total_returns)/Decimal(total_inseminations)
@@ -312,7 +850,7 @@ def calculate_return_status_statistics(cow_dict: dict) -> dict:
     }
 
 
-def create_return_days_histogram(cow_dict: dict, bar_chart_filename: str) -> list:
+def create_return_days_histogram(cow_dict: dict, bar_chart_filename: Union[str, None] = None) -> list:
 
     return_days_histogram = dict()
 
@@ -330,9 +868,25 @@ def create_return_days_histogram(cow_dict: dict, bar_chart_filename: str) -> lis
     return_days_histogram_list = [(days, count) for days, count in return_days_histogram.items()]
     return_days_histogram_list.sort(key=lambda x: x[0])
 
-    ########################################################################
-    # Create Bar Chart of Counts of Returns by Days Elapsed.
+    if bar_chart_filename:
+        plot_return_days_histogram(
+            return_days_histogram_list=return_days_histogram_list, bar_chart_filename=bar_chart_filename
+        )
+
+    return return_days_histogram_list
+
+
+def plot_return_days_histogram(return_days_histogram_list: list, bar_chart_filename: str):
+    with open(bar_chart_filename, "wb") as g:
+        g.write(render_return_days_histogram(return_days_histogram_list=return_days_histogram_list))
 
+
+def render_return_days_histogram(return_days_histogram_list: list) -> bytes:
+    """
+    Create Bar Chart of Counts of Returns by Days Elapsed, as SVG.
+    'return_days_histogram_list' is a list of (days, count) tuples, sorted by days.
+    Uses its own Figure (not the pyplot state machine), so it is safe to run concurrently, eg. in a process pool.
+    """
     days = [day for (day, count) in return_days_histogram_list]
     counts = [count for (day, count) in return_days_histogram_list]
 
@@ -343,34 +897,28 @@ def create_return_days_histogram(cow_dict: dict, bar_chart_filename: str) -> lis
                + ["green" for x in range(num_bars_normal)]
                + ["blue" for x in range(num_bars_long)])
 
-    plt.cla()
-    plt.bar(days, counts, color=colours, zorder=2)
+    fig = Figure()
+    ax = fig.subplots()
+    ax.bar(days, counts, color=colours, zorder=2)
 
-    plt.xlabel("Days Since Previous Insemination")
-    plt.ylabel("Count")
-    plt.title("Counts of Returns by Days")
+    ax.set_xlabel("Days Since Previous Insemination")
+    ax.set_ylabel("Count")
+    ax.set_title("Counts of Returns by Days")
 
-    max_days = max(return_days_histogram.keys())
+    max_days = max(days)
     x_labels = range(0, max_days+1, 2)
-    plt.xticks(ticks=x_labels, labels=x_labels)
+    ax.set_xticks(ticks=x_labels, labels=x_labels)
 
-    max_count = max(return_days_histogram.values())
+    max_count = max(counts)
     y_labels = range(0, max_count+1, 2)
-    plt.yticks(ticks=y_labels, labels=y_labels)
+    ax.set_yticks(ticks=y_labels, labels=y_labels)
 
-    plt.grid(visible=True, axis='y', zorder=0)
+    ax.grid(visible=True, axis='y', zorder=0)
 
-    plt.savefig(bar_chart_filename)
-
-    return return_days_histogram_list
+    return _figure_to_svg(fig)
 
 
 def calculate_cumulative_insemination_statistics(cow_dict: dict, herd_size: Union[int, None]) -> list[dict]:
-    target_weekly_pcts = {
-        1: "30%",
-        2: "60%",
-        3: "90%",
-    }
     total_cows_submitted = len(cow_dict)
 
     first_submissions = [(cow, data["first_insemination_date"]) for cow, data in cow_dict.items()]
@@ -383,9 +931,7 @@ def calculate_cumulative_insemination_statistics(cow_dict: dict, herd_size: Unio
     week_end_date = start_date + datetime.timedelta(weeks=1)
 
     week = 1
-    cumulative_count = 0
-
-    submissions_by_week = []
+    week_counts = []
 
     while week_start_date <= end_date or week <= 3:
         week_count = 0
@@ -394,6 +940,30 @@ def calculate_cumulative_insemination_statistics(cow_dict: dict, herd_size: Unio
             if week_start_date <= insem_date < week_end_date:
                 week_count += 1
 
+        week_counts.append(week_count)
+
+        week += 1
+        week_start_date = week_end_date
+        week_end_date += datetime.timedelta(weeks=1)
+
+    return summarise_weekly_submissions(
+        week_counts=week_counts, total_cows_submitted=total_cows_submitted, herd_size=herd_size
+    )
+
+
+def summarise_weekly_submissions(
+        week_counts: list[int], total_cows_submitted: int, herd_size: Union[int, None]
+) -> list[dict]:
+    target_weekly_pcts = {
+        1: "30%",
+        2: "60%",
+        3: "90%",
+    }
+    cumulative_count = 0
+
+    submissions_by_week = []
+
+    for week, week_count in enumerate(week_counts, start=1):
         cumulative_count += week_count
         cumulative_pct_insems = 100 * Decimal(cumulative_count)/Decimal(total_cows_submitted)
 
@@ -417,14 +987,10 @@ def calculate_cumulative_insemination_statistics(cow_dict: dict, herd_size: Unio
 
         submissions_by_week.append(weekly_data)
 
-        week += 1
-        week_start_date = week_end_date
-        week_end_date += datetime.timedelta(weeks=1)
-
     return submissions_by_week
 
 
-def create_cow_submission_graph(cow_dict: dict, graph_filename: str):
+def create_cow_submission_graph(cow_dict: dict, graph_filename: Union[str, None] = None) -> list:
     date_dict = dict()
 
     for cow, data in cow_dict.items():
@@ -454,31 +1020,57 @@ def create_cow_submission_graph(cow_dict: dict, graph_filename: str):
         insems_cum_count += counts["inseminations"]
         day_cumulative_counts.append((day, cow_cum_count, insems_cum_count))
 
+    if graph_filename:
+        plot_cow_submission_graph(day_cumulative_counts=day_cumulative_counts, graph_filename=graph_filename)
+
+    return day_cumulative_counts
+
+
+def plot_cow_submission_graph(day_cumulative_counts: list, graph_filename: str):
+    """
+    'day_cumulative_counts' is a list of (day, cumulative cows, cumulative inseminations) tuples, sorted by day.
+    Day 1 is the first day of the season.
+    """
+    with open(graph_filename, "wb") as g:
+        g.write(render_cow_submission_graph(day_cumulative_counts=day_cumulative_counts))
+
+
+def render_cow_submission_graph(day_cumulative_counts: list) -> bytes:
+    """
+    Create Line Graph of Cumulative Cow Submissions and Inseminations, as SVG.  (See plot_cow_submission_graph.)
+    """
     x_days = [day for day, cum_cows, cum_insems in day_cumulative_counts]
     cows_cumulative = [cum_cows for day, cum_cows, cum_insems in day_cumulative_counts]
     insems_cumulative = [cum_insems for day, cum_cows, cum_insems in day_cumulative_counts]
 
-    plt.cla()
-    plt.plot(x_days, insems_cumulative, color="green", label="Inseminations")
-    plt.plot(x_days, cows_cumulative, color="blue", label="Cow Submissions")
-    plt.legend()
+    fig = Figure()
+    ax = fig.subplots()
+    ax.plot(x_days, insems_cumulative, color="green", label="Inseminations")
+    ax.plot(x_days, cows_cumulative, color="blue", label="Cow Submissions")
+    ax.legend()
 
-    plt.xlabel("Days into Season")
-    plt.ylabel("Cumulative Counts")
-    plt.title("Cow Submissions and Inseminations")
+    ax.set_xlabel("Days into Season")
+    ax.set_ylabel("Cumulative Counts")
+    ax.set_title("Cow Submissions and Inseminations")
 
     max_days = x_days[-1]
     x_labels = range(0, max_days+1, 2)
-    plt.xticks(ticks=x_labels, labels=x_labels)
+    ax.set_xticks(ticks=x_labels, labels=x_labels)
 
     max_count = insems_cumulative[-1]
     y_labels = range(0, max_count+50, 100)
-    plt.yticks(ticks=y_labels, labels=y_labels)
+    ax.set_yticks(ticks=y_labels, labels=y_labels)
+
+    ax.vlines([7, 14, 21], ymin=0, ymax=max_count, linestyles="dashed")
+    ax.grid(visible=True, axis='y', linestyle="dashed", zorder=0)
+
+    return _figure_to_svg(fig)
 
-    plt.vlines([7, 14, 21], ymin=0, ymax=max_count, linestyles="dashed")
-    plt.grid(visible=True, axis='y', linestyle="dashed", zorder=0)
 
-    plt.savefig(graph_filename)
+def _figure_to_svg(fig: Figure) -> bytes:
+    svg_buffer = io.BytesIO()
+    fig.savefig(svg_buffer, format="svg")
+    return svg_buffer.getvalue()
 
 
 def calculate_return_status(days_elapsed: int) -> ReturnType:
@@ -495,6 +1087,12 @@ def calculate_return_status(days_elapsed: int) -> ReturnType:
 
 
 def calculate_bull_statistics(inseminations: list) -> list:
+    """
+    'inseminations' is a list of (cow, date, bull) tuples, or InseminationColumns.
+    """
+    if isinstance(inseminations, InseminationColumns):
+        return summarise_bull_counts(bull_counts=inseminations.bull_counts(), total_inseminations=len(inseminations))
+
     bull_dict = dict()
 
     for cow, insem_date, bull in inseminations:
@@ -503,9 +1101,15 @@ def calculate_bull_statistics(inseminations: list) -> list:
         else:
             bull_dict[bull] = 1
 
-    total_inseminations = len(inseminations)
+    return summarise_bull_counts(bull_counts=list(bull_dict.items()), total_inseminations=len(inseminations))
+
+
+def summarise_bull_counts(bull_counts: list[tuple], total_inseminations: int) -> list:
+    """
+    'bull_counts' is a list of (bull, count) tuples, in order of each bull's first appearance in the input file.
+    """
     bull_list = []
-    for bull, count in bull_dict.items():
+    for bull, count in bull_counts:
         pct = 100 * Decimal(count)/Decimal(total_inseminations)
         bull_list.append({
             "bull_name": bull,
@@ -559,57 +1163,144 @@ def generate_augmented_insemination_file(cow_dict: dict, output_file_path: str):
     inseminations_per_cow.sort(key=lambda x: x[1], reverse=True)  # Sort by Num Inseminations.
     # Since sorts are *stable*, records with same Num Inseminations keep their original order (which was sorted).
 
-    return_type_map = {
-        ReturnType.FIRST_INSEMINATION: "",
-        ReturnType.SAME_DAY: "Short",
-        ReturnType.ONE_DAY: "Short",
-        ReturnType.TWO_17_DAY: "Short",
-        ReturnType.NORMAL: "Normal",
-        ReturnType.LONG: "Long",
-    }
+    lines = (
+        format_augmented_insemination_line(
+            cow=str(cow_id),
+            date_string=insem.insemination_date.strftime("%d-%b-%y"),
+            bull=insem.bull,
+            return_type=insem.return_type,
+            days_elapsed=insem.days_elapsed,
+        )
+        for cow_id, num_insems in inseminations_per_cow
+        for insem in cow_dict[str(cow_id)]["inseminations"]
+    )
+    write_augmented_insemination_file(lines=lines, output_file_path=output_file_path)
+
+
+augmented_return_type_map = {
+    ReturnType.FIRST_INSEMINATION: "",
+    ReturnType.SAME_DAY: "Short",
+    ReturnType.ONE_DAY: "Short",
+    ReturnType.TWO_17_DAY: "Short",
+    ReturnType.NORMAL: "Normal",
+    ReturnType.LONG: "Long",
+}
+
+
+def format_augmented_insemination_line(
+        cow: str, date_string: str, bull: str, return_type: ReturnType, days_elapsed
+) -> str:
+    return f"{cow},{date_string},{bull},{augmented_return_type_map[return_type]},{days_elapsed}" + "\n"
+
+
+def write_augmented_insemination_file(lines, output_file_path: str):
+    """
+    'lines' is an iterable of lines created by format_augmented_insemination_line(), already in output order.
+    """
     with open(output_file_path, "w") as g:
         header_tuple = ("Cow", "Mating Date", "Bull", "Return Type", "Days")
         header = ",".join(header_tuple) + "\n"
         g.write(header)
-
-        for cow_id, num_insems in inseminations_per_cow:
-            cow = str(cow_id)
-            cow_insems = cow_dict[cow]["inseminations"]
-            for insem in cow_insems:
-                date_string = insem.insemination_date.strftime("%d-%b-%y")
-                return_type = return_type_map[insem.return_type]
-                line = f"{cow},{date_string},{insem.bull},{return_type},{insem.days_elapsed}" + "\n"
-                g.write(line)
+        g.writelines(lines)
 
 
 def _parse_csv_file(file_path) -> list:
-    inseminations = []
+    """
+    List of (cow, insemination date, bull) tuples, in file order.  'file_path' can also be an open file object.
+    """
+    return list(iter_csv_inseminations(file_path))
 
-    with open(file_path) as f:
-        header = f.readline()
-        fields = header.strip().split(",")
-        lower_case_fields = [x.lower() for x in fields]
-
-        for idx, field in enumerate(lower_case_fields):
-            if "cow" in field:
-                cow_idx = idx
-            if "date" in field:
-                date_idx = idx
-            if "bull" in field:
-                bull_idx = idx
-
-        # File pointer is now at second line, where data starts.
-        for line in f:
-            parts = line.strip().split(",")
-
-            cow = parts[cow_idx].strip()
-            bull = parts[bull_idx].strip()
-            date_string = parts[date_idx].strip()
-            insem_date = datetime.datetime.strptime(date_string, "%d-%b-%y").date()
-
-            inseminations.append((cow, insem_date, bull))
-
-    return inseminations
+
+# Reported in the ValueError for a file with malformed rows.  (The rest are counted.)
+max_reported_row_errors = 10
+
+
+def iter_csv_inseminations(file_path) -> Iterator[tuple]:
+    """
+    Yield (cow, insemination date, bull) tuples, one row at a time.
+    'file_path' is a path, or an open file object in text or binary mode (eg. an uploaded file), which is not closed.
+
+    Raises ValueError (after the last row) listing the line numbers of malformed rows, and if the header has no
+    Cow, Date or Bull column.  Blank lines are skipped.
+    """
+    if isinstance(file_path, (str, os.PathLike)):
+        with open(file_path, "rb") as f:
+            yield from iter_csv_inseminations(f)
+        return
+
+    if isinstance(file_path.read(0), bytes):
+        f = io.TextIOWrapper(file_path, encoding="utf-8-sig", errors="replace")
+        try:
+            yield from _iter_csv_lines(f)
+        finally:
+            f.detach()  # Otherwise closing the wrapper would close the caller's file.
+    else:
+        yield from _iter_csv_lines(file_path)
+
+
+def _iter_csv_lines(f) -> Iterator[tuple]:
+    header = f.readline()
+    fields = header.strip().split(",")
+    lower_case_fields = [x.lower() for x in fields]
+
+    cow_idx = date_idx = bull_idx = None
+    for idx, field in enumerate(lower_case_fields):
+        if "cow" in field:
+            cow_idx = idx
+        if "date" in field:
+            date_idx = idx
+        if "bull" in field:
+            bull_idx = idx
+
+    for column_name, column_idx in (("Cow", cow_idx), ("Mating Date", date_idx), ("Bull", bull_idx)):
+        if column_idx is None:
+            raise ValueError(f"No '{column_name}' column in the header line: '{header.strip()}'")
+
+    num_fields = max(cow_idx, date_idx, bull_idx) + 1
+
+    # A season only has a few hundred distinct dates, so each one is only parsed once.
+    dates = {}
+    row_errors = []
+    num_inseminations = 0
+
+    # File pointer is now at second line, where data starts.
+    for line_number, line in enumerate(f, start=2):
+        if not line.strip():
+            continue
+
+        parts = line.strip().split(",")
+        if len(parts) < num_fields:
+            row_errors.append(f"Line {line_number}: expected at least {num_fields} columns, found {len(parts)}")
+            continue
+
+        cow = parts[cow_idx].strip()
+        bull = parts[bull_idx].strip()
+        date_string = parts[date_idx].strip()
+
+        if not cow:
+            row_errors.append(f"Line {line_number}: no Cow ID")
+            continue
+
+        insem_date = dates.get(date_string)
+        if insem_date is None:
+            try:
+                insem_date = datetime.datetime.strptime(date_string, "%d-%b-%y").date()
+            except ValueError:
+                row_errors.append(f"Line {line_number}: could not read date '{date_string}' (expected eg. 07-May-24)")
+                continue
+            dates[date_string] = insem_date
+
+        num_inseminations += 1
+        yield cow, insem_date, bull
+
+    if row_errors:
+        message = "; ".join(row_errors[:max_reported_row_errors])
+        if len(row_errors) > max_reported_row_errors:
+            message += f"; and {len(row_errors) - max_reported_row_errors} more malformed rows"
+        raise ValueError(message)
+
+    if num_inseminations == 0:
+        raise ValueError("No inseminations in the file")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,437 @@
+"""
+Vectorised NumPy engine for the Non Return Rate analysis.
+
+Produces exactly the same result dict, charts and augmented CSV file as
+calculate_non_return_rate_results() in 'non_return_rate.py', but never builds the per-cow dict of
+Insemination dataclasses.  Instead the inseminations are held as columnar arrays:
+
+    cow codes       (int, index into the sorted array of unique Cow IDs)
+    dates           (int, proleptic Gregorian ordinals, ie. datetime.date.toordinal())
+    bull codes      (int, index into the sorted array of unique Bull names)
+
+The arrays are sorted by cow, then by date, so that each cow's inseminations form one contiguous group.
+Days elapsed is then a single diff over the whole array, and per-cow facts are reductions over the groups.
+"""
+import datetime
+from typing import Iterable, Union
+
+import numpy as np
+
+from src.cowpoke.non_return_rate.non_return_rate import (
+    NrrSeasonIndex,
+    ReturnType,
+    build_nrr_season_record,
+    calculate_non_return_rate_from_index,
+    calculate_non_return_rate_results,
+    cow_id_sort_key,
+    format_augmented_insemination_line,
+    iter_csv_inseminations,
+    nrr_count_fields,
+    plot_cow_submission_graph,
+    plot_return_days_histogram,
+    summarise_bull_counts,
+    summarise_nrr_counts,
+    summarise_return_statuses,
+    summarise_weekly_submissions,
+    write_augmented_insemination_file,
+    write_nrr_season_index,
+    write_nrr_season_record,
+)
+from src.cowpoke.stage_timing import stage_timer
+
+
+# Integer codes for ReturnType, in definition order.  Bit (1 << code) is used in per-cow return bitmasks.
+return_types = tuple(ReturnType)
+FIRST_INSEMINATION = return_types.index(ReturnType.FIRST_INSEMINATION)
+SAME_DAY = return_types.index(ReturnType.SAME_DAY)
+ONE_DAY = return_types.index(ReturnType.ONE_DAY)
+TWO_17_DAY = return_types.index(ReturnType.TWO_17_DAY)
+NORMAL = return_types.index(ReturnType.NORMAL)
+LONG = return_types.index(ReturnType.LONG)
+
+# Mutually exclusive per-cow classes used for NRR counting, as indices into 'nrr_count_fields'.
+# Same precedence as classify_cow_for_nrr().
+NRR_EXCLUDED = nrr_count_fields.index("excluded_from_analysis")
+NRR_NON_RETURN = nrr_count_fields.index("non_return_cows")
+NRR_SAME_DAY = nrr_count_fields.index("same_day_return_cows")
+NRR_ONE_DAY = nrr_count_fields.index("one_day_return_cows")
+NRR_RETURNED = nrr_count_fields.index("returned_cows")
+NUM_NRR_CLASSES = len(nrr_count_fields)
+
+
+def calculate_non_return_rate_results_numpy(
+        herd_size_str,
+        input_file_path: str,
+        output_file_path: str,
+        returns_bar_chart_file_path: Union[str, None] = None,
+        cow_submission_graph_file_path: Union[str, None] = None,
+        season_index_file_path: Union[str, None] = None,
+        season_record_file_path: Union[str, None] = None,
+        inseminations: Union[Iterable[tuple], None] = None,
+) -> dict:
+    with stage_timer("parse"):
+        if inseminations is None:
+            inseminations = iter_csv_inseminations(input_file_path)  # Streamed, without a list of tuples.
+
+        cow_ids, bull_names, cows, dates, bulls = _inseminations_to_columns(inseminations=inseminations)
+
+    with stage_timer("classification"):
+        season = _build_season_arrays(cows=cows, dates=dates, bulls=bulls)
+
+        bull_statistics = _calculate_bull_statistics(bull_names=bull_names, bulls=bulls)
+
+    first_date = datetime.date.fromordinal(int(dates.min()))
+    last_date = datetime.date.fromordinal(int(dates.max()))
+
+    ###########################################################################################
+    # Generate Non Return Rates.
+
+    with stage_timer("nrr"):
+        season_index = _build_nrr_season_index(season=season, season_start_date=first_date, season_end_date=last_date)
+        if season_index_file_path:
+            write_nrr_season_index(season_index=season_index, file_path=season_index_file_path)
+
+        full_season_unconfirmed_nrr = calculate_non_return_rate_from_index(
+            season_index=season_index, start_date=first_date, cut_off_date=last_date
+        )
+        last_date_minus_24 = last_date - datetime.timedelta(days=24)
+        full_season_confirmed_nrr = calculate_non_return_rate_from_index(
+            season_index=season_index, start_date=first_date, cut_off_date=last_date_minus_24
+        )
+        end_of_six_weeks = first_date + datetime.timedelta(weeks=6)
+        end_of_period = min(end_of_six_weeks, last_date)  # In case a real season is *less* than six weeks.
+        end_of_period_minus_24 = end_of_period - datetime.timedelta(days=24)
+        six_weeks_confirmed_nrr = calculate_non_return_rate_from_index(
+            season_index=season_index, start_date=first_date, cut_off_date=end_of_period_minus_24
+        )
+
+        nrr_by_bull = _calculate_nrr_by_bull(
+            bull_statistics=bull_statistics,
+            bull_names=bull_names,
+            season=season,
+            start_date=first_date,
+            cut_off_date=end_of_period_minus_24,
+        )
+
+        if season_record_file_path:
+            season_record = build_nrr_season_record(
+                season_start_date=first_date,
+                season_end_date=last_date,
+                first_insemination_days=(season["cow_first_dates"] - first_date.toordinal()).tolist(),
+                return_bitmasks=season["cow_return_bitmasks"].tolist(),
+                bull_statistics=bull_statistics,
+                nrr_by_bull=nrr_by_bull,
+            )
+            write_nrr_season_record(season_record=season_record, file_path=season_record_file_path)
+
+    #######################################################################################
+    # Generate other statistics.
+
+    total_cows_submitted = len(season["cow_first_dates"])
+    total_inseminations = len(dates)
+
+    try:
+        herd_size = int(herd_size_str)
+    except ValueError:
+        herd_size = None
+
+    with stage_timer("statistics"):
+        submission_statistics = _calculate_cumulative_insemination_statistics(season=season, herd_size=herd_size)
+        cow_submission_counts = _create_cow_submission_graph(
+            season=season, graph_filename=cow_submission_graph_file_path
+        )
+
+        return_status_statistics = _calculate_return_status_statistics(season=season)
+
+        return_days_histogram = _create_return_days_histogram(
+            season=season, bar_chart_filename=returns_bar_chart_file_path
+        )
+
+    ############################################################################################
+
+    with stage_timer("augmented_csv"):
+        _generate_augmented_insemination_file(
+            season=season, cow_ids=cow_ids, bull_names=bull_names, output_file_path=output_file_path
+        )
+
+    return {
+        "first_insemination_date": first_date.strftime("%d-%b-%y"),
+        "last_insemination_date": last_date.strftime("%d-%b-%y"),
+        "bull_statistics": bull_statistics,
+        "total_cows_submitted": total_cows_submitted,
+        "total_inseminations": total_inseminations,
+        "submission_statistics": submission_statistics,
+        "cow_submission_counts": cow_submission_counts,
+        "nrr": {
+            "full_season_unconfirmed": full_season_unconfirmed_nrr,
+            "full_season_confirmed": full_season_confirmed_nrr,
+            "six_weeks_confirmed": six_weeks_confirmed_nrr,
+        },
+        "rss": return_status_statistics,
+        "return_days_histogram": return_days_histogram,
+        "nrr_by_bull": nrr_by_bull,
+    }
+
+
+# Both engines produce identical results.  The NumPy engine is much faster for large co-op files.
+nrr_engines = {
+    "python": calculate_non_return_rate_results,
+    "numpy": calculate_non_return_rate_results_numpy,
+}
+
+
+def _inseminations_to_columns(inseminations: Iterable[tuple]) -> tuple:
+    """
+    Returns (cow_ids, bull_names, cows, dates, bulls), where 'cow_ids' and 'bull_names' are sorted arrays of the
+    unique Cow IDs and Bull names, and 'cows', 'dates' and 'bulls' are integer arrays in original file order.
+    """
+    cow_list = []
+    date_list = []
+    bull_list = []
+
+    for cow, insem_date, bull in inseminations:
+        cow_list.append(cow)
+        date_list.append(insem_date.toordinal())
+        bull_list.append(bull)
+
+    cow_strings = np.array(cow_list)
+    dates = np.array(date_list, dtype=np.int32)
+    bull_strings = np.array(bull_list)
+
+    cow_ids, cows = np.unique(cow_strings, return_inverse=True)
+    bull_names, bulls = np.unique(bull_strings, return_inverse=True)
+
+    return cow_ids, bull_names, cows, dates, bulls
+
+
+def _build_season_arrays(cows: np.ndarray, dates: np.ndarray, bulls: np.ndarray) -> dict:
+    """
+    Sort inseminations by cow, then date, and derive days elapsed, return types and per-cow classes.
+    Inseminations of one cow on the same date keep their original file order, as in the pure Python engine.
+    """
+    order = np.argsort(dates, kind="stable")
+    order = order[np.argsort(cows[order], kind="stable")]
+
+    sorted_cows = cows[order]
+    sorted_dates = dates[order]
+    sorted_bulls = bulls[order]
+
+    num_inseminations = len(sorted_dates)
+    is_first = np.ones(num_inseminations, dtype=bool)
+    is_first[1:] = sorted_cows[1:] != sorted_cows[:-1]
+
+    days_elapsed = np.zeros(num_inseminations, dtype=np.int32)
+    days_elapsed[1:] = sorted_dates[1:] - sorted_dates[:-1]
+
+    return_codes = _calculate_return_codes(days_elapsed=days_elapsed)
+    return_codes[is_first] = FIRST_INSEMINATION
+
+    group_starts = np.flatnonzero(is_first)
+    inseminations_per_cow = np.diff(np.append(group_starts, num_inseminations))
+
+    return_bits = np.left_shift(1, return_codes).astype(np.uint8)
+    cow_return_bitmasks = np.bitwise_or.reduceat(return_bits, group_starts)
+
+    return {
+        "cows": sorted_cows,
+        "dates": sorted_dates,
+        "bulls": sorted_bulls,
+        "is_first": is_first,
+        "days_elapsed": days_elapsed,
+        "return_codes": return_codes,
+        "group_starts": group_starts,
+        "inseminations_per_cow": inseminations_per_cow,
+        "cow_first_dates": sorted_dates[group_starts],
+        "cow_return_bitmasks": cow_return_bitmasks,
+        "cow_nrr_classes": _calculate_nrr_classes(
+            cow_return_bitmasks=cow_return_bitmasks, inseminations_per_cow=inseminations_per_cow
+        ),
+    }
+
+
+def _calculate_return_codes(days_elapsed: np.ndarray) -> np.ndarray:
+    # Vectorised equivalent of calculate_return_status().
+    return np.select(
+        condlist=[days_elapsed < 1, days_elapsed == 1, days_elapsed < 18, days_elapsed <= 24],
+        choicelist=[SAME_DAY, ONE_DAY, TWO_17_DAY, NORMAL],
+        default=LONG,
+    ).astype(np.uint8)
+
+
+def _calculate_nrr_classes(cow_return_bitmasks: np.ndarray, inseminations_per_cow: np.ndarray) -> np.ndarray:
+    # Every cow with more than one insemination has at least one return, so the classes below cover all cows.
+    # Assign in reverse order of precedence, so that higher-precedence classes overwrite lower ones.
+    nrr_classes = np.full(len(cow_return_bitmasks), NRR_RETURNED, dtype=np.uint8)
+    nrr_classes[(cow_return_bitmasks & (1 << ONE_DAY)) != 0] = NRR_ONE_DAY
+    nrr_classes[(cow_return_bitmasks & (1 << SAME_DAY)) != 0] = NRR_SAME_DAY
+    nrr_classes[inseminations_per_cow == 1] = NRR_NON_RETURN
+    nrr_classes[(cow_return_bitmasks & ((1 << TWO_17_DAY) | (1 << LONG))) != 0] = NRR_EXCLUDED
+    return nrr_classes
+
+
+def _build_nrr_season_index(
+        season: dict, season_start_date: datetime.date, season_end_date: datetime.date
+) -> NrrSeasonIndex:
+    first_insemination_dates, date_codes = np.unique(season["cow_first_dates"], return_inverse=True)
+
+    counts = np.zeros((len(first_insemination_dates), NUM_NRR_CLASSES), dtype=np.int64)
+    np.add.at(counts, (date_codes, season["cow_nrr_classes"]), 1)
+
+    return NrrSeasonIndex(
+        season_start_date=season_start_date,
+        season_end_date=season_end_date,
+        first_insemination_dates=[datetime.date.fromordinal(x) for x in first_insemination_dates.tolist()],
+        cumulative_counts=[tuple(x) for x in np.cumsum(counts, axis=0).tolist()],
+    )
+
+
+def _summarise_nrr_class_counts(
+        counts: np.ndarray, start_date: datetime.date, cut_off_date: datetime.date
+) -> dict:
+    return summarise_nrr_counts(
+        counts=dict(zip(nrr_count_fields, counts.tolist())), start_date=start_date, cut_off_date=cut_off_date
+    )
+
+
+def _calculate_nrr_by_bull(
+        bull_statistics: list[dict],
+        bull_names: np.ndarray,
+        season: dict,
+        start_date: datetime.date,
+        cut_off_date: datetime.date,
+) -> list[dict]:
+    num_bulls = len(bull_names)
+
+    # Each cow counts once towards every bull that inseminated her, however many times.
+    cow_bull_pairs = np.unique(season["cows"].astype(np.int64) * num_bulls + season["bulls"])
+    pair_cows = cow_bull_pairs // num_bulls
+    pair_bulls = cow_bull_pairs % num_bulls
+
+    pair_cows_in_period = season["cow_first_dates"][pair_cows] <= cut_off_date.toordinal()
+    pair_classes = season["cow_nrr_classes"][pair_cows]
+
+    counts = np.bincount(
+        pair_bulls[pair_cows_in_period] * NUM_NRR_CLASSES + pair_classes[pair_cows_in_period],
+        minlength=num_bulls * NUM_NRR_CLASSES,
+    ).reshape(num_bulls, NUM_NRR_CLASSES)
+
+    bull_codes = {name: code for code, name in enumerate(bull_names.tolist())}
+
+    return [
+        {
+            "bull_name": bull["bull_name"],
+            "nrr": _summarise_nrr_class_counts(
+                counts=counts[bull_codes[bull["bull_name"]]], start_date=start_date, cut_off_date=cut_off_date
+            ),
+        }
+        for bull in bull_statistics
+    ]
+
+
+def _calculate_bull_statistics(bull_names: np.ndarray, bulls: np.ndarray) -> list:
+    counts = np.bincount(bulls, minlength=len(bull_names))
+
+    # Position of each bull's first insemination in the original file, so ties keep first-appearance order.
+    first_appearance = np.full(len(bull_names), len(bulls))
+    np.minimum.at(first_appearance, bulls, np.arange(len(bulls)))
+    appearance_order = np.argsort(first_appearance, kind="stable")
+
+    bull_counts = [(str(bull_names[code]), int(counts[code])) for code in appearance_order]
+
+    return summarise_bull_counts(bull_counts=bull_counts, total_inseminations=len(bulls))
+
+
+def _calculate_return_status_statistics(season: dict) -> dict:
+    counts = np.bincount(season["return_codes"], minlength=len(return_types)).tolist()
+
+    return summarise_return_statuses(
+        first_inseminations=counts[FIRST_INSEMINATION],
+        same_day_returns=counts[SAME_DAY],
+        one_day_returns=counts[ONE_DAY],
+        two_17_day_returns=counts[TWO_17_DAY],
+        normal_returns=counts[NORMAL],
+        long_returns=counts[LONG],
+    )
+
+
+def _create_return_days_histogram(season: dict, bar_chart_filename: Union[str, None] = None) -> list:
+    days, counts = np.unique(season["days_elapsed"][~season["is_first"]], return_counts=True)
+    return_days_histogram_list = list(zip(days.tolist(), counts.tolist()))
+
+    if bar_chart_filename:
+        plot_return_days_histogram(
+            return_days_histogram_list=return_days_histogram_list, bar_chart_filename=bar_chart_filename
+        )
+
+    return return_days_histogram_list
+
+
+def _calculate_cumulative_insemination_statistics(season: dict, herd_size: Union[int, None]) -> list[dict]:
+    first_dates = season["cow_first_dates"]
+    start_date = first_dates.min()
+
+    weeks = (first_dates - start_date) // 7
+    num_weeks = max(int(weeks.max()) + 1, 3)  # Always report at least the three target weeks.
+    week_counts = np.bincount(weeks, minlength=num_weeks).tolist()
+
+    return summarise_weekly_submissions(
+        week_counts=week_counts, total_cows_submitted=len(first_dates), herd_size=herd_size
+    )
+
+
+def _create_cow_submission_graph(season: dict, graph_filename: Union[str, None] = None) -> list:
+    start_date = season["dates"].min()
+
+    insems_per_day = np.bincount(season["dates"] - start_date)
+    cows_per_day = np.bincount(season["cow_first_dates"] - start_date, minlength=len(insems_per_day))
+
+    # Every first-insemination date is also an insemination date, so only days with inseminations are plotted.
+    days_with_insems = np.flatnonzero(insems_per_day)
+
+    day_cumulative_counts = list(zip(
+        (days_with_insems + 1).tolist(),
+        np.cumsum(cows_per_day[days_with_insems]).tolist(),
+        np.cumsum(insems_per_day[days_with_insems]).tolist(),
+    ))
+
+    if graph_filename:
+        plot_cow_submission_graph(day_cumulative_counts=day_cumulative_counts, graph_filename=graph_filename)
+
+    return day_cumulative_counts
+
+
+def _generate_augmented_insemination_file(
+        season: dict, cow_ids: np.ndarray, bull_names: np.ndarray, output_file_path: str
+):
+    cow_id_strings = cow_ids.tolist()
+    bull_name_strings = bull_names.tolist()
+
+    # Sort cows by number of inseminations (descending), then by Cow ID, as generate_augmented_insemination_file().
+    cow_codes = list(range(len(cow_id_strings)))
+    cow_codes.sort(key=lambda code: cow_id_sort_key(cow_id_strings[code]))
+    inseminations_per_cow = season["inseminations_per_cow"].tolist()
+    cow_codes.sort(key=lambda code: inseminations_per_cow[code], reverse=True)
+
+    date_strings = {
+        ordinal: datetime.date.fromordinal(ordinal).strftime("%d-%b-%y")
+        for ordinal in np.unique(season["dates"]).tolist()
+    }
+
+    group_starts = season["group_starts"].tolist()
+    dates = season["dates"].tolist()
+    bulls = season["bulls"].tolist()
+    return_codes = season["return_codes"].tolist()
+    days_elapsed = season["days_elapsed"].tolist()
+
+    lines = (
+        format_augmented_insemination_line(
+            cow=cow_id_strings[cow_code],
+            date_string=date_strings[dates[idx]],
+            bull=bull_name_strings[bulls[idx]],
+            return_type=return_types[return_codes[idx]],
+            days_elapsed="" if idx == group_starts[cow_code] else days_elapsed[idx],
+        )
+        for cow_code in cow_codes
+        for idx in range(group_starts[cow_code], group_starts[cow_code] + inseminations_per_cow[cow_code])
+    )
+    write_augmented_insemination_file(lines=lines, output_file_path=output_file_path)
@@ -1,21 +1,111 @@
+import asyncio
 import datetime
-import shutil
-
-from fastapi import APIRouter, Request
+import functools
+import io
+import json
+import logging
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import FileResponse, HTMLResponse
 from fastapi.templating import Jinja2Templates
-from weasyprint import CSS, HTML
-
-from src.cowpoke.non_return_rate.non_return_rate import calculate_non_return_rate_results
 
+from sqlmodel import Session, select
+
+from src.cowpoke.database_connection import engine
+from src.cowpoke.models import Farm
+from src.cowpoke.non_return_rate.database_inseminations import FarmInseminations
+from src.cowpoke.non_return_rate.farm_totals import season_dates, season_start_year
+from src.cowpoke.non_return_rate.non_return_rate import (
+    NrrSeasonIndex,
+    calculate_non_return_rate_for_window,
+    calculate_non_return_rate_from_index,
+    calculate_nrr_curve,
+    read_nrr_season_index,
+    render_cow_submission_graph,
+    render_return_days_histogram,
+)
+from src.cowpoke.non_return_rate.non_return_rate_numpy import nrr_engines
+from src.cowpoke.non_return_rate.season_store import default_season_label
+from src.cowpoke.pdf_reports import write_report_pdf
+from src.cowpoke.run_directories import (
+    add_file_to_cached_results,
+    calculate_run_id,
+    create_staging_directory,
+    discard_staging_directory,
+    load_cached_results,
+    publish_run_directory,
+    run_directory,
+    store_cached_results,
+    write_file_atomically,
+)
+from src.cowpoke.stage_timing import call_with_stage_timings, record_stage_timings, recorded_stage
+from src.cowpoke.worker_pools import run_in_worker_pool
+
+
+logger = logging.getLogger(__name__)
 
 templates = Jinja2Templates(directory=["cowpoke/non_return_rate/templates", "templates"])
 
-cow_submissions_chart_file_name = "temp/cowpoke/cow_submissions_chart.svg"
-returns_bar_chart_file_name = "temp/cowpoke/return_days_bar_chart.svg"
-output_file_name = "temp/cowpoke/nrr_data_output.csv"
-report_html_file_name = "temp/cowpoke/mating_report.html"
-report_pdf_file_name = "temp/cowpoke/mating_report.pdf"
+# Files in each run directory.  (See 'run_directories.py'.)
+cow_submissions_chart_file_name = "cow_submissions_chart.svg"
+returns_bar_chart_file_name = "return_days_bar_chart.svg"
+output_file_name = "nrr_data_output.csv"
+chart_data_file_name = "nrr_chart_data.json"
+results_page_file_name = "non_return_results.html"
+report_html_file_name = "mating_report.html"
+report_pdf_file_name = "mating_report.pdf"
+season_index_file_name = "nrr_season_index.json"
+season_record_file_name = "nrr_season_record.json"  # Kept in the farm's season store, if the user saves it.
+
+# Output files of the analysis itself, which are cached along with the result dict.  The results only depend on the
+# uploaded file and the herd size, so a repeat upload (eg. for another look, or to download the PDF) doesn't re-parse
+# the file and redraw the charts.  (Charts are added to the cache once they have been drawn.)
+cached_file_names = (output_file_name, season_index_file_name, season_record_file_name)
+cached_chart_file_names = (returns_bar_chart_file_name, cow_submissions_chart_file_name)
+
+
+@dataclass(frozen=True)
+class NrrChart:
+    file_name: str
+    render_function: object  # Takes the chart data, and returns SVG bytes.  (See 'worker_pools.py'.)
+    data_key: str  # Key of the chart data in the result dict, and in the chart data file.
+    alt_text: str
+
+
+# Charts are drawn in the chart process pool after the results page has been sent, and lazy-loaded by HTMX.
+nrr_charts = {
+    "cow-submissions-chart": NrrChart(
+        file_name=cow_submissions_chart_file_name,
+        render_function=render_cow_submission_graph,
+        data_key="cow_submission_counts",
+        alt_text="Cumulative Counts of Cow Submissions and Inseminations",
+    ),
+    "return-days-bar-chart": NrrChart(
+        file_name=returns_bar_chart_file_name,
+        render_function=render_return_days_histogram,
+        data_key="return_days_histogram",
+        alt_text="Counts of returns by days elapsed",
+    ),
+}
+
+# Charts being drawn by this worker, keyed by (run ID, chart name), so that a chart is only drawn once.
+chart_tasks: dict[tuple[str, str], asyncio.Task] = {}
+
+# PDF reports being generated by this worker, keyed by run ID, so that a report is only generated once.
+# Failed tasks are kept, so that the status poll can report the failure (instead of retrying forever).
+pdf_tasks: dict[str, asyncio.Task] = {}
+
+# A key of 'nrr_engines'.  (See 'non_return_rate_numpy.py'.)
+nrr_engine = os.environ.get("COWPOKE_NRR_ENGINE", "numpy")
+
+# Season indexes of recent runs, so that other cut-off dates can be explored without re-parsing the upload.
+# Keyed by run ID.  Least recently used first.
+season_index_cache: OrderedDict[str, NrrSeasonIndex] = OrderedDict()
+season_index_cache_size = 64
 
 router = APIRouter()
 
@@ -28,79 +118,377 @@ async def non_return_rate(request: Request):
 
 @router.post("/cowpoke/nrr-upload", response_class=HTMLResponse)
 async def non_return_rate_upload(request: Request):
-    input_temp_file_name = "temp/cowpoke/nrr_data.csv"
-
     async with request.form() as form:
         farm_name = form["farm_name"]
         herd_size = form["herd_size"]
         upload_file = form["file"]
-        file_object = upload_file.file  # File object is in 'bytes' mode, not 'string' mode.
-        with open(input_temp_file_name, "wb") as g:
-            shutil.copyfileobj(file_object, g)  # Save locally so can be re-opened in 'string' mode.
-
-    non_return_result = calculate_non_return_rate_results(
-        herd_size_str=herd_size,
-        input_file_path=input_temp_file_name,
-        output_file_path=output_file_name,
-        returns_bar_chart_file_path=returns_bar_chart_file_name,
-        cow_submission_graph_file_path=cow_submissions_chart_file_name,
+        input_bytes = await upload_file.read()
+
+    return await run_non_return_rate_analysis(farm_name=farm_name, herd_size=herd_size, input_bytes=input_bytes)
+
+
+@router.get("/cowpoke/nrr-results/{run_id}", response_class=HTMLResponse)
+async def non_return_rate_results(run_id: str):
+    """
+    The results of an earlier run (eg. one herd of a batch), as the same HTMX fragment that the upload returned.
+    """
+    results_page_file_path = run_file_path(run_id=run_id, file_name=results_page_file_name)
+    start_report_pdf(run_id=run_id)  # In case the run was published by another worker, which has restarted.
+    return HTMLResponse(content=results_page_file_path.read_bytes())
+
+
+@router.get("/cowpoke/nrr-download/{run_id}")
+async def non_return_rate_download(run_id: str):
+    output_file_path = run_file_path(run_id=run_id, file_name=output_file_name)
+    return FileResponse(path=output_file_path, filename="matings_with_returns.csv")
+
+
+@router.get("/cowpoke/mating-report-download/{run_id}")
+async def mating_report_download(run_id: str):
+    run_dir = run_file_path(run_id=run_id, file_name=results_page_file_name).parent
+    pdf_file_path = run_dir.joinpath(report_pdf_file_name)
+
+    if not pdf_file_path.exists():  # Normally generated in the background before the link is shown.
+        task = pdf_tasks.get(run_id)
+        if task is not None and task.done() and pdf_task_failed(task):
+            del pdf_tasks[run_id]  # Try again.
+        await asyncio.shield(start_report_pdf(run_id=run_id))
+
+    return FileResponse(path=pdf_file_path)
+
+
+@router.get("/cowpoke/mating-report-status/{run_id}", response_class=HTMLResponse)
+async def mating_report_status(run_id: str):
+    """
+    HTMX fragment, polled until the PDF report is ready to download.
+    """
+    try:
+        pdf_file_path = run_file_path(run_id=run_id, file_name=results_page_file_name).parent.joinpath(
+            report_pdf_file_name
+        )
+    except HTTPException:
+        context = {"error_message": "These results have expired.  Please upload the mating records again."}
+        return templates.TemplateResponse(request={}, name="mating_report_status.html", context=context)
+
+    if pdf_file_path.exists():
+        status = "ready"
+    else:
+        task = start_report_pdf(run_id=run_id)  # In case it was started by another worker, which has restarted.
+        status = "failed" if task.done() and pdf_task_failed(task) else "generating"
+
+    context = {"run_id": run_id, "status": status}
+    return templates.TemplateResponse(request={}, name="mating_report_status.html", context=context)
+
+
+@router.get("/cowpoke/nrr-curve/{run_id}", response_class=HTMLResponse)
+async def non_return_rate_curve(run_id: str):
+    season_index = get_season_index(run_id=run_id)
+    context = {"nrr_curve": calculate_nrr_curve(season_index=season_index)}
+    return templates.TemplateResponse(request={}, name="nrr_curve.html", context=context)
+
+
+@router.get("/cowpoke/nrr-cut-off", response_class=HTMLResponse)
+async def non_return_rate_cut_off(
+        run_id: str, cut_off_date: datetime.date | None = None, window_days: int | None = None
+):
+    try:
+        season_index = get_season_index(run_id=run_id)
+    except HTTPException:
+        context = {"error_message": "These results have expired.  Please upload the mating records again."}
+        return templates.TemplateResponse(request={}, name="nrr_cut_off.html", context=context)
+
+    if cut_off_date is not None:
+        nrr = calculate_non_return_rate_from_index(
+            season_index=season_index, start_date=season_index.season_start_date, cut_off_date=cut_off_date
+        )
+    else:
+        nrr = calculate_non_return_rate_for_window(season_index=season_index, window_days=window_days or 42)
+
+    context = {"nrr": nrr, "window_days": None if cut_off_date is not None else window_days or 42}
+    return templates.TemplateResponse(request={}, name="nrr_cut_off.html", context=context)
+
+
+@router.get("/cowpoke/nrr-charts/{run_id}/{chart_name}", response_class=HTMLResponse)
+async def non_return_rate_chart(run_id: str, chart_name: str):
+    """
+    HTMX fragment with the chart image, sent once the chart has been drawn.
+    """
+    try:
+        await get_chart_file_path(run_id=run_id, chart_name=chart_name)
+    except HTTPException:
+        context = {"error_message": "These results have expired.  Please upload the mating records again."}
+        return templates.TemplateResponse(request={}, name="nrr_chart.html", context=context)
+
+    context = {"run_id": run_id, "chart_name": chart_name, "alt_text": nrr_charts[chart_name].alt_text}
+    return templates.TemplateResponse(request={}, name="nrr_chart.html", context=context)
+
+
+@router.get("/cowpoke/nrr-images/{run_id}/{chart_name}.svg")
+async def non_return_rate_chart_download(run_id: str, chart_name: str):
+    return FileResponse(path=await get_chart_file_path(run_id=run_id, chart_name=chart_name))
+
+
+@router.post("/cowpoke/nrr-farm-records", response_class=HTMLResponse)
+async def non_return_rate_farm_records(request: Request):
+    """
+    The same analysis as for an uploaded file, of the inseminations recorded on a farm in the Cowpoke database.
+    """
+    async with request.form() as form:
+        farm_id = form.get("farm_id")
+        herd_size = form.get("herd_size", "")
+        start_date = form.get("start_date") or None
+        end_date = form.get("end_date") or None
+
+    if not farm_id:
+        context = {"error_message": "Please choose a farm."}
+        return templates.TemplateResponse(request={}, name="non_return_results_error.html", context=context)
+
+    with Session(engine) as session:
+        farm = session.exec(select(Farm).where(Farm.id == farm_id)).first()
+
+    if farm is None:
+        context = {"error_message": "Unknown farm.  Please choose a farm again."}
+        return templates.TemplateResponse(request={}, name="non_return_results_error.html", context=context)
+
+    # A blank date is the start or end of the season (June to May) of the other date, or of the current season, so
+    # that seasons are not analysed together as one.
+    try:
+        start_date = datetime.date.fromisoformat(start_date) if start_date else None
+        end_date = datetime.date.fromisoformat(end_date) if end_date else None
+        if start_date is None:
+            start_date, _ = season_dates(start_year=season_start_year(end_date or datetime.date.today()))
+        if end_date is None:
+            _, end_date = season_dates(start_year=season_start_year(start_date))
+    except ValueError:
+        context = {"error_message": "Please enter the dates in the format YYYY-MM-DD."}
+        return templates.TemplateResponse(request={}, name="non_return_results_error.html", context=context)
+
+    farm_inseminations = FarmInseminations(farm_id=farm.id, start_date=start_date, end_date=end_date)
+    return await run_non_return_rate_analysis(
+        farm_name=farm.name, herd_size=herd_size, farm_inseminations=farm_inseminations
+    )
+
+
+@router.get("/cowpoke/nrr-demo", response_class=HTMLResponse)
+async def non_return_rate_demo(request: Request):
+    demo_file_name = "cowpoke/non_return_rate/nrr_data_demo.csv"
+
+    with open(demo_file_name, "rb") as f:
+        input_bytes = f.read()
+
+    return await run_non_return_rate_analysis(
+        farm_name="Old MacDonald's", herd_size="275", input_bytes=input_bytes
     )
-    non_return_result["farm_name"] = farm_name
-    non_return_result["herd_size"] = herd_size
-    non_return_result["utcnow"] = str(datetime.datetime.now(datetime.UTC)).replace(" ", "::")
 
-    template_resp = templates.TemplateResponse(request={}, name="non_return_results.html", context=non_return_result)
 
-    generate_report_html(template_response=template_resp)
+async def run_non_return_rate_analysis(
+        farm_name: str,
+        herd_size: str,
+        input_bytes: bytes | None = None,
+        farm_inseminations: FarmInseminations | None = None,
+) -> HTMLResponse:
+    """
+    Run the analysis in a staging directory, then publish it as the run directory for these inputs.
+    The input is either an uploaded CSV file ('input_bytes'), or inseminations recorded in the database.
+    The calculations run in the "analysis" worker pool, so that several herds can be analysed at once.
+    The context of the returned response is the result dict, or has 'error_message' if the CSV file is malformed.
+    """
+    if farm_inseminations is None:
+        input_parts = (input_bytes,)
+        engine_input = {"input_file_path": io.BytesIO(input_bytes)}  # Parsed straight from memory.
+    else:
+        # Reads every insemination in the range, so not on the event loop.
+        input_parts = ("database", await run_in_worker_pool("analysis", farm_inseminations.fingerprint))
+        engine_input = {"input_file_path": None, "inseminations": farm_inseminations}  # Streamed by the worker.
+
+    run_id = calculate_run_id("non_return_rate", farm_name, herd_size, *input_parts)
+    cache_key = calculate_run_id("non_return_rate_results", herd_size, *input_parts)
+    staging_dir = create_staging_directory(run_id=run_id)
+
+    try:
+        non_return_result = load_cached_results(
+            cache_key=cache_key,
+            run_dir=staging_dir,
+            file_names=cached_file_names,
+            optional_file_names=cached_chart_file_names,
+        )
+
+        if non_return_result is None:
+            non_return_result, stage_timings = await run_in_worker_pool("analysis", functools.partial(
+                call_with_stage_timings,
+                "non_return_rate",
+                nrr_engines[nrr_engine],
+                herd_size_str=herd_size,
+                **engine_input,
+                output_file_path=staging_dir.joinpath(output_file_name),
+                season_index_file_path=staging_dir.joinpath(season_index_file_name),
+                season_record_file_path=staging_dir.joinpath(season_record_file_name),
+            ))
+            record_stage_timings(timings=stage_timings, run_id=run_id)
+            store_cached_results(
+                cache_key=cache_key, results=non_return_result, run_dir=staging_dir, file_names=cached_file_names
+            )
+
+        season_index = read_nrr_season_index(file_path=staging_dir.joinpath(season_index_file_name))
+
+        chart_data = {chart.data_key: non_return_result[chart.data_key] for chart in nrr_charts.values()}
+        chart_data["cache_key"] = cache_key
+        with open(staging_dir.joinpath(chart_data_file_name), "w") as g:
+            json.dump(chart_data, g)
+
+        non_return_result["farm_name"] = farm_name
+        non_return_result["herd_size"] = herd_size
+        non_return_result["utcnow"] = str(datetime.datetime.now(datetime.UTC)).replace(" ", "::")
+        non_return_result["run_id"] = run_id
+        non_return_result["season_length_days"] = (
+            (season_index.season_end_date - season_index.season_start_date).days + 1
+        )
+        non_return_result["season_label"] = default_season_label(season_start_date=season_index.season_start_date)
+
+        template_resp = templates.TemplateResponse(
+            request={}, name="non_return_results.html", context=non_return_result
+        )
+
+        staging_dir.joinpath(results_page_file_name).write_bytes(template_resp.body)
+    except ValueError as err:  # Malformed mating records, or none at all.
+        discard_staging_directory(staging_dir=staging_dir)
+        logger.error(err)
+        template_resp = templates.TemplateResponse(
+            request={}, name="non_return_results_error.html", context={"error_message": err}
+        )
+        return template_resp
+    except BaseException:
+        discard_staging_directory(staging_dir=staging_dir)
+        raise
+
+    publish_run_directory(staging_dir=staging_dir, run_id=run_id)
+    cache_season_index(run_id=run_id, season_index=season_index)
+    start_report_pdf(run_id=run_id)
 
     return template_resp
 
 
-@router.get("/cowpoke/nrr-download")
-async def non_return_rate_download():
-    return FileResponse(path=output_file_name, filename="matings_with_returns.csv")
+def run_file_path(run_id: str, file_name: str) -> Path:
+    """
+    Path of a file in a run directory.  Raises 404 if the run ID is invalid, or the run has been garbage-collected.
+    """
+    try:
+        file_path = run_directory(run_id=run_id).joinpath(file_name)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Unknown run")
 
+    if not file_path.exists():
+        raise HTTPException(status_code=404, detail="Results have expired.  Please upload again.")
 
-@router.get("/cowpoke/mating-report-download")
-async def mating_report_download():
-    generate_report_pdf_from_html()
-    return FileResponse(path=report_pdf_file_name)
+    return file_path
 
 
-@router.get("/cowpoke/nrr-images/cow-submissions-chart.svg")
-async def cow_submissions_chart_download():
-    return FileResponse(path=cow_submissions_chart_file_name)
+def get_season_index(run_id: str) -> NrrSeasonIndex:
+    season_index = season_index_cache.get(run_id)
 
+    if season_index is None:  # Not cached in this worker, or evicted.
+        file_path = run_file_path(run_id=run_id, file_name=season_index_file_name)
+        season_index = read_nrr_season_index(file_path=file_path)
 
-@router.get("/cowpoke/nrr-images/return-days-bar-chart.svg")
-async def return_days_bar_chart_download():
-    return FileResponse(path=returns_bar_chart_file_name)
+    cache_season_index(run_id=run_id, season_index=season_index)
 
+    return season_index
 
-@router.get("/cowpoke/nrr-demo", response_class=HTMLResponse)
-async def non_return_rate_demo(request: Request):
-    demo_file_name = "cowpoke/non_return_rate/nrr_data_demo.csv"
 
-    non_return_result = calculate_non_return_rate_results(
-        herd_size_str="275",
-        input_file_path=demo_file_name,
-        output_file_path=output_file_name,
-        returns_bar_chart_file_path=returns_bar_chart_file_name,
-        cow_submission_graph_file_path=cow_submissions_chart_file_name,
-    )
-    non_return_result["farm_name"] = "Old MacDonald's"
-    non_return_result["herd_size"] = 275
-    non_return_result["utcnow"] = str(datetime.datetime.now(datetime.UTC)).replace(" ", "::")
+def cache_season_index(run_id: str, season_index: NrrSeasonIndex):
+    season_index_cache[run_id] = season_index
+    season_index_cache.move_to_end(run_id)
+    while len(season_index_cache) > season_index_cache_size:
+        season_index_cache.popitem(last=False)
 
-    template_resp = templates.TemplateResponse(request={}, name="non_return_results.html", context=non_return_result)
 
-    generate_report_html(template_response=template_resp)
+async def get_chart_file_path(run_id: str, chart_name: str) -> Path:
+    """
+    Path of a chart in a run directory, drawing the chart first if necessary.
+    """
+    if chart_name not in nrr_charts:
+        raise HTTPException(status_code=404, detail="Unknown chart")
 
-    return template_resp
+    chart = nrr_charts[chart_name]
+    run_dir = run_file_path(run_id=run_id, file_name=chart_data_file_name).parent
+    chart_file_path = run_dir.joinpath(chart.file_name)
+
+    if chart_file_path.exists():  # Already drawn, or copied from the result cache.
+        return chart_file_path
+
+    task_key = (run_id, chart_name)
+    task = chart_tasks.get(task_key)
+
+    if task is None:  # Not being drawn by this worker (though maybe by another one - which is harmless).
+        task = asyncio.create_task(draw_chart(run_dir=run_dir, chart=chart))
+        chart_tasks[task_key] = task
+        task.add_done_callback(lambda _: chart_tasks.pop(task_key, None))
 
+    try:
+        await asyncio.shield(task)  # If this request is cancelled, keep drawing for the other requests.
+    except FileNotFoundError:  # Run directory removed by garbage collection while drawing.
+        raise HTTPException(status_code=404, detail="Results have expired.  Please upload again.")
 
-def generate_report_html(template_response):
-    rendered_html = template_response.body.decode("utf-8")
+    return chart_file_path
+
+
+async def draw_chart(run_dir: Path, chart: NrrChart):
+    with open(run_dir.joinpath(chart_data_file_name)) as f:
+        chart_data = json.load(f)
+
+    with recorded_stage(pipeline="non_return_rate", stage="chart_rendering", run_id=run_dir.name):
+        svg = await run_in_worker_pool("charts", chart.render_function, chart_data[chart.data_key])
+
+    chart_file_path = run_dir.joinpath(chart.file_name)
+    write_file_atomically(file_path=chart_file_path, content=svg)
+    add_file_to_cached_results(cache_key=chart_data["cache_key"], file_path=chart_file_path)
+
+
+def start_report_pdf(run_id: str) -> asyncio.Task:
+    """
+    Start generating the PDF report in the background, unless it is already being generated by this worker.
+    Must be called from the event loop.
+    """
+    task = pdf_tasks.get(run_id)
+
+    if task is None:
+        task = asyncio.create_task(generate_report_pdf(run_id=run_id))
+        pdf_tasks[run_id] = task
+        task.add_done_callback(lambda t: None if pdf_task_failed(t) else pdf_tasks.pop(run_id, None))
+
+    return task
+
+
+def pdf_task_failed(task: asyncio.Task) -> bool:
+    """
+    Only call for a finished task.  (Also marks the exception as retrieved.)
+    """
+    return task.cancelled() or task.exception() is not None
+
+
+async def generate_report_pdf(run_id: str):
+    try:
+        run_dir = run_file_path(run_id=run_id, file_name=results_page_file_name).parent
+        if run_dir.joinpath(report_pdf_file_name).exists():  # Identical inputs were uploaded before.
+            return
+
+        for chart_name in nrr_charts:  # Charts are included in the report.
+            await get_chart_file_path(run_id=run_id, chart_name=chart_name)
+
+        generate_report_html(run_dir=run_dir)
+
+        with recorded_stage(pipeline="non_return_rate", stage="pdf_report", run_id=run_id):
+            await run_in_worker_pool(
+                "pdf", write_report_pdf, run_dir.joinpath(report_html_file_name), run_dir.joinpath(report_pdf_file_name)
+            )
+    except Exception:
+        logger.exception(f"Could not generate mating report PDF for run {run_id}")
+        raise
+
+
+def generate_report_html(run_dir: Path):
+    with open(run_dir.joinpath(results_page_file_name)) as f:
+        rendered_html = f.read()
 
     report_html = f"""
 <html>
@@ -112,7 +500,7 @@ def generate_report_html(template_response):
 </html>
 """
 
-    with open(cow_submissions_chart_file_name) as f:
+    with open(run_dir.joinpath(cow_submissions_chart_file_name)) as f:
         cow_submissions_chart_svg = f.read()
 
     cow_submssions_chart_figure = f"""
@@ -120,7 +508,7 @@ def generate_report_html(template_response):
 {cow_submissions_chart_svg}
 </figure>
 """
-    with open(returns_bar_chart_file_name) as f:
+    with open(run_dir.joinpath(returns_bar_chart_file_name)) as f:
         returns_bar_chart_svg = f.read()
 
     returns_bar_chart_figure = f"""
@@ -133,11 +521,11 @@ def generate_report_html(template_response):
     replacing_block = False
 
     for line in report_html.splitlines():
-        if '<figure id="cow_submissions_chart">' in line:
+        if '<figure id="cow_submissions_chart"' in line:
             replacing_block = True
             for row in cow_submssions_chart_figure:
                 html_with_svg.append(row)
-        elif '<figure id="return_days_bar_chart">' in line:
+        elif '<figure id="return_days_bar_chart"' in line:
             replacing_block = True
             for row in returns_bar_chart_figure:
                 html_with_svg.append(row)
@@ -159,15 +547,6 @@ def generate_report_html(template_response):
             if not delete_block:
                 new_html_lines.append(line)
 
-    with open(report_html_file_name, "w") as g:
-        g.writelines(new_html_lines)
-
-
-def generate_report_pdf_from_html():
-    with open(report_html_file_name) as f:
-        report_html = f.read()
-
-    HTML(string=report_html).write_pdf(
-        target=report_pdf_file_name,
-        stylesheets=[CSS(filename="static/report.css")],
+    write_file_atomically(
+        file_path=run_dir.joinpath(report_html_file_name), content="".join(new_html_lines).encode("utf-8")
     )
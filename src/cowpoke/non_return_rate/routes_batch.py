@@ -0,0 +1,197 @@
+import asyncio
+import json
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse, HTMLResponse
+from fastapi.templating import Jinja2Templates
+
+from src.cowpoke.non_return_rate.batch import (
+    BatchHerd,
+    calculate_bull_league_table,
+    read_batch_zip,
+    summarise_batch_herd,
+    summarise_batch_totals,
+)
+from src.cowpoke.non_return_rate.routes import run_file_path, run_non_return_rate_analysis
+from src.cowpoke.run_directories import (
+    calculate_run_id, create_staging_directory, discard_staging_directory, publish_run_directory,
+)
+
+
+logger = logging.getLogger(__name__)
+
+templates = Jinja2Templates(directory=["cowpoke/non_return_rate/templates", "templates"])
+
+# Files in each batch run directory.  (See 'run_directories.py'.)  Each herd has its own run directory as well.
+batch_summary_file_name = "batch_summary.json"
+batch_summary_csv_file_name = "batch_summary.csv"
+
+
+@dataclass
+class NrrBatch:
+    batch_id: str
+    herds: list[BatchHerd]
+    herd_rows: list[dict] = field(default_factory=list)  # Summary table rows, in order of completion.
+    herd_results: list[dict] = field(default_factory=list)  # Result dicts of the herds without errors.
+    task: asyncio.Task | None = None
+
+
+# Batches being processed (or recently finished) by this worker, keyed by batch ID.  Least recently started first.
+nrr_batches: OrderedDict[str, NrrBatch] = OrderedDict()
+nrr_batches_size = 16
+
+router = APIRouter()
+
+
+@router.get("/cowpoke/nrr-batch", response_class=HTMLResponse)
+async def non_return_rate_batch(request: Request):
+    context = {}
+    return templates.TemplateResponse(request={}, name="nrr_batch.html", context=context)
+
+
+@router.post("/cowpoke/nrr-batch-upload", response_class=HTMLResponse)
+async def non_return_rate_batch_upload(request: Request):
+    async with request.form() as form:
+        zip_bytes = await form["zip_file"].read()
+        uploaded_manifest_file = form.get("manifest_file")  # Manifest may be in the zip file instead.
+        if uploaded_manifest_file:
+            manifest_bytes = await uploaded_manifest_file.read()
+        else:
+            manifest_bytes = None
+
+    batch_id = calculate_run_id("non_return_rate_batch", zip_bytes, manifest_bytes or b"")
+
+    if batch_id not in nrr_batches:  # Otherwise the same batch was uploaded again.
+        try:
+            herds = read_batch_zip(zip_bytes=zip_bytes, manifest_bytes=manifest_bytes)
+        except ValueError as err:
+            logger.error(err)
+            context = {"error_message": err}
+            return templates.TemplateResponse(request={}, name="nrr_batch_results.html", context=context)
+
+        batch = NrrBatch(batch_id=batch_id, herds=herds)
+        batch.task = asyncio.create_task(process_nrr_batch(batch=batch))
+        nrr_batches[batch_id] = batch
+        while len(nrr_batches) > nrr_batches_size and next(iter(nrr_batches.values())).task.done():
+            nrr_batches.popitem(last=False)
+
+    return await non_return_rate_batch_progress(batch_id=batch_id)
+
+
+@router.get("/cowpoke/nrr-batch-progress/{batch_id}", response_class=HTMLResponse)
+async def non_return_rate_batch_progress(batch_id: str):
+    """
+    HTMX fragment, polled until every herd in the batch has been analysed.
+    """
+    batch = nrr_batches.get(batch_id)
+
+    if batch is not None and not batch.task.done():
+        context = {
+            "batch_id": batch_id,
+            "finished": False,
+            "herds_total": len(batch.herds),
+            "herds_done": len(batch.herd_rows),
+            "herd_rows": batch.herd_rows,
+        }
+        return templates.TemplateResponse(request={}, name="nrr_batch_results.html", context=context)
+
+    try:  # Finished, possibly by another worker.
+        summary_file_path = run_file_path(run_id=batch_id, file_name=batch_summary_file_name)
+    except HTTPException:
+        if batch is not None and (batch.task.cancelled() or batch.task.exception() is not None):
+            context = {"error_message": "The batch could not be processed."}
+        else:
+            context = {"error_message": "This batch has expired.  Please upload it again."}
+        return templates.TemplateResponse(request={}, name="nrr_batch_results.html", context=context)
+
+    with open(summary_file_path) as f:
+        context = json.load(f)
+    context["batch_id"] = batch_id
+    context["finished"] = True
+
+    return templates.TemplateResponse(request={}, name="nrr_batch_results.html", context=context)
+
+
+@router.get("/cowpoke/nrr-batch-download/{batch_id}")
+async def non_return_rate_batch_download(batch_id: str):
+    file_path = run_file_path(run_id=batch_id, file_name=batch_summary_csv_file_name)
+    return FileResponse(path=file_path, filename="nrr_batch_summary.csv")
+
+
+async def process_nrr_batch(batch: NrrBatch):
+    """
+    Analyse every herd, as many at once as the "analysis" worker pool allows, then publish the batch summary.
+    """
+    async def process_herd(herd: BatchHerd):
+        try:
+            response = await run_non_return_rate_analysis(
+                farm_name=herd.farm_name, herd_size=herd.herd_size, input_bytes=herd.input_bytes
+            )
+        except Exception as err:
+            logger.exception(f"Batch {batch.batch_id}: could not analyse '{herd.file_name}'")
+            error_message = f"Could not analyse this file ({type(err).__name__})"
+        else:
+            error_message = response.context.get("error_message")
+
+        herd.input_bytes = b""  # No longer needed.
+
+        if error_message:
+            batch.herd_rows.append({
+                "file_name": herd.file_name,
+                "farm_name": herd.farm_name,
+                "herd_size": herd.herd_size,
+                "error_message": str(error_message),
+            })
+        else:
+            batch.herd_rows.append(summarise_batch_herd(herd=herd, results=response.context))
+            batch.herd_results.append(response.context)
+
+    await asyncio.gather(*(process_herd(herd) for herd in batch.herds))
+
+    file_order = {herd.file_name: idx for idx, herd in enumerate(batch.herds)}
+    herd_rows = sorted(batch.herd_rows, key=lambda row: file_order[row["file_name"]])
+
+    summary = {
+        "herd_rows": herd_rows,
+        "totals": summarise_batch_totals(herd_results=batch.herd_results),
+        "bull_league_table": calculate_bull_league_table(herd_results=batch.herd_results),
+        "herds_total": len(batch.herds),
+        "herds_done": len(herd_rows),
+        "herds_failed": sum(1 for row in herd_rows if row["error_message"]),
+    }
+
+    staging_dir = create_staging_directory(run_id=batch.batch_id)
+    try:
+        with open(staging_dir.joinpath(batch_summary_file_name), "w") as g:
+            json.dump(summary, g)
+        write_batch_summary_csv(
+            herd_rows=herd_rows, output_file_path=staging_dir.joinpath(batch_summary_csv_file_name)
+        )
+    except BaseException:
+        discard_staging_directory(staging_dir=staging_dir)
+        raise
+
+    publish_run_directory(staging_dir=staging_dir, run_id=batch.batch_id)
+
+
+def write_batch_summary_csv(herd_rows: list[dict], output_file_path):
+    header = "File,Farm Name,Herd Size,Cows Submitted,Inseminations,3 Week Submission %,6 Week NRR %,Season NRR %,Error"
+
+    with open(output_file_path, "w") as g:
+        g.write(header + "\n")
+        for row in herd_rows:
+            values = [
+                row["file_name"],
+                row["farm_name"],
+                row["herd_size"],
+                row.get("total_cows_submitted", ""),
+                row.get("total_inseminations", ""),
+                row.get("three_week_submission_pct", "").rstrip("%"),
+                row.get("six_weeks_nrr", ""),
+                row.get("full_season_nrr", ""),
+                row["error_message"],
+            ]
+            g.write(",".join(str(value).replace(",", " ") for value in values) + "\n")
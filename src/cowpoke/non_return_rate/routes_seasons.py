@@ -0,0 +1,154 @@
+import datetime
+import logging
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import HTMLResponse
+from fastapi.templating import Jinja2Templates
+
+from sqlmodel import Session, select
+
+from src.cowpoke.database_connection import engine
+from src.cowpoke.models import Bull, Farm, FarmNrrTotals, NrrSeason
+from src.cowpoke.non_return_rate.farm_totals import summarise_farm_nrr_totals
+from src.cowpoke.non_return_rate.non_return_rate import read_nrr_season_record
+from src.cowpoke.non_return_rate.routes import run_file_path, season_record_file_name
+from src.cowpoke.non_return_rate.season_store import (
+    compare_nrr_seasons, default_season_label, pack_nrr_season,
+)
+
+
+logger = logging.getLogger(__name__)
+
+templates = Jinja2Templates(directory=["cowpoke/non_return_rate/templates", "templates"])
+
+router = APIRouter()
+
+
+@router.get("/cowpoke/nrr-season-farms", response_class=HTMLResponse)
+async def non_return_rate_season_farms(farm_name: str = ""):
+    """
+    HTMX fragment with the <option>s of the farm picker, with the farm of the uploaded file selected if it exists.
+    """
+    with Session(engine) as session:
+        farms = session.exec(select(Farm).order_by(Farm.name)).all()
+
+    context = {"farms": farms, "farm_name": farm_name.strip().lower()}
+    return templates.TemplateResponse(request={}, name="nrr_season_farms.html", context=context)
+
+
+@router.post("/cowpoke/nrr-save-season", response_class=HTMLResponse)
+async def non_return_rate_save_season(request: Request):
+    async with request.form() as form:
+        run_id = form["run_id"]
+        farm_id = form.get("farm_id")
+        season_label = form.get("season_label", "").strip()
+        herd_size_str = form.get("herd_size", "")
+
+    try:
+        season_record_file_path = run_file_path(run_id=run_id, file_name=season_record_file_name)
+    except HTTPException:
+        context = {"error_message": "These results have expired.  Please upload the mating records again."}
+        return templates.TemplateResponse(request={}, name="nrr_season_saved.html", context=context)
+
+    if not farm_id:
+        context = {"error_message": "Please add the farm on the Farms page first."}
+        return templates.TemplateResponse(request={}, name="nrr_season_saved.html", context=context)
+
+    try:
+        herd_size = int(herd_size_str)
+    except ValueError:
+        herd_size = None
+
+    try:
+        nrr_season = pack_nrr_season(
+            farm_id=int(farm_id),
+            season_label=season_label,
+            herd_size=herd_size,
+            season_record=read_nrr_season_record(file_path=season_record_file_path),
+            run_id=run_id,
+        )
+    except ValueError as err:
+        logger.error(err)
+        context = {"error_message": err}
+        return templates.TemplateResponse(request={}, name="nrr_season_saved.html", context=context)
+
+    with Session(engine) as session:
+        farm = session.get(Farm, nrr_season.farm_id)
+        if farm is None:
+            context = {"error_message": "Unknown farm."}
+            return templates.TemplateResponse(request={}, name="nrr_season_saved.html", context=context)
+
+        statement = (select(NrrSeason).where(NrrSeason.farm_id == nrr_season.farm_id)
+                                      .where(NrrSeason.run_id == run_id))
+        saved_season = session.exec(statement).first()
+
+        if saved_season is not None:  # Saved before, so only the label and herd size can have changed.
+            saved_season.season_label = nrr_season.season_label or saved_season.season_label
+            saved_season.herd_size = nrr_season.herd_size
+            nrr_season = saved_season
+        elif not nrr_season.season_label:
+            nrr_season.season_label = default_season_label(season_start_date=nrr_season.season_start_date)
+
+        session.add(nrr_season)
+        session.commit()
+        session.refresh(nrr_season)
+
+        context = {"farm": farm, "nrr_season": nrr_season}
+        return templates.TemplateResponse(request={}, name="nrr_season_saved.html", context=context)
+
+
+@router.get("/cowpoke/nrr-seasons-for-farm/{farm_id}", response_class=HTMLResponse)
+async def non_return_rate_seasons_for_farm(farm_id: int):
+    with Session(engine) as session:
+        farm_statement = select(Farm).where(Farm.id == farm_id)
+        farm = session.exec(farm_statement).one()
+
+        statement = select(NrrSeason).where(NrrSeason.farm_id == farm_id)
+        nrr_seasons = session.exec(statement).all()
+
+    try:
+        context = compare_nrr_seasons(nrr_seasons=nrr_seasons)
+    except ValueError as err:
+        logger.error(err)
+        context = {"error_message": err}
+
+    context["farm"] = farm
+    return templates.TemplateResponse(request={}, name="nrr_season_comparison.html", context=context)
+
+
+@router.delete("/cowpoke/nrr-season/{season_id}", response_class=HTMLResponse)
+async def non_return_rate_season_delete(season_id: int):
+    with Session(engine) as session:
+        statement = select(NrrSeason).where(NrrSeason.id == season_id)
+        nrr_season_to_delete = session.exec(statement).one()
+        farm_id = nrr_season_to_delete.farm_id
+
+        session.delete(nrr_season_to_delete)
+        session.commit()
+
+    return await non_return_rate_seasons_for_farm(farm_id=farm_id)
+
+
+@router.get("/cowpoke/nrr-live-for-farm/{farm_id}", response_class=HTMLResponse)
+async def non_return_rate_live_for_farm(farm_id: int):
+    """
+    The NRRs of the inseminations recorded on the farm so far, from the running totals.  Latest season first.
+    """
+    with Session(engine) as session:
+        farm_statement = select(Farm).where(Farm.id == farm_id)
+        farm = session.exec(farm_statement).one()
+
+        statement = (select(FarmNrrTotals).where(FarmNrrTotals.farm_id == farm_id)
+                                          .order_by(FarmNrrTotals.season_start_year.desc()))
+        all_farm_nrr_totals = session.exec(statement).all()
+
+        bull_codes = {bull.id: bull.bull_code for bull in session.exec(select(Bull)).all()}
+
+    today = datetime.date.today()
+    seasons = [
+        summarise_farm_nrr_totals(farm_nrr_totals=farm_nrr_totals, bull_codes=bull_codes, today=today)
+        for farm_nrr_totals in all_farm_nrr_totals
+    ]
+
+    context = {"farm": farm, "seasons": [season for season in seasons if season is not None]}
+    return templates.TemplateResponse(request={}, name="nrr_live.html", context=context)
@@ -0,0 +1,208 @@
+"""
+Per-farm store of Non Return Rate seasons, so that this season can be compared with earlier ones without
+uploading the earlier mating records again.
+
+Each season is an NrrSeason row (see 'models.py'), packed from the NrrSeasonRecord written by the analysis.
+The per-cow first insemination days and return bitmasks are packed arrays, a few bytes per cow, and the season
+index is rebuilt from them (without the mating records) whenever seasons are compared.
+"""
+import array
+import datetime
+import json
+import sys
+from decimal import Decimal
+
+from src.cowpoke.models import NrrSeason
+from src.cowpoke.non_return_rate.non_return_rate import (
+    NrrSeasonRecord,
+    build_nrr_season_index_from_record,
+    bull_counter_fields,
+    calculate_non_return_rate_for_window,
+    calculate_non_return_rate_from_index,
+)
+
+
+def pack_nrr_season(
+        farm_id: int, season_label: str, herd_size: int | None, season_record: NrrSeasonRecord, run_id: str
+) -> NrrSeason:
+    """
+    Raises ValueError if the season is too long to pack.  (Over 179 years.)
+    """
+    try:
+        first_insemination_days = array.array("H", season_record.first_insemination_days)
+    except OverflowError:
+        raise ValueError("The mating season is too long to keep")
+    return_bitmasks = array.array("B", season_record.return_bitmasks)
+
+    if sys.byteorder == "big":  # Stored little-endian, so that the database can be moved between machines.
+        first_insemination_days.byteswap()
+
+    return NrrSeason(
+        farm_id=farm_id,
+        season_label=season_label,
+        herd_size=herd_size,
+        season_start_date=season_record.season_start_date,
+        season_end_date=season_record.season_end_date,
+        total_inseminations=sum(counters[0] for counters in season_record.bull_counters.values()),
+        first_insemination_days=first_insemination_days.tobytes(),
+        return_bitmasks=return_bitmasks.tobytes(),
+        bull_counters=json.dumps({"fields": bull_counter_fields, "bulls": season_record.bull_counters}),
+        run_id=run_id,
+    )
+
+
+def unpack_nrr_season(nrr_season: NrrSeason) -> NrrSeasonRecord:
+    first_insemination_days = array.array("H")
+    first_insemination_days.frombytes(nrr_season.first_insemination_days)
+    if sys.byteorder == "big":
+        first_insemination_days.byteswap()
+
+    return_bitmasks = array.array("B")
+    return_bitmasks.frombytes(nrr_season.return_bitmasks)
+
+    bull_counters = json.loads(nrr_season.bull_counters)
+    if tuple(bull_counters["fields"]) != bull_counter_fields:
+        raise ValueError(f"Season {nrr_season.id} was saved with different bull counters")
+
+    return NrrSeasonRecord(
+        season_start_date=nrr_season.season_start_date,
+        season_end_date=nrr_season.season_end_date,
+        first_insemination_days=first_insemination_days.tolist(),
+        return_bitmasks=return_bitmasks.tolist(),
+        bull_counters={bull: tuple(x) for bull, x in bull_counters["bulls"].items()},
+    )
+
+
+def default_season_label(season_start_date: datetime.date) -> str:
+    return season_start_date.strftime("%b %Y")
+
+
+def compare_nrr_seasons(nrr_seasons: list[NrrSeason]) -> dict:
+    """
+    A row for each season, oldest first, with the change since the season before, and a league table of the bulls
+    used in any of the seasons.  Changes are in percentage points.
+    """
+    nrr_seasons = sorted(nrr_seasons, key=lambda x: x.season_start_date)
+    season_records = [unpack_nrr_season(nrr_season) for nrr_season in nrr_seasons]
+
+    season_rows = []
+    previous_row = None
+
+    for nrr_season, season_record in zip(nrr_seasons, season_records):
+        row = summarise_nrr_season(nrr_season=nrr_season, season_record=season_record)
+        for key in ("three_week_submission_pct", "six_weeks_nrr", "full_season_nrr"):
+            previous_pct = previous_row[key] if previous_row is not None else None
+            row[f"{key}_change"] = _format_change(current_pct=row[key], previous_pct=previous_pct)
+        season_rows.append(row)
+        previous_row = row
+
+    return {
+        "season_rows": [_format_season_row(row) for row in season_rows],
+        "bull_rows": compare_bulls(season_records=season_records),
+    }
+
+
+def summarise_nrr_season(nrr_season: NrrSeason, season_record: NrrSeasonRecord) -> dict:
+    season_index = build_nrr_season_index_from_record(season_record=season_record)
+
+    six_weeks_nrr = calculate_non_return_rate_for_window(season_index=season_index, window_days=42)
+    full_season_nrr = calculate_non_return_rate_from_index(
+        season_index=season_index,
+        start_date=season_record.season_start_date,
+        cut_off_date=season_record.season_end_date - datetime.timedelta(days=24),
+    )
+
+    total_cows_submitted = len(season_record.first_insemination_days)
+    three_week_cows = sum(1 for day in season_record.first_insemination_days if day < 21)
+
+    return {
+        "id": nrr_season.id,
+        "season_label": nrr_season.season_label,
+        "start_date": season_record.season_start_date.strftime("%d-%b-%y"),
+        "end_date": season_record.season_end_date.strftime("%d-%b-%y"),
+        "herd_size": nrr_season.herd_size if nrr_season.herd_size is not None else "",
+        "total_cows_submitted": total_cows_submitted,
+        "total_inseminations": nrr_season.total_inseminations,
+        "three_week_submission_pct": _percentage(three_week_cows, nrr_season.herd_size or 0),
+        "six_weeks_nrr": _non_return_rate(six_weeks_nrr["eligible_cows"], six_weeks_nrr["returned_cows"]),
+        "full_season_nrr": _non_return_rate(full_season_nrr["eligible_cows"], full_season_nrr["returned_cows"]),
+    }
+
+
+def compare_bulls(season_records: list[NrrSeasonRecord]) -> list[dict]:
+    """
+    Six week NRR of each bull in each season, with the change between the last two seasons the bull was used in.
+    Bulls used in the latest season first, then by name.
+    """
+    bull_names = sorted({bull for season_record in season_records for bull in season_record.bull_counters})
+
+    bull_rows = []
+
+    for bull_name in bull_names:
+        seasons = []
+        for season_record in season_records:
+            counters = season_record.bull_counters.get(bull_name)
+            if counters is None:
+                seasons.append({"inseminations": "", "eligible_cows": "", "non_return_rate": None})
+                continue
+            counters = dict(zip(bull_counter_fields, counters))
+            seasons.append({
+                "inseminations": counters["inseminations"],
+                "eligible_cows": counters["eligible_cows"],
+                "non_return_rate": _non_return_rate(counters["eligible_cows"], counters["returned_cows"]),
+            })
+
+        used_seasons = [season for season in seasons if season["inseminations"] != ""]
+        change = ""
+        if len(used_seasons) >= 2:
+            change = _format_change(
+                current_pct=used_seasons[-1]["non_return_rate"], previous_pct=used_seasons[-2]["non_return_rate"]
+            )
+
+        bull_rows.append({
+            "bull_name": bull_name,
+            "in_latest_season": seasons[-1]["inseminations"] != "",
+            "seasons": [
+                {
+                    **season,
+                    "non_return_rate": _format_pct(season["non_return_rate"]) if season["inseminations"] != "" else "",
+                }
+                for season in seasons
+            ],
+            "change": change,
+        })
+
+    bull_rows.sort(key=lambda x: not x["in_latest_season"])  # Stable, so still by name.
+
+    return bull_rows
+
+
+def _non_return_rate(eligible_cows: int, returned_cows: int) -> Decimal | None:
+    # Same formula as summarise_non_return_rate().
+    return _percentage(eligible_cows - returned_cows, eligible_cows)
+
+
+def _percentage(numerator: int, denominator: int) -> Decimal | None:
+    if denominator > 0:
+        return 100 * Decimal(numerator) / Decimal(denominator)
+    else:
+        return None
+
+
+def _format_change(current_pct: Decimal | None, previous_pct: Decimal | None) -> str:
+    if current_pct is None or previous_pct is None:
+        return ""
+    return f"{current_pct.quantize(Decimal('0.1')) - previous_pct.quantize(Decimal('0.1')):+.1f}"
+
+
+def _format_pct(pct: Decimal | None) -> str:
+    return f"{pct:.1f}" if pct is not None else "N/A"
+
+
+def _format_season_row(row: dict) -> dict:
+    return {
+        **row,
+        "three_week_submission_pct": _format_pct(row["three_week_submission_pct"]),
+        "six_weeks_nrr": _format_pct(row["six_weeks_nrr"]),
+        "full_season_nrr": _format_pct(row["full_season_nrr"]),
+    }
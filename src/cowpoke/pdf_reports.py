@@ -0,0 +1,20 @@
+"""
+PDF reports, generated by WeasyPrint from report HTML files.  Runs in the "pdf" worker pool (see 'worker_pools.py').
+"""
+from pathlib import Path
+
+from weasyprint import CSS, HTML
+
+from src.cowpoke.run_directories import write_file_atomically
+
+
+report_stylesheet_file_path = "static/report.css"
+
+
+def write_report_pdf(html_file_path: Path, pdf_file_path: Path):
+    with open(html_file_path) as f:
+        report_html = f.read()
+
+    pdf = HTML(string=report_html).write_pdf(stylesheets=[CSS(filename=report_stylesheet_file_path)])
+
+    write_file_atomically(file_path=pdf_file_path, content=pdf)
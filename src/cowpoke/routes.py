@@ -12,9 +12,14 @@ from src.cowpoke.models import Insemination
 from src.cowpoke.routes_bulls import router as bulls_router
 from src.cowpoke.routes_farms import router as farms_router
 from src.cowpoke.routes_jobs import router as jobs_router, calculate_return_status
+from src.cowpoke.routes_metrics import router as metrics_router
 from src.cowpoke.routes_technicians import router as technicians_router
+from src.cowpoke.non_return_rate.farm_totals import rebuild_farm_nrr_totals
 from src.cowpoke.non_return_rate.routes import router as non_return_rate_router
+from src.cowpoke.non_return_rate.routes_batch import router as non_return_rate_batch_router
+from src.cowpoke.non_return_rate.routes_seasons import router as non_return_rate_seasons_router
 from src.cowpoke.herd_improvement.routes import router as herd_improvement_router
+from src.cowpoke.worker_pools import shutdown_worker_pools
 
 
 templates = Jinja2Templates(directory=["cowpoke/templates", "templates"])
@@ -25,7 +30,10 @@ router.include_router(technicians_router)
 router.include_router(farms_router)
 router.include_router(jobs_router)
 router.include_router(non_return_rate_router)
+router.include_router(non_return_rate_batch_router)
+router.include_router(non_return_rate_seasons_router)
 router.include_router(herd_improvement_router)
+router.include_router(metrics_router)
 
 
 @router.on_event("startup")
@@ -33,6 +41,12 @@ def on_startup():
     print("Doing startup")
     models.SQLModel.metadata.create_all(engine)
     insert_example_data_if_db_empty()
+    rebuild_farm_nrr_totals_if_missing()
+
+
+@router.on_event("shutdown")
+def on_shutdown():
+    shutdown_worker_pools()
 
 
 @router.get("/cowpoke", response_class=HTMLResponse)
@@ -200,3 +214,17 @@ def insert_example_data_if_db_empty():
                 session.add(insemination)
 
             session.commit()
+
+
+def rebuild_farm_nrr_totals_if_missing():
+    """
+    Calculate the live NRR totals of the farms, if there are inseminations but no totals yet.
+    (Eg. the example data, or a database from before the totals were kept.)
+    """
+    with Session(engine) as session:
+        totals_exist = session.exec(select(models.FarmNrrTotals)).first()
+        inseminations_exist = session.exec(select(models.Insemination)).first()
+
+        if inseminations_exist and not totals_exist:
+            rebuild_farm_nrr_totals(session=session)
+            session.commit()
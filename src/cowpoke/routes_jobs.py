@@ -10,6 +10,7 @@ from sqlmodel import Session, select
 
 from src.cowpoke.database_connection import engine
 from src.cowpoke.models import Bull, Cow, Farm, Insemination, Job, PlannedInsemination, Technician
+from src.cowpoke.non_return_rate.farm_totals import calculate_cow_nrr_state, season_start_year, update_farm_nrr_totals
 
 
 templates = Jinja2Templates(directory=["cowpoke/templates", "templates"])
@@ -238,6 +239,12 @@ async def complete_planned_insemination(planned_insemination_id: int):
         statement = select(PlannedInsemination).where(PlannedInsemination.id == planned_insemination_id)
         planned_insemination = session.exec(statement).one()
 
+        job = session.get(Job, planned_insemination.job_id)
+        start_year = season_start_year(job_date=job.job_date)
+        cow_state_before = calculate_cow_nrr_state(
+            session=session, cow_id=planned_insemination.cow_id, start_year=start_year
+        )
+
         insemination = Insemination(
             job_id = planned_insemination.job_id,
             technician_id = planned_insemination.technician_id,
@@ -248,12 +255,47 @@ async def complete_planned_insemination(planned_insemination_id: int):
         )
         session.add(insemination)
         session.delete(planned_insemination)
+        session.flush()
+
+        update_farm_nrr_totals(
+            session=session,
+            farm_id=job.farm_id,
+            start_year=start_year,
+            cow_state_before=cow_state_before,
+            cow_state_after=calculate_cow_nrr_state(session=session, cow_id=insemination.cow_id, start_year=start_year),
+        )
         session.commit()
         session.refresh(insemination)
 
     return generate_inseminations(job_id=insemination.job_id)
 
 
+@router.delete("/cowpoke/delete-insemination/{insemination_id}", response_class=HTMLResponse)
+async def delete_insemination(insemination_id: int):
+    with Session(engine) as session:
+        statement = select(Insemination, Job).join(Job).where(Insemination.id == insemination_id)
+        insemination, job = session.exec(statement).one()
+        cow_id = insemination.cow_id
+        job_id = job.id
+
+        start_year = season_start_year(job_date=job.job_date)
+        cow_state_before = calculate_cow_nrr_state(session=session, cow_id=cow_id, start_year=start_year)
+
+        session.delete(insemination)
+        session.flush()
+
+        update_farm_nrr_totals(
+            session=session,
+            farm_id=job.farm_id,
+            start_year=start_year,
+            cow_state_before=cow_state_before,
+            cow_state_after=calculate_cow_nrr_state(session=session, cow_id=cow_id, start_year=start_year),
+        )
+        session.commit()
+
+    return generate_inseminations(job_id=job_id)
+
+
 @router.delete("/cowpoke/delete-planned-insemination/{planned_insemination_id}", response_class=HTMLResponse)
 async def delete_planned_insemination(planned_insemination_id: int):
     with Session(engine) as session:
@@ -0,0 +1,15 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from src.cowpoke.stage_timing import format_stage_metrics
+
+
+router = APIRouter()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Latency histograms of the analysis stages, for Prometheus.  (Of this web server process only.)
+    """
+    return PlainTextResponse(content=format_stage_metrics(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,274 @@
+"""
+Isolated working directories for analysis runs (Non Return Rate, Herd Improvement).
+
+Every run writes its uploaded input and all of its output files (charts, CSV, PDF, etc.) into its own directory
+under 'temp/cowpoke/runs'.  The directory name is the run ID, which is a hash of everything that determines the
+output (analysis name, uploaded file contents, form values).  So concurrent users, and several uvicorn workers
+sharing the same disk, never overwrite each other's files.
+
+A run is first written into a private staging directory, which is then renamed to the run directory in one step.
+If the run directory already exists (because identical inputs were uploaded before), the staging directory is
+discarded, because the existing run directory holds the same output.
+
+Old runs are garbage-collected by age, and then by total size, oldest first.  This walks every file of every run, so
+it is done when a run is published, but at most once every 'garbage_collection_interval_seconds' in each worker.
+
+The same mechanism caches analysis results: a cached result is a run directory, keyed by a hash of only the inputs
+that affect the calculations, which holds the result dict as JSON plus the output files.  A repeat upload copies the
+cached files into its own run directory instead of re-running the analysis.  Cached results are touched on every
+hit, so garbage collection removes the least recently used first.
+
+Where the run ID is already a hash of only those inputs (Herd Improvement), the run directory itself is the cache:
+its result dict is saved in it with save_run_results(), and a repeat upload is answered with load_run_results().
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+
+
+runs_dir = Path(__file__).parent.parent.joinpath("temp", "cowpoke", "runs")
+
+max_run_age_seconds = 24 * 60 * 60
+max_runs_total_bytes = 500 * 1024 * 1024
+max_staging_age_seconds = 60 * 60  # Staging directories left behind by crashed or killed workers.
+garbage_collection_interval_seconds = 60
+
+# time.monotonic() of this worker's last garbage collection.
+_last_garbage_collection: float | None = None
+
+staging_prefix = ".staging-"
+run_id_length = 32
+
+cached_results_file_name = "results.json"
+
+
+def calculate_run_id(*parts) -> str:
+    """
+    Hash of all the inputs of a run.  Each part is either 'bytes' or 'str'.
+    """
+    hasher = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        hasher.update(len(part).to_bytes(8, "little"))  # Length prefix, so that ("ab", "c") != ("a", "bc").
+        hasher.update(part)
+
+    return hasher.hexdigest()[:run_id_length]
+
+
+def run_directory(run_id: str) -> Path:
+    """
+    Directory of a published run.  Raises ValueError if 'run_id' is not a valid run ID.
+    (Run IDs arrive in URLs, so this also stops paths like '../..' from escaping the runs directory.)
+    """
+    if len(run_id) != run_id_length or any(char not in "0123456789abcdef" for char in run_id):
+        raise ValueError(f"Invalid run ID '{run_id}'")
+
+    return runs_dir.joinpath(run_id)
+
+
+def create_staging_directory(run_id: str) -> Path:
+    staging_dir = runs_dir.joinpath(f"{staging_prefix}{run_id}-{uuid.uuid4().hex}")
+    staging_dir.mkdir(parents=True)
+    return staging_dir
+
+
+def publish_run_directory(staging_dir: Path, run_id: str) -> Path:
+    """
+    Atomically move a completed staging directory to its run directory, then collect garbage if it is due.
+    """
+    run_dir = run_directory(run_id)
+
+    try:
+        staging_dir.rename(run_dir)
+    except OSError:  # Run directory already exists, with identical content.
+        discard_staging_directory(staging_dir)
+        touch_run_directory(run_dir)
+
+    collect_garbage_if_due()
+
+    return run_dir
+
+
+def discard_staging_directory(staging_dir: Path):
+    shutil.rmtree(staging_dir, ignore_errors=True)
+
+
+def touch_run_directory(run_dir: Path):
+    """
+    Mark a run as recently used, so that garbage collection removes it last.
+    """
+    try:
+        os.utime(run_dir)
+    except FileNotFoundError:  # Removed by garbage collection in another worker.
+        pass
+
+
+def collect_garbage_if_due():
+    """
+    Collect garbage, unless this worker has already done so in the last 'garbage_collection_interval_seconds'.
+    """
+    global _last_garbage_collection
+
+    now = time.monotonic()
+    if _last_garbage_collection is not None and now - _last_garbage_collection < garbage_collection_interval_seconds:
+        return
+
+    _last_garbage_collection = now
+    collect_garbage()
+
+
+def collect_garbage():
+    """
+    Remove runs older than 'max_run_age_seconds', then remove the least recently used runs until the total size of
+    the remaining runs is within 'max_runs_total_bytes'.
+    """
+    if not runs_dir.exists():
+        return
+
+    now = time.time()
+    runs = []
+
+    for entry in os.scandir(runs_dir):
+        if not entry.is_dir():
+            continue
+        try:
+            age = now - entry.stat().st_mtime
+        except FileNotFoundError:  # Removed by garbage collection in another worker.
+            continue
+
+        if entry.name.startswith(staging_prefix):
+            if age > max_staging_age_seconds:
+                shutil.rmtree(entry.path, ignore_errors=True)
+        elif age > max_run_age_seconds:
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            runs.append((age, entry.path, _directory_size(entry.path)))
+
+    runs.sort(key=lambda x: x[0], reverse=True)  # Oldest first.
+    total_bytes = sum(size for _, _, size in runs)
+
+    for age, path, size in runs:
+        if total_bytes <= max_runs_total_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total_bytes -= size
+
+
+def _directory_size(path: str) -> int:
+    total_bytes = 0
+    for dir_path, _, file_names in os.walk(path):
+        for file_name in file_names:
+            try:
+                total_bytes += os.path.getsize(os.path.join(dir_path, file_name))
+            except FileNotFoundError:
+                pass
+    return total_bytes
+
+
+def load_cached_results(
+        cache_key: str, run_dir: Path, file_names: tuple, optional_file_names: tuple = ()
+) -> dict | None:
+    """
+    Copy the cached output files into 'run_dir', and return the cached result dict.
+    Returns None if there is no cached result for 'cache_key'.
+    'optional_file_names' are files which may be added to the cache later (see add_file_to_cached_results).
+    """
+    cache_dir = run_directory(cache_key)
+
+    try:
+        with open(cache_dir.joinpath(cached_results_file_name)) as f:
+            results = json.load(f)
+        for file_name in file_names:
+            _link_or_copy_file(cache_dir.joinpath(file_name), run_dir.joinpath(file_name))
+    except FileNotFoundError:  # Not cached, or removed by garbage collection in the meantime.
+        for file_name in file_names:  # Don't leave links to a half-removed cache entry for the analysis to overwrite.
+            run_dir.joinpath(file_name).unlink(missing_ok=True)
+        return None
+
+    for file_name in optional_file_names:
+        try:
+            _link_or_copy_file(cache_dir.joinpath(file_name), run_dir.joinpath(file_name))
+        except FileNotFoundError:
+            pass
+
+    touch_run_directory(cache_dir)
+
+    return results
+
+
+def store_cached_results(cache_key: str, results: dict, run_dir: Path, file_names: tuple):
+    """
+    Cache the result dict (which must be JSON-serialisable) and the output files in 'run_dir'.
+    """
+    staging_dir = create_staging_directory(run_id=cache_key)
+
+    try:
+        for file_name in file_names:
+            _link_or_copy_file(run_dir.joinpath(file_name), staging_dir.joinpath(file_name))
+        with open(staging_dir.joinpath(cached_results_file_name), "w") as g:
+            json.dump(results, g)
+    except BaseException:
+        discard_staging_directory(staging_dir)
+        raise
+
+    publish_run_directory(staging_dir=staging_dir, run_id=cache_key)
+
+
+def add_file_to_cached_results(cache_key: str, file_path: Path):
+    """
+    Add an output file which was created after the results were cached (eg. a chart drawn in the background).
+    """
+    try:
+        _link_or_copy_file(file_path, run_directory(cache_key).joinpath(file_path.name))
+    except (FileExistsError, FileNotFoundError):  # Already added, or cache entry removed by garbage collection.
+        pass
+
+
+def save_run_results(run_dir: Path, results: dict):
+    """
+    Save the result dict of a run in its staging directory, to answer repeats of the run (see load_run_results).
+    Values that JSON can't store, eg. Decimals, are saved as strings.
+    """
+    with open(run_dir.joinpath(cached_results_file_name), "w") as g:
+        json.dump(results, g, default=str)
+
+
+def load_run_results(run_id: str) -> dict | None:
+    """
+    The result dict saved in a published run directory, or None if the run doesn't exist (or has no result dict).
+    The run is touched, so that garbage collection removes it last.
+    """
+    run_dir = run_directory(run_id)
+
+    try:
+        with open(run_dir.joinpath(cached_results_file_name)) as f:
+            results = json.load(f)
+    except FileNotFoundError:  # Not run before, or removed by garbage collection.
+        return None
+
+    touch_run_directory(run_dir)
+
+    return results
+
+
+def write_file_atomically(file_path: Path, content: bytes):
+    """
+    Write a file into an already published run directory, so that readers never see a partly written file.
+    """
+    temp_file_path = file_path.with_name(f"{staging_prefix}{uuid.uuid4().hex}-{file_path.name}")
+    temp_file_path.write_bytes(content)
+    os.replace(temp_file_path, file_path)
+
+
+def _link_or_copy_file(source_path: Path, target_path: Path):
+    try:
+        os.link(source_path, target_path)  # Output files are never modified once written, so can be shared.
+    except (FileExistsError, FileNotFoundError):
+        raise
+    except OSError:  # Eg. hard links not supported by the file system.
+        shutil.copyfile(source_path, target_path)
@@ -0,0 +1,153 @@
+"""
+Timing of the stages of the analysis pipelines (parsing, statistics, charts, spreadsheets, reports), so that a slow
+upload can be traced to the stage that is slow.
+
+A run of a pipeline is timed with timed_run(), and each stage inside it with stage_timer().  stage_timer() does
+nothing outside a timed run, so the calculation functions can also be used on their own.  When a run is finished,
+record_stage_timings() adds its stages to the latency histograms served at /metrics (see 'routes_metrics.py'), and
+logs them if COWPOKE_LOG_STAGE_TIMINGS is set.
+
+Runs in a worker pool are timed with call_with_stage_timings(), which sends the timings back with the result, to
+be recorded in the web server process.  Each web server process has its own histograms.
+"""
+import contextlib
+import contextvars
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+
+
+logger = logging.getLogger(__name__)
+
+log_stage_timings = os.environ.get("COWPOKE_LOG_STAGE_TIMINGS", "") not in ("", "0")
+
+# Upper bounds of the histogram buckets, in seconds.  (Prometheus style, so each bucket includes the ones below it.)
+stage_histogram_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+@dataclass
+class StageTimings:
+    """
+    The stages of one run of a pipeline, in the order they finished, as (stage, seconds) tuples.
+    """
+    pipeline: str
+    stages: list[tuple[str, float]] = field(default_factory=list)
+    total_seconds: float = 0.0
+
+
+@dataclass
+class StageHistogram:
+    bucket_counts: list[int] = field(default_factory=lambda: [0] * len(stage_histogram_buckets))
+    count: int = 0
+    sum_seconds: float = 0.0
+
+    def observe(self, seconds: float):
+        for k, upper_bound in enumerate(stage_histogram_buckets):
+            if seconds <= upper_bound:
+                self.bucket_counts[k] += 1
+                break
+        self.count += 1
+        self.sum_seconds += seconds
+
+
+_active_stage_timings: contextvars.ContextVar[StageTimings | None] = contextvars.ContextVar(
+    "active_stage_timings", default=None
+)
+
+# Keyed by (pipeline, stage), in order of first use.
+stage_histograms: dict[tuple[str, str], StageHistogram] = {}
+_stage_histograms_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def timed_run(pipeline: str):
+    """
+    Time the stages run inside the block.  Yields the StageTimings, which are complete when the block ends.
+    """
+    timings = StageTimings(pipeline=pipeline)
+    token = _active_stage_timings.set(timings)
+    start = time.perf_counter()
+    try:
+        yield timings
+    finally:
+        timings.total_seconds = time.perf_counter() - start
+        _active_stage_timings.reset(token)
+
+
+@contextlib.contextmanager
+def stage_timer(stage: str):
+    """
+    Time a stage of the run being timed.  (Only stages that finish without an exception are kept.)
+    """
+    timings = _active_stage_timings.get()
+    if timings is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    yield
+    timings.stages.append((stage, time.perf_counter() - start))
+
+
+def call_with_stage_timings(pipeline: str, function, *args, **kwargs) -> tuple:
+    """
+    Run 'function' as a timed run.  Returns (result, StageTimings).  A module-level function, for the worker pools.
+    """
+    with timed_run(pipeline) as timings:
+        result = function(*args, **kwargs)
+    return result, timings
+
+
+def record_stage_timings(timings: StageTimings, run_id: str = ""):
+    """
+    Add a finished run to the histograms.  The whole run is recorded as the stage "total".
+    """
+    with _stage_histograms_lock:
+        for stage, seconds in timings.stages + [("total", timings.total_seconds)]:
+            stage_histograms.setdefault((timings.pipeline, stage), StageHistogram()).observe(seconds)
+
+    if log_stage_timings:
+        breakdown = ", ".join(f"{stage} {seconds:.3f}s" for stage, seconds in timings.stages)
+        logger.info(f"{timings.pipeline} {run_id}: {breakdown}; total {timings.total_seconds:.3f}s")
+
+
+@contextlib.contextmanager
+def recorded_stage(pipeline: str, stage: str, run_id: str = ""):
+    """
+    Time and record a stage outside a timed run, eg. waiting for a chart or PDF from a worker pool.
+    (Not added to the pipeline's "total".)
+    """
+    start = time.perf_counter()
+    yield
+    seconds = time.perf_counter() - start
+
+    with _stage_histograms_lock:
+        stage_histograms.setdefault((pipeline, stage), StageHistogram()).observe(seconds)
+
+    if log_stage_timings:
+        logger.info(f"{pipeline} {run_id}: {stage} {seconds:.3f}s")
+
+
+def format_stage_metrics() -> str:
+    """
+    The histograms in the Prometheus text format.
+    """
+    lines = [
+        "# HELP cowpoke_stage_duration_seconds Duration of each stage of the analysis pipelines.",
+        "# TYPE cowpoke_stage_duration_seconds histogram",
+    ]
+
+    with _stage_histograms_lock:
+        for (pipeline, stage), histogram in stage_histograms.items():
+            labels = f'pipeline="{pipeline}",stage="{stage}"'
+            cumulative_count = 0
+            for upper_bound, bucket_count in zip(stage_histogram_buckets, histogram.bucket_counts):
+                cumulative_count += bucket_count
+                lines.append(f'cowpoke_stage_duration_seconds_bucket{{{labels},le="{upper_bound}"}} {cumulative_count}')
+            lines.append(f'cowpoke_stage_duration_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+            lines.append(f"cowpoke_stage_duration_seconds_sum{{{labels}}} {histogram.sum_seconds}")
+            lines.append(f"cowpoke_stage_duration_seconds_count{{{labels}}} {histogram.count}")
+
+    return "\n".join(lines) + "\n"
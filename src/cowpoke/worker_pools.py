@@ -0,0 +1,43 @@
+"""
+Pools of worker processes for slow, CPU-bound work (calculations, charts, PDFs), so it runs off the event loop.
+
+Functions run in a pool must be module-level functions (so they can be pickled), which take and return plain data.
+Chart functions use their own matplotlib Figure rather than the pyplot state machine, and return SVG bytes.
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+worker_pool_sizes = {
+    "analysis": int(os.environ.get("COWPOKE_ANALYSIS_WORKERS", os.cpu_count() or 1)),
+    "charts": int(os.environ.get("COWPOKE_CHART_WORKERS", os.cpu_count() or 1)),
+    "pdf": int(os.environ.get("COWPOKE_PDF_WORKERS", 1)),  # WeasyPrint needs a lot of memory per report.
+}
+
+_worker_pools: dict[str, ProcessPoolExecutor] = {}
+
+
+def get_worker_pool(pool_name: str) -> ProcessPoolExecutor:
+    """
+    Pools are started on first use, so that importing the app doesn't start any processes.
+    """
+    if pool_name not in _worker_pools:
+        _worker_pools[pool_name] = ProcessPoolExecutor(
+            max_workers=worker_pool_sizes[pool_name],
+            mp_context=multiprocessing.get_context("spawn"),  # Forking a process running an event loop is unsafe.
+        )
+
+    return _worker_pools[pool_name]
+
+
+async def run_in_worker_pool(pool_name: str, function, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_worker_pool(pool_name), function, *args)
+
+
+def shutdown_worker_pools():
+    while _worker_pools:
+        _, pool = _worker_pools.popitem()
+        pool.shutdown(cancel_futures=True)